@@ -0,0 +1,175 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .models import UserActivityLog
+
+logger = logging.getLogger(__name__)
+
+
+# In-process activity log pipeline. Views only enqueue the events, a background thread writes them
+# with bulk_create once a batch is full or the flush interval has passed. Entries keep the time they
+# were queued, so they show up in the log a little later (at most the flush interval) but in order.
+class ActivityLogWriter:
+    def __init__(self, batch_size, flush_interval, queue_size, put_timeout):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        # The counters are bumped from request threads and the writer thread
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'flushes': 0,
+            'write_errors': 0,
+            # Backpressure: puts that found the queue full, and entries written inline because it stayed full
+            'queue_full': 0,
+            'written_inline': 0,
+            'queue_high_water': 0,
+        }
+
+    def _count(self, **increments):
+        with self._metrics_lock:
+            for name, value in increments.items():
+                self.metrics[name] += value
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            # A forked worker inherits the queue but not the thread, start over in the child
+            if self._pid != os.getpid():
+                self._reset()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+                self._thread.start()
+
+    def log(self, user_id, activity):
+        entry = UserActivityLog(user_id=user_id, activity=activity, created_at=timezone.now())
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._count(queue_full=1)
+            try:
+                self._queue.put(entry, timeout=self.put_timeout)
+            except queue.Full:
+                # The writer cannot keep up, write this one in the request rather than losing it
+                self._count(written_inline=1)
+                UserActivityLog.objects.bulk_create([entry])
+                return
+        depth = self._queue.qsize()
+        with self._metrics_lock:
+            self.metrics['enqueued'] += 1
+            self.metrics['queue_high_water'] = max(self.metrics['queue_high_water'], depth)
+
+    def _collect(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        close_old_connections()
+        try:
+            UserActivityLog.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            self._count(write_errors=len(batch))
+            logger.exception("Failed to write %d activity log entries", len(batch))
+        else:
+            self._count(written=len(batch), flushes=1)
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._collect()
+                if batch:
+                    self._write(batch)
+                    # Not kept open until the next batch, the writer may sit idle for a long time
+                    connection.close()
+                elif self._stopping.is_set():
+                    break
+        finally:
+            connection.close()
+
+    def flush(self):
+        # Drains whatever is queued from the calling thread
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        return dict(metrics, queue_depth=self._queue.qsize(), queue_capacity=self.queue_size)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ActivityLogWriter(
+                    batch_size=settings.ACTIVITY_LOG_BATCH_SIZE,
+                    flush_interval=settings.ACTIVITY_LOG_FLUSH_INTERVAL,
+                    queue_size=settings.ACTIVITY_LOG_QUEUE_SIZE,
+                    put_timeout=settings.ACTIVITY_LOG_PUT_TIMEOUT,
+                )
+                # Flush what is left when the worker shuts down
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def log_activity(user_id, activity):
+    if not settings.ACTIVITY_LOG_ASYNC:
+        UserActivityLog.objects.create(user_id=user_id, activity=activity)
+        return
+    get_writer().log(user_id, activity)
+
+
+def log_activities(entries):
+    # Logs several (user_id, activity) entries at once, a single insert when writing synchronously
+    if not settings.ACTIVITY_LOG_ASYNC:
+        UserActivityLog.objects.bulk_create([UserActivityLog(user_id=user_id, activity=activity) for user_id, activity in entries])
+        return
+    writer = get_writer()
+    for user_id, activity in entries:
+        writer.log(user_id, activity)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SocialConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'social'
+
+    def ready(self):
+        # Register the signal handlers (metrics instruments every new database connection)
+        from . import metrics, signals  # noqa: F401
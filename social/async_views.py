@@ -0,0 +1,235 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, PermissionDenied, Throttled
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .authentication import StatelessJWTAuthentication
+from .blocks import aget_block_set
+from .caching import aget_cached, aset_cached, friends_list_namespace, pending_requests_namespace, query_key
+from .models import *
+from .pagination import KeysetPagination, SearchKeysetPagination, get_paginator
+from .partitions import retention_cutoff
+from .permissions import RoleBasedPermission
+from .renderers import dumps
+from . import views
+
+# Native async versions of the read endpoints, served when the app runs under ASGI (ASYNC_READ_VIEWS).
+# They use the async ORM and the cache's async API, so a slow client holds a coroutine and not a thread.
+# Same URLs, responses and rules as the views in views.py; writes stay on the synchronous views.
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    # Rendered like the synchronous views (orjson when installed, datetimes keep their microseconds)
+    return HttpResponse(dumps(data), status=status_code, content_type='application/json', headers=headers)
+
+
+async def apaginate(paginator, queryset, request):
+    # Async counterpart of paginator.paginate_queryset() for the keyset and the page number paginators
+    if isinstance(paginator, KeysetPagination):
+        return paginator.paginate_rows([row async for row in paginator.filter_queryset(queryset, request)])
+
+    page_size = paginator.get_page_size(request)
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    django_paginator.count = await queryset.acount()
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        paginator.page = django_paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    paginator.page.object_list = [row async for row in paginator.page.object_list]
+    paginator.request = request
+    return paginator.page.object_list
+
+
+# Authentication, permissions and throttling of DRF's APIView, done with async calls.
+class AsyncAPIView(View):
+    http_method_names = ['get', 'options']
+    permission_classes = [IsAuthenticated, RoleBasedPermission]
+    throttle_cost = 1
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(request)
+        try:
+            await self.initial(request)
+            response = await self.get(request, *args, **kwargs)
+        except APIException as exc:
+            headers = {'Retry-After': str(exc.wait)} if getattr(exc, 'wait', None) else None
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            response = json_response(detail, exc.status_code, headers)
+        return response
+
+    async def initial(self, request):
+        authenticator = StatelessJWTAuthentication()
+        result = await authenticator.aauthenticate(request)
+        request.user = result[0] if result else AnonymousUser()
+
+        for permission in [permission() for permission in self.permission_classes]:
+            if not permission.has_permission(request, self):
+                if not request.user.is_authenticated:
+                    raise NotAuthenticated()
+                raise PermissionDenied()
+
+        for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+            throttle = throttle_class()
+            if not await throttle.aallow_request(request, self):
+                raise Throttled(await throttle.await_time())
+
+    async def options(self, request, *args, **kwargs):
+        return json_response({})
+
+
+# This api is for searching via email or named.
+class UserSearchView(AsyncAPIView):
+    throttle_cost = 5
+
+    async def get(self, request):
+        search_keyword = request.query_params.get('q', '')
+        block_set = await aget_block_set(request.user.id)
+
+        if request.query_params.get('mode') == 'prefix':
+            return await self.prefix_search(search_keyword, block_set)
+
+        if search_keyword:
+            user_by_email = await CustomUser.objects.filter(email__iexact=search_keyword).values('id', 'email', 'first_name', 'last_name').afirst()
+            if user_by_email and user_by_email['id'] not in block_set:
+                return json_response(user_by_email)
+
+            users_by_name = CustomUser.objects.search(search_keyword)
+            if block_set:
+                users_by_name = users_by_name.exclude(pk__in=block_set.excluded_ids())
+
+            paginator = get_paginator(request, SearchKeysetPagination)
+            paginated_users = await apaginate(paginator, users_by_name.values('id', 'email', 'first_name', 'rank'), request)
+            if paginated_users:
+                user_list = [{
+                    'id': user['id'],
+                    'email': user['email'],
+                    'name': user['first_name']
+                } for user in paginated_users]
+                return json_response(paginator.get_paginated_response(user_list).data)
+
+        return json_response({'message': 'No users found'}, status.HTTP_404_NOT_FOUND)
+
+    async def prefix_search(self, prefix, block_set):
+        prefix = prefix.strip().lower()
+        if len(prefix) < settings.TYPEAHEAD_MIN_LENGTH:
+            return json_response({"error": f"Please type at least {settings.TYPEAHEAD_MIN_LENGTH} characters."}, status.HTTP_400_BAD_REQUEST)
+
+        cache_key = hashlib.sha1(prefix.encode()).hexdigest()
+        results = await aget_cached('typeahead', cache_key)
+        if results is None:
+            results = [
+                user async for user in CustomUser.objects.filter(
+                    Q(email__istartswith=prefix) | Q(first_name__istartswith=prefix) | Q(last_name__istartswith=prefix)
+                ).order_by('email').values('id', 'email', 'first_name', 'last_name')[:settings.TYPEAHEAD_LIMIT * 2]
+            ]
+            await aset_cached('typeahead', cache_key, results, settings.TYPEAHEAD_CACHE_TIMEOUT)
+
+        results = [user for user in results if user['id'] not in block_set][:settings.TYPEAHEAD_LIMIT]
+        return json_response({"results": results})
+
+
+# This api is for showing the friend list.
+class FriendsListAPI(AsyncAPIView):
+    async def get(self, request):
+        user = request.user
+        friends_list = await aget_cached(friends_list_namespace(user.id), 'friends')
+
+        if friends_list is None:
+            friendships = Friendship.objects.filter(user_id=user.id)
+            block_set = await aget_block_set(user.id)
+            if block_set:
+                friendships = friendships.exclude(friend_id__in=block_set.excluded_ids())
+            friends_list = [email async for email in friendships.values_list('friend__email', flat=True)]
+            await aset_cached(friends_list_namespace(user.id), 'friends', friends_list, settings.CACHE_TIMEOUT)
+
+        return json_response({"message": "Successfully fetched", "friends": friends_list})
+
+
+# This api is for showing the pending friend list.
+class PendingFriendRequestsAPI(AsyncAPIView):
+    async def get(self, request):
+        user = request.user
+
+        # Shares the page cache with the synchronous view
+        namespace = pending_requests_namespace(user.id)
+        cache_key = query_key(request)
+        cached_page = await aget_cached(namespace, cache_key)
+        if cached_page is not None:
+            return json_response(cached_page)
+
+        pending_requests = FriendRequest.objects.filter(receiver_id=user.id, status='pending').order_by('-created_at').values(
+            'id', 'created_at', 'sender_id', 'status'
+        )
+        paginator = get_paginator(request)
+        paginated_requests = await apaginate(paginator, pending_requests, request)
+
+        response_data = [
+            {
+                "request_id": friend_request['id'],
+                "created_at": friend_request['created_at'],
+                "sender_id": friend_request['sender_id'],
+                "status": friend_request['status']
+            }
+            for friend_request in paginated_requests
+        ]
+        data = paginator.get_paginated_response(response_data).data
+        await aset_cached(namespace, cache_key, data, settings.CACHE_TIMEOUT)
+        return json_response(data)
+
+
+# This api is for showing the user activity.
+class UserActivityLogAPI(AsyncAPIView):
+    # The date range parsing is shared with the synchronous view
+    filter_date_range = views.UserActivityLogAPI.filter_date_range
+    parse_bound = views.UserActivityLogAPI.parse_bound
+
+    async def get(self, request):
+        user = request.user
+        activity_logs = UserActivityLog.objects.filter(user_id=user.id, created_at__gte=retention_cutoff())
+        try:
+            activity_logs = self.filter_date_range(activity_logs, request)
+        except ValueError as error:
+            return json_response({"error": str(error)}, status.HTTP_400_BAD_REQUEST)
+
+        if request.query_params.get('export') == 'jsonl':
+            return self.export_jsonl(activity_logs, user)
+
+        paginator = get_paginator(request)
+        paginated_logs = await apaginate(paginator, activity_logs.order_by('-created_at', '-id').values('id', 'activity', 'created_at'), request)
+        user_email = user.email
+        activity_data = [
+            {
+                "activity": log['activity'],
+                "created_at": log['created_at'],
+                "user_email": user_email
+            }
+            for log in paginated_logs
+        ]
+        return json_response(paginator.get_paginated_response(activity_data).data)
+
+    def export_jsonl(self, activity_logs, user):
+        # An async generator over a chunked server-side cursor, the connection is not held by a thread
+        rows = activity_logs.order_by('-created_at', '-id').values_list('activity', 'created_at').aiterator(chunk_size=2000)
+
+        async def lines():
+            async for activity, created_at in rows:
+                yield json.dumps({
+                    "activity": activity,
+                    "created_at": created_at.isoformat(),
+                    "user_email": user.email
+                }) + "\n"
+
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="user-activity.jsonl"'
+        return response
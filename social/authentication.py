@@ -0,0 +1,132 @@
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# Stateless JWT authentication. The access token carries the claims the permission checks need
+# (role, is_active, email), so authenticating a request does not query the database. The full user
+# record is only loaded when a view reads another attribute, and then from a short-lived cache.
+# When a user is saved, tokens issued before that fall back to loading the user, so a role change
+# or a deactivation takes effect right away and not only when the token expires.
+# That marker lives in the cache, so the token-only path needs a cache shared by every worker
+# (settings.CACHE_SHARED). With a per-process cache the user is always loaded the usual way.
+
+CLAIMS = ('role', 'is_active', 'email')
+# What the cache keeps of the user behind a token, the password hash and the search vector stay in the database
+CACHED_USER_FIELDS = ('email', 'first_name', 'last_name', 'role', 'is_active', 'is_staff', 'is_superuser')
+# Saves of these make the tokens issued before them load the user again
+AUTH_FIELDS = ('email', 'password', 'role', 'is_active', 'is_staff', 'is_superuser')
+
+
+def user_cache_key(user_id):
+    return f"auth_user:{user_id}"
+
+
+def user_changed_key(user_id):
+    return f"auth_changed:{user_id}"
+
+
+def get_cached_user(user_id):
+    UserModel = get_user_model()
+    values = cache.get(user_cache_key(user_id))
+    if values is None:
+        values = UserModel.objects.values('id', *CACHED_USER_FIELDS).get(pk=user_id)
+        cache.set(user_cache_key(user_id), values, settings.AUTH_USER_CACHE_TIMEOUT)
+    # The other fields are deferred, read from the database on access and left alone by save().
+    # from_db takes the values in the order of the model's fields.
+    field_names = [field.attname for field in UserModel._meta.concrete_fields if field.attname in values]
+    return UserModel.from_db(UserModel.objects.db, field_names, [values[name] for name in field_names])
+
+
+def forget_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def user_changed(user_id):
+    # Rounded up, a token issued in the same second as the change is treated as stale
+    lifetime = settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds()
+    cache.set(user_changed_key(user_id), math.ceil(time.time()), lifetime)
+    forget_cached_user(user_id)
+
+
+# Refresh token with the user's claims, they are copied to every access token made from it.
+class ClaimsRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim in CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
+
+
+# Lightweight request.user built from the token claims, the rest of the user is hydrated on demand.
+class ClaimsUser(TokenUser):
+    @cached_property
+    def role(self):
+        return self.token['role']
+
+    @cached_property
+    def is_active(self):
+        return self.token['is_active']
+
+    @cached_property
+    def email(self):
+        return self.token['email']
+
+    @cached_property
+    def user(self):
+        return get_cached_user(self.id)
+
+    def __str__(self):
+        return self.email
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.user, attr)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    def claims_user(self, validated_token, changed_at):
+        # The token-only user, or None when the user has to be loaded from the database
+        if not settings.CACHE_SHARED:
+            # A change marker in a per-process cache would only revoke the token in one worker
+            return None
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None or any(claim not in validated_token for claim in CLAIMS):
+            # Tokens issued without the claims are served the usual way
+            return None
+        if changed_at is not None and validated_token.get('iat', 0) < changed_at:
+            # The user changed after this token was issued, its claims may be out of date
+            return None
+        if not validated_token['is_active']:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return ClaimsUser(validated_token)
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        changed_at = cache.get(user_changed_key(user_id)) if user_id is not None and settings.CACHE_SHARED else None
+        return self.claims_user(validated_token, changed_at) or super().get_user(validated_token)
+
+    async def aauthenticate(self, request):
+        # Async variant of authenticate() for the async views
+        header = self.get_header(request)
+        raw_token = self.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        changed_at = await cache.aget(user_changed_key(user_id)) if user_id is not None and settings.CACHE_SHARED else None
+        user = self.claims_user(validated_token, changed_at)
+        if user is None:
+            user = await sync_to_async(super().get_user)(validated_token)
+        return user, validated_token
@@ -0,0 +1,74 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.utils.crypto import get_random_string
+
+# Login backend with a fast path for unknown emails.
+# Django's ModelBackend hashes the password even when the user does not exist, so that the response
+# time does not reveal which emails are registered. Under credential stuffing that is a full hash per
+# attempt for nothing. Here unknown emails are remembered in a negative cache and, instead of hashing,
+# the request sleeps for the time a real password check takes (a moving average of the measured checks),
+# so the timing stays the same but no CPU is spent.
+
+_hash_time_lock = threading.Lock()
+_hash_time = None
+
+HASH_TIME_WEIGHT = 0.1
+
+
+def negative_cache_key(email):
+    # The exact email, get_by_natural_key is case-sensitive and another capitalisation may be a real account
+    return f"login_unknown:{hashlib.sha1(email.encode()).hexdigest()}"
+
+
+def forget_unknown_email(email):
+    # Called when an account is created with this email
+    cache.delete(negative_cache_key(email))
+
+
+def record_hash_time(seconds):
+    global _hash_time
+    with _hash_time_lock:
+        _hash_time = seconds if _hash_time is None else (1 - HASH_TIME_WEIGHT) * _hash_time + HASH_TIME_WEIGHT * seconds
+
+
+def expected_hash_time():
+    if _hash_time is None:
+        # Nothing measured yet in this process, time one hash with the preferred hasher
+        start = time.perf_counter()
+        make_password(get_random_string(12))
+        record_hash_time(time.perf_counter() - start)
+    return _hash_time
+
+
+class EmailBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        email = username or kwargs.get(UserModel.USERNAME_FIELD)
+        if email is None or password is None:
+            return None
+
+        if cache.get(negative_cache_key(email)):
+            time.sleep(expected_hash_time())
+            return None
+
+        try:
+            user = UserModel._default_manager.get_by_natural_key(email)
+        except UserModel.DoesNotExist:
+            cache.set(negative_cache_key(email), True, settings.LOGIN_NEGATIVE_CACHE_TIMEOUT)
+            time.sleep(expected_hash_time())
+            return None
+
+        # check_password also rehashes the password when the preferred hasher or its work factor changed
+        start = time.perf_counter()
+        valid = user.check_password(password)
+        record_hash_time(time.perf_counter() - start)
+        if valid and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,80 @@
+import math
+import random
+import string
+import time
+
+
+# Helpers shared by the benchmark management commands.
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(samples):
+    # Latency samples are in milliseconds
+    return {
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples), 3) if samples else 0.0,
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+    }
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def random_name(rng=random, length=None):
+    length = length or rng.randint(4, 9)
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+# Users made by generate_social_graph, bench_endpoints replays the API as them
+GRAPH_EMAIL_DOMAIN = 'bench-graph.invalid'
+
+
+def graph_email(index):
+    return f"user{index}@{GRAPH_EMAIL_DOMAIN}"
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Counts the statements run on every database alias of the current thread while it is active.
+class QueryCounter:
+    def __init__(self, connections):
+        self.connections = connections
+        self.count = 0
+        self._wrappers = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        for alias in self.connections:
+            wrapper = self.connections[alias].execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._wrappers:
+            self._wrappers.pop().__exit__(*exc_info)
@@ -0,0 +1,91 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models import Q
+
+from .caching import aget_cached, aset_cached, blocks_namespace, get_cached, invalidate, set_cached
+from .models import Block
+
+
+# Both directions of a user's blocks as sorted int arrays: the users they blocked and the users who
+# blocked them. Membership is a binary search, so relationship checks need no query once it is loaded.
+# They are cached only when the cache is shared by all workers (settings.CACHE_SHARED), a block in one
+# worker could not invalidate the copies of the others. With a per-process cache every request loads them.
+class BlockSet:
+    __slots__ = ('blocking', 'blocked_by')
+
+    def __init__(self, blocking=(), blocked_by=()):
+        self.blocking = array('q', sorted(blocking))
+        self.blocked_by = array('q', sorted(blocked_by))
+
+    @staticmethod
+    def _contains(values, user_id):
+        index = bisect_left(values, user_id)
+        return index < len(values) and values[index] == user_id
+
+    def has_blocked(self, user_id):
+        return self._contains(self.blocking, user_id)
+
+    def is_blocked_by(self, user_id):
+        return self._contains(self.blocked_by, user_id)
+
+    def __contains__(self, user_id):
+        # True when either side blocked the other
+        return self.has_blocked(user_id) or self.is_blocked_by(user_id)
+
+    def excluded_ids(self):
+        # Everyone hidden from this user in either direction, used to filter search and friend lists
+        return sorted(set(self.blocking).union(self.blocked_by))
+
+    def __len__(self):
+        return len(self.blocking) + len(self.blocked_by)
+
+
+def load_block_set(user_id):
+    rows = Block.objects.filter(Q(blocker_id=user_id) | Q(blocked_id=user_id)).values_list('blocker_id', 'blocked_id')
+    blocking = []
+    blocked_by = []
+    for blocker_id, blocked_id in rows:
+        if blocker_id == user_id:
+            blocking.append(blocked_id)
+        else:
+            blocked_by.append(blocker_id)
+    return BlockSet(blocking, blocked_by)
+
+
+def get_block_set(user_id):
+    if not settings.CACHE_SHARED:
+        return load_block_set(user_id)
+    block_set = get_cached(blocks_namespace(user_id), 'set')
+    if block_set is None:
+        block_set = load_block_set(user_id)
+        set_cached(blocks_namespace(user_id), 'set', block_set, settings.BLOCK_CACHE_TIMEOUT)
+    return block_set
+
+
+async def aload_block_set(user_id):
+    blocking = []
+    blocked_by = []
+    async for blocker_id, blocked_id in Block.objects.filter(
+        Q(blocker_id=user_id) | Q(blocked_id=user_id)
+    ).values_list('blocker_id', 'blocked_id'):
+        if blocker_id == user_id:
+            blocking.append(blocked_id)
+        else:
+            blocked_by.append(blocker_id)
+    return BlockSet(blocking, blocked_by)
+
+
+async def aget_block_set(user_id):
+    if not settings.CACHE_SHARED:
+        return await aload_block_set(user_id)
+    block_set = await aget_cached(blocks_namespace(user_id), 'set')
+    if block_set is None:
+        block_set = await aload_block_set(user_id)
+        await aset_cached(blocks_namespace(user_id), 'set', block_set, settings.BLOCK_CACHE_TIMEOUT)
+    return block_set
+
+
+def invalidate_block_sets(*user_ids):
+    invalidate(*[blocks_namespace(user_id) for user_id in user_ids])
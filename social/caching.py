@@ -0,0 +1,113 @@
+import hashlib
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .metrics import record_cache
+
+# Namespaced, versioned cache keys on top of the default cache.
+# Every namespace has a version token stored in the cache itself and each key is built with it,
+# so invalidating a namespace is one write that reaches every worker sharing the cache backend.
+
+_MISSING = object()
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def friends_list_namespace(user_id):
+    return f"friends_list:{user_id}"
+
+
+def pending_requests_namespace(user_id):
+    return f"pending_requests:{user_id}"
+
+
+def blocks_namespace(user_id):
+    return f"blocks:{user_id}"
+
+
+def query_key(request):
+    # Stable key for the query parameters of a request (page, page_size, ...)
+    return hashlib.sha1(request.GET.urlencode().encode()).hexdigest()
+
+
+def _version_key(namespace):
+    return f"nsv:{namespace}"
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+    record_cache(outcome == 'hits')
+
+
+def namespace_version(namespace):
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        version = _new_version()
+        # Another worker may have created the version first, in that case use theirs
+        if not cache.add(_version_key(namespace), version, None):
+            version = cache.get(_version_key(namespace), version)
+    return version
+
+
+def make_key(namespace, key):
+    return f"{namespace}:{namespace_version(namespace)}:{key}"
+
+
+def get_cached(namespace, key, default=None):
+    value = cache.get(make_key(namespace, key), _MISSING)
+    if value is _MISSING:
+        _record('misses')
+        return default
+    _record('hits')
+    return value
+
+
+def set_cached(namespace, key, value, timeout=DEFAULT_TIMEOUT):
+    cache.set(make_key(namespace, key), value, timeout)
+
+
+# Async variants for the async views, through the cache's async API (aget, aadd, aset)
+async def anamespace_version(namespace):
+    version = await cache.aget(_version_key(namespace))
+    if version is None:
+        version = _new_version()
+        if not await cache.aadd(_version_key(namespace), version, None):
+            version = await cache.aget(_version_key(namespace), version)
+    return version
+
+
+async def amake_key(namespace, key):
+    return f"{namespace}:{await anamespace_version(namespace)}:{key}"
+
+
+async def aget_cached(namespace, key, default=None):
+    value = await cache.aget(await amake_key(namespace, key), _MISSING)
+    if value is _MISSING:
+        _record('misses')
+        return default
+    _record('hits')
+    return value
+
+
+async def aset_cached(namespace, key, value, timeout=DEFAULT_TIMEOUT):
+    await cache.aset(await amake_key(namespace, key), value, timeout)
+
+
+def invalidate(*namespaces):
+    # Replacing the version tokens orphans every key of these namespaces, the old entries simply expire
+    if namespaces:
+        cache.set_many({_version_key(namespace): _new_version() for namespace in namespaces}, None)
+
+
+def cache_stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -1,4 +1,7 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import models
+from django.db.models.functions import Cast
 
 # Create our custom manager for the custom user model.
 class CustomUserManager(BaseUserManager):
@@ -20,4 +23,43 @@ class CustomUserManager(BaseUserManager):
         if extra_fields.get('is_superuser') is not True:
             raise ValueError('Superuser must have is_superuser=True.')
 
-        return self.create_user(email, password, **extra_fields)
\ No newline at end of file
+        return self.create_user(email, password, **extra_fields)
+
+    # Recomputes the stored search vector of the matching users with a single UPDATE
+    def update_search_vectors(self, **filters):
+        return self.filter(**filters).update(search_vector=SearchVector(*self.model.SEARCH_VECTOR_FIELDS))
+
+    # Full-text search on the stored vector, best match first. The rank is cast to numeric so that
+    # a keyset cursor holding it compares exactly with the rows of the next page.
+    def search(self, keyword):
+        search_query = SearchQuery(keyword)
+        return self.filter(search_vector=search_query).annotate(
+            rank=Cast(SearchRank(models.F('search_vector'), search_query), models.DecimalField(max_digits=20, decimal_places=10))
+        ).order_by('-rank', 'id')
+
+
+# Manager for the symmetric friendship edges, every friendship is stored in both directions.
+class FriendshipManager(models.Manager):
+    def add_pair(self, user_id, friend_id):
+        self.bulk_create([
+            self.model(user_id=user_id, friend_id=friend_id),
+            self.model(user_id=friend_id, friend_id=user_id),
+        ], ignore_conflicts=True)
+
+    def add_pairs(self, user_id, friend_ids):
+        self.bulk_create([
+            self.model(user_id=user, friend_id=friend)
+            for friend_id in friend_ids
+            for user, friend in ((user_id, friend_id), (friend_id, user_id))
+        ], ignore_conflicts=True)
+
+    def remove_pair(self, user_id, friend_id):
+        return self.filter(
+            models.Q(user_id=user_id, friend_id=friend_id) | models.Q(user_id=friend_id, friend_id=user_id)
+        ).delete()
+
+    def are_friends(self, user_id, friend_id):
+        return self.filter(user_id=user_id, friend_id=friend_id).exists()
+
+    def friend_ids(self, user_id):
+        return self.filter(user_id=user_id).values_list('friend_id', flat=True)
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from social.models import CustomUser
+
+
+# Fills the stored search vector in id ranges, one short UPDATE per chunk, so a table with millions
+# of users is never locked or rewritten in one long transaction.
+class Command(BaseCommand):
+    help = "Backfill the search vector of existing users in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help="Users per UPDATE.")
+        parser.add_argument('--all', action='store_true', help="Recompute every user, not only the missing vectors.")
+        parser.add_argument('--sleep', type=float, default=0.0, help="Pause between chunks in seconds, to spare replicas.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        max_id = CustomUser.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        start = time.perf_counter()
+        last_id = 0
+        updated = 0
+
+        while last_id < max_id:
+            upper_id = last_id + chunk_size
+            filters = {'id__gt': last_id, 'id__lte': upper_id}
+            if not options['all']:
+                filters['search_vector__isnull'] = True
+            updated += CustomUser.objects.update_search_vectors(**filters)
+            last_id = upper_id
+            self.stdout.write(f"Up to id {min(upper_id, max_id)}/{max_id}: {updated} users updated")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} users in {time.perf_counter() - start:.1f}s"))
@@ -0,0 +1,84 @@
+import random
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.postgres.search import SearchVector
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from social.benchmarking import random_name, summarize, timed
+from social.blocks import invalidate_block_sets
+from social.models import Block, CustomUser
+from social.views import FriendsListAPI, UserSearchView
+
+BENCH_EMAIL_DOMAIN = 'bench-blocks.invalid'
+
+
+# Compares search and friend list latency for a viewer without blocks and a viewer with many blocks,
+# to show what the block filtering adds.
+class Command(BaseCommand):
+    help = "Benchmark the cost of block filtering in user search and the friend list."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--blocks', type=int, default=10000, help="Block entries of the heavy viewer.")
+        parser.add_argument('--users', type=int, default=50000, help="Searchable users to create.")
+        parser.add_argument('--requests', type=int, default=300, help="Requests per measurement.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--cleanup', action='store_true', help="Delete the generated rows afterwards.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = [random_name(rng) for _ in range(200)]
+        users = self.create_users(max(options['users'], options['blocks'] + 2), vocabulary, rng)
+
+        plain_viewer, heavy_viewer = users[0], users[1]
+        Block.objects.bulk_create(
+            [Block(blocker=heavy_viewer, blocked=blocked) for blocked in users[2:options['blocks'] + 2]],
+            ignore_conflicts=True
+        )
+        invalidate_block_sets(plain_viewer.id, heavy_viewer.id)
+
+        factory = APIRequestFactory()
+        search_view = UserSearchView.as_view()
+        friends_view = FriendsListAPI.as_view()
+
+        def call(view, viewer, path, params=None):
+            request = factory.get(path, params or {})
+            force_authenticate(request, user=viewer)
+            response = view(request)
+            # A throttled or failed request would be timed as a fast one
+            if response.status_code != 200:
+                raise CommandError(f"{path} answered {response.status_code}: {response.data}")
+            return response
+
+        # The benchmark sends every request from one viewer, it would be throttled right away
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}):
+            for label, viewer in (('no blocks', plain_viewer), (f"{options['blocks']} blocks", heavy_viewer)):
+                terms = iter([rng.choice(vocabulary) for _ in range(options['requests'])])
+                search = summarize(timed(lambda: call(search_view, viewer, '/api/user-search', {'q': next(terms)}),
+                                         options['requests']))
+                friends = summarize(timed(lambda: call(friends_view, viewer, '/api/friend-list/'), options['requests']))
+                self.stdout.write(
+                    f"{label:>14}: search p50={search['p50_ms']:.2f}ms p95={search['p95_ms']:.2f}ms | "
+                    f"friend list p50={friends['p50_ms']:.2f}ms p95={friends['p95_ms']:.2f}ms"
+                )
+
+        if options['cleanup']:
+            deleted, _ = CustomUser.objects.filter(email__endswith=f"@{BENCH_EMAIL_DOMAIN}").delete()
+            self.stdout.write(f"Deleted {deleted} benchmark rows.")
+
+    def create_users(self, count, vocabulary, rng):
+        password = make_password(None)
+        CustomUser.objects.bulk_create([
+            CustomUser(
+                email=f"user{index}@{BENCH_EMAIL_DOMAIN}",
+                first_name=rng.choice(vocabulary),
+                last_name=rng.choice(vocabulary),
+                password=password,
+            )
+            for index in range(count)
+        ], batch_size=5000, ignore_conflicts=True)
+        users = CustomUser.objects.filter(email__endswith=f"@{BENCH_EMAIL_DOMAIN}")
+        users.filter(search_vector__isnull=True).update(search_vector=SearchVector('first_name', 'last_name'))
+        return list(users.order_by('id').only('id', 'email')[:count])
@@ -0,0 +1,221 @@
+import json
+import platform
+import queue
+import random
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from social.authentication import ClaimsRefreshToken
+from social.benchmarking import GRAPH_EMAIL_DOMAIN, QueryCounter, summarize
+from social.models import CustomUser, Friendship
+
+# The endpoints of social/urls.py as (method, path, payload) builders. They get the viewer and
+# a random generator, so every run with the same --seed replays the same requests.
+# Write endpoints change the graph and only run when they are named in --endpoints.
+ENDPOINTS = {
+    'friend-list': (False, lambda viewer, rng: ('get', '/api/friend-list/', None)),
+    'pending-list': (False, lambda viewer, rng: ('get', '/api/pending-list/', {'page': 1})),
+    'pending-list-cursor': (False, lambda viewer, rng: ('get', '/api/pending-list/', {'pagination': 'cursor'})),
+    'user-activity': (False, lambda viewer, rng: ('get', '/api/user-activity/', {'pagination': 'cursor'})),
+    'user-search': (False, lambda viewer, rng: ('get', '/api/user-search', {'q': viewer['first_name']})),
+    'user-search-email': (False, lambda viewer, rng: ('get', '/api/user-search', {'q': rng.choice(viewer['others'])})),
+    'typeahead': (False, lambda viewer, rng: ('get', '/api/user-search', {'q': viewer['first_name'][:3], 'mode': 'prefix'})),
+    'suggestions': (False, lambda viewer, rng: ('get', '/api/suggestions/', None)),
+    'mutual-friends': (False, lambda viewer, rng: ('get', f"/api/mutual-friends/{viewer['friend_id']}/", None)),
+    'friend-request': (True, lambda viewer, rng: ('post', '/api/friend-request/', {'receiver_email': rng.choice(viewer['others'])})),
+    'block': (True, lambda viewer, rng: ('post', '/api/blocked/', {'blocked_email': rng.choice(viewer['others'])})),
+    'unblock': (True, lambda viewer, rng: ('post', '/api/unblocked/', {'blocked_email': rng.choice(viewer['others'])})),
+}
+
+
+# Replays the API endpoints against a graph made by generate_social_graph, through the full
+# middleware, URL routing and authentication stack, at one or more concurrency levels.
+# For every endpoint and level it reports throughput, p50/p95/p99 latency and queries per request,
+# and writes them to a JSON file. --baseline compares a run with an earlier file.
+# Only 2xx responses are timed, the others (throttled, not found, server errors) are counted by status.
+class Command(BaseCommand):
+    help = "Benchmark the API endpoints at configurable concurrency and write the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', default=None,
+                            help=f"Comma separated endpoints (default: every read endpoint). Choices: {', '.join(ENDPOINTS)}.")
+        parser.add_argument('--concurrency', default='1,8,32', help="Comma separated numbers of concurrent clients.")
+        parser.add_argument('--requests', type=int, default=1000, help="Requests per endpoint and concurrency level.")
+        parser.add_argument('--viewers', type=int, default=500, help="Distinct users the requests are spread over.")
+        parser.add_argument('--warmup', type=int, default=50, help="Requests per endpoint before measuring.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--throttle', action='store_true', help="Keep the configured throttles and rate limits.")
+        parser.add_argument('--output', default='bench_results.json', help="File the JSON results are written to.")
+        parser.add_argument('--baseline', default=None, help="Earlier results file to compare with.")
+
+    def handle(self, *args, **options):
+        names = options['endpoints'].split(',') if options['endpoints'] else [name for name, (write, _) in ENDPOINTS.items() if not write]
+        unknown = set(names) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        rng = random.Random(options['seed'])
+        viewers = self.load_viewers(options['viewers'], rng)
+
+        overrides = {}
+        if not options['throttle']:
+            # The benchmark sends everything from one IP and a few hundred users
+            overrides = {
+                'REST_FRAMEWORK': {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}},
+                'RATE_LIMITS': {scope: {} for scope in settings.RATE_LIMITS},
+            }
+
+        results = []
+        with override_settings(**overrides):
+            for name in names:
+                self.run(name, viewers, options['warmup'], 1, rng)
+                for level in levels:
+                    result = self.run(name, viewers, options['requests'], level, rng)
+                    results.append(result)
+                    self.stdout.write(
+                        f"{name:>20} c={level:<4} {result['throughput_rps']:9.1f} req/s | "
+                        f"p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms p99={result['p99_ms']:.1f}ms | "
+                        f"{result['queries_per_request']:.2f} queries/req | {result['errors']} errors | "
+                        f"{sum(result['non_2xx'].values())} non-2xx"
+                    )
+
+        report = {'meta': self.metadata(options, len(viewers)), 'results': results}
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['baseline']:
+            self.compare(options['baseline'], results)
+
+    def load_viewers(self, count, rng):
+        users = list(
+            CustomUser.objects.filter(email__endswith=f"@{GRAPH_EMAIL_DOMAIN}")
+            .order_by('id').values('id', 'email', 'first_name', 'role', 'is_active')[:count * 10]
+        )
+        if len(users) < 2:
+            raise CommandError("No generated graph found, run generate_social_graph first.")
+        viewers = rng.sample(users, min(count, len(users)))
+
+        friends = {}
+        for user_id, friend_id in Friendship.objects.filter(user_id__in=[viewer['id'] for viewer in viewers]).values_list('user_id', 'friend_id'):
+            friends.setdefault(user_id, friend_id)
+        for viewer in viewers:
+            user = CustomUser(pk=viewer['id'], email=viewer['email'], role=viewer['role'], is_active=viewer['is_active'])
+            viewer['token'] = f"Bearer {ClaimsRefreshToken.for_user(user).access_token}"
+            viewer['friend_id'] = friends.get(viewer['id'], viewer['id'])
+            viewer['first_name'] = viewer['first_name'] or viewer['email']
+            # The users this viewer searches, befriends and blocks
+            viewer['others'] = [user['email'] for user in rng.sample(users, min(20, len(users)))]
+        return viewers
+
+    def run(self, name, viewers, count, concurrency, rng):
+        build = ENDPOINTS[name][1]
+        calls = queue.Queue()
+        for _ in range(count):
+            viewer = rng.choice(viewers)
+            calls.put((viewer['token'], *build(viewer, rng)))
+
+        samples, queries, errors = [], [], []
+        non_2xx = {}
+        lock = threading.Lock()
+
+        def client():
+            # One thread per concurrent client, each with its own database connections
+            http = Client()
+            try:
+                while True:
+                    try:
+                        token, method, path, data = calls.get_nowait()
+                    except queue.Empty:
+                        return
+                    start = time.perf_counter()
+                    with QueryCounter(connections) as counter:
+                        try:
+                            response = getattr(http, method)(path, data, HTTP_AUTHORIZATION=token)
+                            if response.streaming:
+                                b''.join(response.streaming_content)
+                            status_code = response.status_code
+                        except Exception:
+                            # The test client re-raises the view's exceptions, count them as server errors
+                            status_code = 500
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with lock:
+                        if 200 <= status_code < 300:
+                            samples.append(elapsed)
+                            queries.append(counter.count)
+                        else:
+                            # JSON object keys, the status codes are written as strings
+                            non_2xx[str(status_code)] = non_2xx.get(str(status_code), 0) + 1
+                        if status_code >= 500:
+                            errors.append(status_code)
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        return {
+            'endpoint': name,
+            'concurrency': concurrency,
+            'requests': count,
+            'errors': len(errors),
+            'non_2xx': non_2xx,
+            # Successful responses only, fast 429s would inflate it
+            'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0,
+            **summarize(samples),
+        }
+
+    def metadata(self, options, viewers):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        database = settings.DATABASES['default']
+        return {
+            'created_at': timezone.now().isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'database': database['ENGINE'],
+            'conn_max_age': database.get('CONN_MAX_AGE', 0),
+            'replicas': len(getattr(settings, 'DATABASE_REPLICAS', [])),
+            'cache': settings.CACHES['default']['BACKEND'],
+            'async_read_views': settings.ASYNC_READ_VIEWS,
+            'users': CustomUser.objects.filter(email__endswith=f"@{GRAPH_EMAIL_DOMAIN}").count(),
+            'viewers': viewers,
+            'seed': options['seed'],
+            'throttled': options['throttle'],
+        }
+
+    def compare(self, path, results):
+        with open(path) as baseline_file:
+            baseline = {(row['endpoint'], row['concurrency']): row for row in json.load(baseline_file)['results']}
+        self.stdout.write(f"Compared with {path}:")
+        for result in results:
+            before = baseline.get((result['endpoint'], result['concurrency']))
+            if before is None:
+                continue
+            self.stdout.write(
+                f"{result['endpoint']:>20} c={result['concurrency']:<4} "
+                f"throughput {self.change(before['throughput_rps'], result['throughput_rps'])} | "
+                f"p95 {self.change(before['p95_ms'], result['p95_ms'])} | "
+                f"queries {before['queries_per_request']:.2f} -> {result['queries_per_request']:.2f}"
+            )
+
+    def change(self, before, after):
+        if not before:
+            return "n/a"
+        return f"{(after - before) / before * 100:+.1f}%"
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from social.backends import negative_cache_key
+from social.benchmarking import summarize
+
+BENCH_PASSWORD = 'correct horse battery staple'
+BENCH_EMAIL = 'unknown@bench-login.invalid'
+
+
+# Measures password checks per second on one core for each configured hasher, and what a login
+# with an unknown email costs once it is in the negative cache.
+class Command(BaseCommand):
+    help = "Benchmark logins per second per core for the password hashers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=20, help="Password checks per hasher.")
+        parser.add_argument('--hashers', nargs='*', default=None,
+                            help="Hashers to measure (pbkdf2, argon2, bcrypt, scrypt), all by default.")
+
+    def handle(self, *args, **options):
+        for name in options['hashers'] or list(settings.PASSWORD_HASHER_CLASSES):
+            algorithm = import_string(settings.PASSWORD_HASHER_CLASSES[name]).algorithm
+            try:
+                encoded = make_password(BENCH_PASSWORD, hasher=algorithm)
+            except ValueError as error:
+                # The optional library of this hasher is not installed
+                self.stdout.write(f"{name:>8}: skipped ({error})")
+                continue
+            self.report(name, *self.measure(lambda: check_password(BENCH_PASSWORD, encoded), options['logins']))
+
+        # Unknown email already in the negative cache: no query and no hash, only the timing-equalising sleep
+        authenticate(email=BENCH_EMAIL, password=BENCH_PASSWORD)
+        self.report('unknown', *self.measure(lambda: authenticate(email=BENCH_EMAIL, password=BENCH_PASSWORD), options['logins']))
+        cache.delete(negative_cache_key(BENCH_EMAIL))
+
+    def measure(self, func, repeat):
+        wall, cpu = [], []
+        for _ in range(repeat):
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            func()
+            wall.append((time.perf_counter() - wall_start) * 1000)
+            cpu.append((time.process_time() - cpu_start) * 1000)
+        return summarize(wall), summarize(cpu)
+
+    def report(self, label, wall, cpu):
+        per_core = f"{1000 / cpu['mean_ms']:,.0f}" if cpu['mean_ms'] else "unbounded"
+        self.stdout.write(
+            f"{label:>8}: wall p50={wall['p50_ms']:.1f}ms p95={wall['p95_ms']:.1f}ms | "
+            f"cpu mean={cpu['mean_ms']:.2f}ms | {per_core} logins/s per core"
+        )
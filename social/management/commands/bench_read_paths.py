@@ -0,0 +1,130 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+
+from social import async_views, views
+from social.authentication import ClaimsRefreshToken
+from social.benchmarking import summarize
+from social.caching import friends_list_namespace, invalidate, pending_requests_namespace
+from social.models import CustomUser, FriendRequest, Friendship
+
+BENCH_EMAIL_DOMAIN = 'bench-read.invalid'
+
+READ_PATHS = [
+    ('friend list', 'FriendsListAPI', '/api/friend-list/', {}),
+    ('pending list', 'PendingFriendRequestsAPI', '/api/pending-list/', {'pagination': 'cursor'}),
+    ('activity', 'UserActivityLogAPI', '/api/user-activity/', {'pagination': 'cursor'}),
+    ('typeahead', 'UserSearchView', '/api/user-search', {'q': 'user', 'mode': 'prefix'}),
+]
+
+
+# Compares the read endpoints on three request paths:
+#   wsgi        the synchronous views on a pool of worker threads, like a threaded WSGI server
+#   asgi-sync   the synchronous views under ASGI, where Django runs them through sync_to_async
+#   asgi-async  the native async views on the event loop
+# --client-delay keeps every connection open for a while after its response, which is what slow
+# mobile clients do: a WSGI worker thread is held for that time, a coroutine is not.
+class Command(BaseCommand):
+    help = "Benchmark the read endpoints on the WSGI and the ASGI request paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint and path.")
+        parser.add_argument('--concurrency', type=int, default=200, help="Concurrent clients on the ASGI paths.")
+        parser.add_argument('--threads', type=int, default=8, help="Worker threads on the WSGI path.")
+        parser.add_argument('--client-delay', type=float, default=0.05, help="Seconds each client holds its connection.")
+        parser.add_argument('--users', type=int, default=200, help="Viewers to create, each with friends and pending requests.")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the generated rows afterwards.")
+
+    def handle(self, *args, **options):
+        viewers = self.create_users(options['users'])
+        tokens = [f"Bearer {ClaimsRefreshToken.for_user(viewer).access_token}" for viewer in viewers]
+
+        # The benchmark runs from one IP and a few users, it would be throttled right away
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}):
+            for label, view_name, path, params in READ_PATHS:
+                self.run_endpoint(label, view_name, path, params, viewers, tokens, options)
+
+        if options['cleanup']:
+            deleted, _ = CustomUser.objects.filter(email__endswith=f"@{BENCH_EMAIL_DOMAIN}").delete()
+            self.stdout.write(f"Deleted {deleted} benchmark rows.")
+
+    def run_endpoint(self, label, view_name, path, params, viewers, tokens, options):
+        sync_view = getattr(views, view_name).as_view()
+        async_view = getattr(async_views, view_name).as_view()
+        runs = {
+            'wsgi': lambda: self.run_wsgi(sync_view, path, params, tokens, options),
+            'asgi-sync': lambda: asyncio.run(self.run_asgi(sync_to_async(sync_view), path, params, tokens, options)),
+            'asgi-async': lambda: asyncio.run(self.run_asgi(async_view, path, params, tokens, options)),
+        }
+        for mode, run in runs.items():
+            # Every path starts from the same cold caches
+            self.reset_caches(viewers)
+            samples, elapsed = run()
+            stats = summarize(samples)
+            self.stdout.write(
+                f"{label:>12} {mode:>10}: {len(samples) / elapsed:8.1f} req/s | "
+                f"p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms"
+            )
+
+    def reset_caches(self, viewers):
+        namespaces = ['typeahead']
+        for viewer in viewers:
+            namespaces += [friends_list_namespace(viewer.id), pending_requests_namespace(viewer.id)]
+        invalidate(*namespaces)
+
+    def run_wsgi(self, view, path, params, tokens, options):
+        factory = RequestFactory()
+
+        def call(index):
+            start = time.perf_counter()
+            response = view(factory.get(path, params, HTTP_AUTHORIZATION=tokens[index % len(tokens)]))
+            response.render()
+            # The worker stays busy until the slow client has received the response
+            time.sleep(options['client_delay'])
+            close_old_connections()
+            return (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            samples = list(pool.map(call, range(options['requests'])))
+        return samples, time.perf_counter() - start
+
+    async def run_asgi(self, view, path, params, tokens, options):
+        factory = AsyncRequestFactory()
+        slots = asyncio.Semaphore(options['concurrency'])
+
+        async def call(index):
+            async with slots:
+                start = time.perf_counter()
+                await view(factory.get(path, params, headers={'authorization': tokens[index % len(tokens)]}))
+                await asyncio.sleep(options['client_delay'])
+                return (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        samples = await asyncio.gather(*[call(index) for index in range(options['requests'])])
+        return samples, time.perf_counter() - start
+
+    def create_users(self, count):
+        password = make_password(None)
+        CustomUser.objects.bulk_create([
+            CustomUser(email=f"user{index}@{BENCH_EMAIL_DOMAIN}", first_name=f"user{index}", password=password)
+            for index in range(count)
+        ], batch_size=5000, ignore_conflicts=True)
+        users = list(CustomUser.objects.filter(email__endswith=f"@{BENCH_EMAIL_DOMAIN}").order_by('id').only('id', 'email', 'role', 'is_active'))
+
+        # Every viewer gets a handful of friends and pending requests from the next users in the list
+        for index, user in enumerate(users):
+            for offset in (1, 2, 3):
+                Friendship.objects.add_pair(user.id, users[(index + offset) % len(users)].id)
+        FriendRequest.objects.bulk_create([
+            FriendRequest(sender=users[(index + offset) % len(users)], receiver=user)
+            for index, user in enumerate(users) for offset in (4, 5, 6)
+        ], ignore_conflicts=True)
+        return users
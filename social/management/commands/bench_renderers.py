@@ -0,0 +1,94 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from social import renderers
+from social.benchmarking import GRAPH_EMAIL_DOMAIN, graph_email
+from social.models import UserActivityLog
+from social.renderers import ORJSONRenderer
+
+
+# Microbenchmark of the list endpoints' response path, in rows per second of CPU time of this process (one core):
+#   render        DRF's JSONRenderer against ORJSONRenderer on pages shaped like the pending list,
+#                 the activity log and the search results (no database involved)
+#   materialize   model instances against values() rows for an activity log page, with a user of
+#                 the generated graph (skipped when there is none)
+class Command(BaseCommand):
+    help = "Benchmark JSON rendering and row materialization of the list endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--pages', type=int, default=2000, help="Pages rendered per measurement.")
+        parser.add_argument('--queries', type=int, default=200, help="Pages loaded per materialization measurement.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            self.stdout.write(self.style.WARNING("orjson is not installed, ORJSONRenderer falls back to JSONRenderer."))
+
+        rng = random.Random(options['seed'])
+        for label, page in self.pages(options['page_size'], rng).items():
+            drf = self.rows_per_second(lambda: JSONRenderer().render(page), options['pages'], options['page_size'])
+            fast = self.rows_per_second(lambda: ORJSONRenderer().render(page), options['pages'], options['page_size'])
+            self.stdout.write(
+                f"render {label:>13}: JSONRenderer {drf:>10,.0f} rows/s | ORJSONRenderer {fast:>10,.0f} rows/s | x{fast / drf:.1f}"
+            )
+
+        self.materialize(options['page_size'], options['queries'])
+
+    def rows_per_second(self, func, repeat, rows):
+        start = time.process_time()
+        for _ in range(repeat):
+            func()
+        return repeat * rows / max(time.process_time() - start, 1e-9)
+
+    def pages(self, size, rng):
+        now = timezone.now()
+
+        def moment():
+            return now - timedelta(seconds=rng.randint(0, 10 ** 7), microseconds=rng.randint(0, 999999))
+
+        def page(results):
+            return {'count': size * 10, 'next': 'http://testserver/api/pending-list/?page=2', 'previous': None, 'results': results}
+
+        return {
+            'pending list': page([
+                {"request_id": rng.randint(1, 10 ** 7), "created_at": moment(), "sender_id": rng.randint(1, 10 ** 6), "status": "pending"}
+                for _ in range(size)
+            ]),
+            'activity': page([
+                {"activity": f"Sent a friend request to {graph_email(rng.randint(0, 10 ** 6))}", "created_at": moment(),
+                 "user_email": graph_email(0)}
+                for _ in range(size)
+            ]),
+            'search': page([
+                {'id': rng.randint(1, 10 ** 6), 'email': graph_email(index), 'name': f"user{index}"}
+                for index in range(size)
+            ]),
+        }
+
+    def materialize(self, size, repeat):
+        viewer = UserActivityLog.objects.filter(user__email__endswith=f"@{GRAPH_EMAIL_DOMAIN}").values_list('user_id', flat=True).first()
+        if viewer is None:
+            self.stdout.write("materialize: no generated graph found, run generate_social_graph first.")
+            return
+        logs = UserActivityLog.objects.filter(user_id=viewer).order_by('-created_at', '-id')
+
+        def instances():
+            return [{"activity": log.activity, "created_at": log.created_at} for log in logs[:size]]
+
+        def rows():
+            return [{"activity": log['activity'], "created_at": log['created_at']} for log in logs.values('id', 'activity', 'created_at')[:size]]
+
+        rows_on_page = len(rows())
+        if not rows_on_page:
+            return
+        model = self.rows_per_second(instances, repeat, rows_on_page)
+        values = self.rows_per_second(rows, repeat, rows_on_page)
+        self.stdout.write(
+            f"materialize    activity: instances {model:>10,.0f} rows/s | values() {values:>10,.0f} rows/s | x{values / model:.1f}"
+        )
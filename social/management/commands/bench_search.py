@@ -0,0 +1,82 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+
+from social.benchmarking import random_name, summarize, timed
+from social.models import CustomUser
+
+BENCH_EMAIL_DOMAIN = 'bench-search.invalid'
+
+
+# Grows the user table step by step and measures the latency of the name search used by UserSearchView.
+class Command(BaseCommand):
+    help = "Benchmark full-text user search latency as the user table grows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help="Comma separated user table sizes to measure at.")
+        parser.add_argument('--queries', type=int, default=200, help="Searches to run at each size.")
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--cleanup', action='store_true', help="Delete the generated users afterwards.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        password = make_password(None)
+        vocabulary = [random_name(rng) for _ in range(5000)]
+
+        for size in sizes:
+            self.grow_to(size, options['batch_size'], password, vocabulary, rng)
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {CustomUser._meta.db_table}")
+
+            terms = [rng.choice(vocabulary) for _ in range(options['queries'])]
+            terms_iter = iter(terms)
+            samples = timed(lambda: self.search(next(terms_iter)), len(terms))
+            stats = summarize(samples)
+            self.stdout.write(
+                f"users={CustomUser.objects.count():>10}  p50={stats['p50_ms']:.2f}ms  "
+                f"p95={stats['p95_ms']:.2f}ms  p99={stats['p99_ms']:.2f}ms  "
+                f"gin_index_used={self.uses_index(terms[0])}"
+            )
+
+        if options['cleanup']:
+            deleted, _ = CustomUser.objects.filter(email__endswith=f"@{BENCH_EMAIL_DOMAIN}").delete()
+            self.stdout.write(f"Deleted {deleted} benchmark rows.")
+
+    def grow_to(self, size, batch_size, password, vocabulary, rng):
+        existing = CustomUser.objects.filter(email__endswith=f"@{BENCH_EMAIL_DOMAIN}").count()
+        while existing < size:
+            count = min(batch_size, size - existing)
+            users = [
+                CustomUser(
+                    email=f"user{existing + i}@{BENCH_EMAIL_DOMAIN}",
+                    first_name=rng.choice(vocabulary),
+                    last_name=rng.choice(vocabulary),
+                    password=password,
+                )
+                for i in range(count)
+            ]
+            created = CustomUser.objects.bulk_create(users)
+            # bulk_create skips post_save, so fill the stored vector for the batch in one UPDATE
+            CustomUser.objects.filter(pk__in=[user.pk for user in created]).update(
+                search_vector=SearchVector('first_name', 'last_name')
+            )
+            existing += count
+
+    def queryset(self, term):
+        search_query = SearchQuery(term)
+        return CustomUser.objects.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', 'id')
+
+    def search(self, term):
+        return list(self.queryset(term)[:10])
+
+    def uses_index(self, term):
+        return 'user_search_vector_gin' in self.queryset(term)[:10].explain()
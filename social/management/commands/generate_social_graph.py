@@ -0,0 +1,184 @@
+import random
+import time
+from array import array
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from social.benchmarking import GRAPH_EMAIL_DOMAIN, chunked, graph_email, random_name
+from social.caching import invalidate
+from social.models import Block, CustomUser, FriendRequest, Friendship, UserActivityLog
+from social.partitions import retention_cutoff
+
+ACTIVITIES = (
+    "Sent a friend request to {email}",
+    "You have accepted the friend request of {email}",
+    "You have rejected the friend request of {email}",
+    "You have blocked this {email}",
+)
+
+
+# Generates a synthetic social graph for the benchmarks. Friendships follow preferential attachment
+# (Barabasi-Albert): every new user befriends --friends-per-user existing users picked in proportion
+# to how many friends they already have, which gives the power-law degree distribution of real
+# networks (a few hubs, a long tail). Requests also favour popular receivers, blocks and logs are
+# spread uniformly. Everything is written with bulk_create in batches, the same --seed gives the same graph.
+class Command(BaseCommand):
+    help = "Generate a synthetic power-law social graph (users, friendships, requests, blocks, logs)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--friends-per-user', type=int, default=5,
+                            help="Friendships every new user adds, the average friend count is twice that.")
+        parser.add_argument('--requests-per-user', type=float, default=2.0, help="Average friend requests received.")
+        parser.add_argument('--blocks-per-user', type=float, default=0.5)
+        parser.add_argument('--logs-per-user', type=float, default=10.0)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--reset', action='store_true', help="Delete a previously generated graph first.")
+        parser.add_argument('--skip-search-vector', action='store_true', help="Do not backfill the search vectors.")
+        parser.add_argument('--suggestions', action='store_true', help="Rebuild the friend suggestions afterwards.")
+
+    def handle(self, *args, **options):
+        graph_users = CustomUser.objects.filter(email__endswith=f"@{GRAPH_EMAIL_DOMAIN}")
+        if graph_users.exists():
+            if not options['reset']:
+                raise CommandError("A generated graph already exists, pass --reset to replace it.")
+            deleted, _ = graph_users.delete()
+            self.stdout.write(f"Deleted {deleted} rows of the previous graph.")
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        start = time.perf_counter()
+
+        user_ids = self.step("users", self.create_users, options['users'])
+        endpoints = self.step("friendships", self.create_friendships, user_ids, options['friends_per_user'])
+        self.step("friend requests", self.create_friend_requests, user_ids, endpoints, options['requests_per_user'])
+        self.step("blocks", self.create_blocks, user_ids, options['blocks_per_user'])
+        self.step("activity logs", self.create_activity_logs, user_ids, options['logs_per_user'])
+
+        if not options['skip_search_vector']:
+            call_command('backfill_search_vector', stdout=self.stdout)
+        if options['suggestions']:
+            call_command('rebuild_suggestions', stdout=self.stdout)
+
+        # The new users are not in the cached typeahead results yet
+        invalidate('typeahead')
+        self.stdout.write(self.style.SUCCESS(f"Generated the graph in {time.perf_counter() - start:.1f}s"))
+
+    def step(self, label, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.stdout.write(f"{label}: {self.created} rows in {time.perf_counter() - start:.1f}s")
+        return result
+
+    def write(self, model, rows):
+        # The generators skip repeated pairs and the graph starts empty, so every row is inserted
+        self.created = 0
+        for batch in chunked(rows, self.batch_size):
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+            self.created += len(batch)
+
+    def count(self, users, per_user):
+        return int(len(users) * per_user)
+
+    def first_time(self, seen, first, second, users):
+        # Pairs of user indexes as single ints, a set of tuples would take several times the memory
+        key = first * users + second
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
+
+    def create_users(self, count):
+        password = make_password(None)
+        vocabulary = [random_name(self.rng) for _ in range(5000)]
+        user_ids = array('q')
+        self.created = 0
+        rows = (
+            CustomUser(
+                email=graph_email(index),
+                first_name=self.rng.choice(vocabulary),
+                last_name=self.rng.choice(vocabulary),
+                password=password,
+            )
+            for index in range(count)
+        )
+        for batch in chunked(rows, self.batch_size):
+            # Without ignore_conflicts the ids come back, the graph below is built on them
+            user_ids.extend(user.pk for user in CustomUser.objects.bulk_create(batch))
+            self.created += len(batch)
+        return user_ids
+
+    def create_friendships(self, user_ids, per_user):
+        # Every friendship adds both users to `endpoints`, so a uniform pick from it is a pick
+        # weighted by friend count. The first users befriend each other to seed the graph.
+        endpoints = array('i')
+
+        def pairs():
+            for index in range(1, len(user_ids)):
+                if index <= per_user:
+                    friends = range(index)
+                else:
+                    friends = set()
+                    while len(friends) < per_user:
+                        friends.add(endpoints[self.rng.randrange(len(endpoints))])
+                for friend in friends:
+                    endpoints.append(index)
+                    endpoints.append(friend)
+                    yield Friendship(user_id=user_ids[index], friend_id=user_ids[friend])
+                    yield Friendship(user_id=user_ids[friend], friend_id=user_ids[index])
+
+        self.write(Friendship, pairs())
+        return endpoints
+
+    def create_friend_requests(self, user_ids, endpoints, per_user):
+        # Popular users receive more requests, some of the older ones were rejected
+        now = timezone.now()
+
+        def rows():
+            seen = set()
+            for _ in range(self.count(user_ids, per_user)):
+                sender = self.rng.randrange(len(user_ids))
+                receiver = endpoints[self.rng.randrange(len(endpoints))] if endpoints else self.rng.randrange(len(user_ids))
+                # One request per (sender, receiver), the unique constraint would refuse a second one
+                if sender == receiver or not self.first_time(seen, sender, receiver, len(user_ids)):
+                    continue
+                rejected = self.rng.random() < 0.2
+                yield FriendRequest(
+                    sender_id=user_ids[sender],
+                    receiver_id=user_ids[receiver],
+                    status='rejected' if rejected else 'pending',
+                    rejected_at=now - timedelta(days=self.rng.randint(1, 60)) if rejected else None,
+                )
+
+        self.write(FriendRequest, rows())
+
+    def create_blocks(self, user_ids, per_user):
+        def rows():
+            seen = set()
+            for _ in range(self.count(user_ids, per_user)):
+                blocker, blocked = self.rng.randrange(len(user_ids)), self.rng.randrange(len(user_ids))
+                if blocker != blocked and self.first_time(seen, blocker, blocked, len(user_ids)):
+                    yield Block(blocker_id=user_ids[blocker], blocked_id=user_ids[blocked])
+
+        self.write(Block, rows())
+
+    def create_activity_logs(self, user_ids, per_user):
+        # Spread over the retention window, so every monthly partition gets its share
+        cutoff = retention_cutoff()
+        span = (timezone.now() - cutoff).total_seconds()
+
+        def rows():
+            for _ in range(self.count(user_ids, per_user)):
+                other = graph_email(self.rng.randrange(len(user_ids)))
+                yield UserActivityLog(
+                    user_id=user_ids[self.rng.randrange(len(user_ids))],
+                    activity=self.rng.choice(ACTIVITIES).format(email=other),
+                    created_at=cutoff + timedelta(seconds=self.rng.uniform(0, span)),
+                )
+
+        self.write(UserActivityLog, rows())
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from social.models import UserActivityLog
+from social.partitions import add_months, create_partition, drop_partition, list_partitions, month_start
+
+
+# Creates the upcoming monthly partitions of the activity log and drops (or archives) the expired ones.
+# Meant to run from cron, e.g. once a day.
+class Command(BaseCommand):
+    help = "Create upcoming activity log partitions and drop or archive expired ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=settings.ACTIVITY_LOG_PARTITIONS_AHEAD,
+                            help="Months of partitions to create in advance.")
+        parser.add_argument('--retention', type=int, default=settings.ACTIVITY_LOG_RETENTION_MONTHS,
+                            help="Months of activity to keep, including the current one.")
+        parser.add_argument('--archive', action='store_true',
+                            help="Detach expired partitions into archive tables instead of dropping them.")
+        parser.add_argument('--dry-run', action='store_true', help="Only print what would be done.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Activity log partitioning needs PostgreSQL.")
+        if options['retention'] < 1:
+            raise CommandError("--retention must be at least 1 month.")
+
+        table = UserActivityLog._meta.db_table
+        current = month_start(timezone.now())
+        oldest_kept = add_months(current, -(options['retention'] - 1))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            existing = list_partitions(cursor, table)
+
+            for offset in range(options['ahead'] + 1):
+                month = add_months(current, offset)
+                if month in existing:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f"Would create partition for {month:%Y-%m}")
+                else:
+                    create_partition(cursor, table, month)
+                    self.stdout.write(f"Created partition for {month:%Y-%m}")
+
+            for month in sorted(existing):
+                if month >= oldest_kept:
+                    continue
+                action = 'archive' if options['archive'] else 'drop'
+                if options['dry_run']:
+                    self.stdout.write(f"Would {action} partition for {month:%Y-%m}")
+                else:
+                    name = drop_partition(cursor, table, month, archive=options['archive'])
+                    self.stdout.write(f"{action.capitalize()}d {name}")
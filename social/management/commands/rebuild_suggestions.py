@@ -0,0 +1,73 @@
+import time
+from multiprocessing import Pool
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import F
+
+# Full rebuild of the friend suggestions table. Users are split into shards by id modulo,
+# and each shard is rebuilt in chunks by a process of the pool.
+
+
+def init_worker():
+    # With the spawn start method the child has to set Django up itself
+    if not apps.ready:
+        django.setup()
+    # Never share the parent's database connections with the children
+    connections.close_all()
+
+
+def rebuild_shard(args):
+    from social.models import CustomUser
+    from social.suggestions import refresh_suggestions
+
+    shard, shards, chunk_size = args
+    user_ids = CustomUser.objects.annotate(shard=F('id') % shards).filter(shard=shard).order_by('id').values_list('id', flat=True)
+
+    rebuilt = 0
+    chunk = []
+    for user_id in user_ids.iterator(chunk_size=chunk_size):
+        chunk.append(user_id)
+        if len(chunk) >= chunk_size:
+            refresh_suggestions(chunk)
+            rebuilt += len(chunk)
+            chunk = []
+    if chunk:
+        refresh_suggestions(chunk)
+        rebuilt += len(chunk)
+    connections.close_all()
+    return shard, rebuilt
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed friend suggestions of every user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Processes in the pool, 1 runs inline.")
+        parser.add_argument('--shards', type=int, default=None, help="Number of user shards (default: 4 per worker).")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Users refreshed per batch.")
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        shards = options['shards'] or workers * 4
+        tasks = [(shard, shards, options['chunk_size']) for shard in range(shards)]
+        start = time.perf_counter()
+        total = 0
+
+        if workers == 1:
+            results = map(rebuild_shard, tasks)
+            for shard, rebuilt in results:
+                total += rebuilt
+                self.stdout.write(f"Shard {shard + 1}/{shards}: {rebuilt} users")
+        else:
+            connections.close_all()
+            with Pool(workers, initializer=init_worker) as pool:
+                for shard, rebuilt in pool.imap_unordered(rebuild_shard, tasks):
+                    total += rebuilt
+                    self.stdout.write(f"Shard {shard + 1}/{shards}: {rebuilt} users")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt suggestions for {total} users in {time.perf_counter() - start:.1f}s"
+        ))
@@ -0,0 +1,180 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Per-request instrumentation: database statements and time, cache hits and misses, total latency.
+# Every database connection gets an execute wrapper when it is opened; outside a request (the
+# activity log writer, management commands) it only checks the context variable and runs the query.
+# The numbers are added up per view in this process and exported in the Prometheus text format.
+# Under several worker processes each one keeps its own totals, Prometheus adds them up per target.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Activity log writer stats that go up and down, the others only grow
+WRITER_GAUGES = ('queue_depth', 'queue_capacity', 'queue_high_water')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.duration = None
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+        return self
+
+
+def start_request():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def record_cache(hit):
+    metrics = _current.get()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+def instrument_queries(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def install_query_wrapper(sender, connection, **kwargs):
+    if instrument_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(instrument_queries)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {round(self.sum, 6)}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+class ViewStats:
+    def __init__(self):
+        self.responses = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, view, method, status_code, metrics):
+        with self._lock:
+            stats = self.views.get((view, method))
+            if stats is None:
+                stats = self.views[(view, method)] = ViewStats()
+            stats.responses[status_code] = stats.responses.get(status_code, 0) + 1
+            stats.latency.observe(metrics.duration)
+            stats.queries.observe(metrics.queries)
+            stats.db_time += metrics.db_time
+            stats.cache_hits += metrics.cache_hits
+            stats.cache_misses += metrics.cache_misses
+
+    def reset(self):
+        with self._lock:
+            self.views = {}
+
+    def render(self, extra=()):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            views = sorted(self.views.items())
+
+            family('social_http_responses_total', 'counter', "Responses by view, method and status code.")
+            for (view, method), stats in views:
+                for status_code, count in sorted(stats.responses.items()):
+                    lines.append(f'social_http_responses_total{{view="{view}",method="{method}",status="{status_code}"}} {count}')
+
+            family('social_http_request_duration_seconds', 'histogram', "Time spent in the view and the middleware.")
+            for (view, method), stats in views:
+                lines.extend(stats.latency.lines('social_http_request_duration_seconds', f'view="{view}",method="{method}"'))
+
+            family('social_db_queries_per_request', 'histogram', "Database statements run by each request.")
+            for (view, method), stats in views:
+                lines.extend(stats.queries.lines('social_db_queries_per_request', f'view="{view}",method="{method}"'))
+
+            family('social_db_query_seconds_total', 'counter', "Time spent in database statements.")
+            for (view, method), stats in views:
+                lines.append(f'social_db_query_seconds_total{{view="{view}",method="{method}"}} {round(stats.db_time, 6)}')
+
+            for outcome in ('hits', 'misses'):
+                family(f'social_request_cache_{outcome}_total', 'counter', f"Cache {outcome} of the namespaced caches by view.")
+                for (view, method), stats in views:
+                    lines.append(f'social_request_cache_{outcome}_total{{view="{view}",method="{method}"}} {getattr(stats, "cache_" + outcome)}')
+
+        for name, kind, help_text, value in extra:
+            family(name, kind, help_text)
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def process_metrics():
+    # Process-wide numbers next to the per-view ones: the namespaced caches and the activity log writer.
+    # Imported here, caching imports this module.
+    from .activity import get_writer
+    from .caching import cache_stats
+
+    extra = [
+        (f'social_cache_{outcome}_total', 'counter', f"Cache {outcome} of the namespaced caches.", count)
+        for outcome, count in sorted(cache_stats().items())
+    ]
+    if settings.ACTIVITY_LOG_ASYNC:
+        for name, value in sorted(get_writer().stats().items()):
+            kind = 'gauge' if name in WRITER_GAUGES else 'counter'
+            metric = f'social_activity_log_{name}' + ('_total' if kind == 'counter' else '')
+            extra.append((metric, kind, f"Activity log writer: {name.replace('_', ' ')}.", value))
+    return registry.render(extra)
@@ -0,0 +1,92 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+from .routers import SAFE_METHODS, apin_to_primary, end_request, pin_to_primary, start_request
+
+
+# Scopes replica routing to the request and pins the user to the primary after a successful write.
+# Works both under WSGI and ASGI, so the async views are not pushed into a thread.
+class PrimaryReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = start_request(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        user_id = self.wrote(request, response)
+        if user_id is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        token = start_request(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        user_id = self.wrote(request, response)
+        if user_id is not None:
+            await apin_to_primary(user_id)
+        return response
+
+    def wrote(self, request, response):
+        # The id of the user who just wrote successfully, DRF sets the authenticated user on the underlying request
+        user = getattr(request, 'user', None)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and user is not None and user.is_authenticated:
+            return user.pk
+        return None
+
+
+# Records the database statements, database time, cache hits and misses and latency of every request.
+# They are added up per view for the /metrics endpoint, and with QUERY_METRICS_HEADERS (on in DEBUG)
+# the numbers of the request are also sent back as response headers, to spot N+1 queries while developing.
+class QueryMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.record(request, response, request_metrics.finish())
+
+    async def __acall__(self, request):
+        request_metrics, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.record(request, response, request_metrics.finish())
+
+    def record(self, request, response, request_metrics):
+        # The URL name keeps the label set small, unmatched paths are counted together
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+        metrics.registry.observe(view, request.method, response.status_code, request_metrics)
+        if settings.QUERY_METRICS_HEADERS:
+            response['X-DB-Queries'] = str(request_metrics.queries)
+            response['X-DB-Time-Ms'] = f"{request_metrics.db_time * 1000:.2f}"
+            response['X-Cache-Hits'] = str(request_metrics.cache_hits)
+            response['X-Cache-Misses'] = str(request_metrics.cache_misses)
+            response['X-Response-Time-Ms'] = f"{request_metrics.duration * 1000:.2f}"
+        return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Build the friendship edges from the requests that were already accepted.
+def backfill_friendships(apps, schema_editor):
+    FriendRequest = apps.get_model('social', 'FriendRequest')
+    Friendship = apps.get_model('social', 'Friendship')
+    accepted = FriendRequest.objects.filter(status='accepted').values_list('sender_id', 'receiver_id')
+    batch = []
+    for sender_id, receiver_id in accepted.iterator(chunk_size=5000):
+        batch.append(Friendship(user_id=sender_id, friend_id=receiver_id))
+        batch.append(Friendship(user_id=receiver_id, friend_id=sender_id))
+        if len(batch) >= 10000:
+            Friendship.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    Friendship.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0003_customuser_first_name_customuser_last_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('friend', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friendships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'friend'), name='unique_friendship')],
+            },
+        ),
+        migrations.RunPython(backfill_friendships, migrations.RunPython.noop),
+    ]
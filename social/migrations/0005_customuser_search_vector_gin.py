@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:04
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+# Fill the stored search vector for users created before it was maintained.
+def backfill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    CustomUser = apps.get_model('social', 'CustomUser')
+    CustomUser.objects.filter(search_vector__isnull=True).update(
+        search_vector=SearchVector('first_name', 'last_name')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0004_friendship'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='user_search_vector_gin'),
+        ),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:09
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+from social.partitions import add_months, create_default_partition, create_partition, month_start
+
+
+# The foreign key index, under a fixed name so that the reverse can drop it
+USER_INDEX_NAME = 'activity_user_id_idx'
+
+
+# Rebuild the activity log as a table partitioned by month on created_at.
+# PostgreSQL needs the partition key in the primary key, so it becomes (id, created_at).
+def partition_activity_log(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    UserActivityLog = apps.get_model('social', 'UserActivityLog')
+    CustomUser = apps.get_model('social', 'CustomUser')
+    table = UserActivityLog._meta.db_table
+    legacy = f"{table}_legacy"
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT min(created_at) FROM "{table}"')
+        oldest = cursor.fetchone()[0]
+
+        # The primary key index keeps its name on rename, and index names are unique per schema
+        cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy}"')
+        cursor.execute(f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{table}_pkey" TO "{legacy}_pkey"')
+        cursor.execute(f"""
+            CREATE TABLE "{table}" (
+                "id" bigint NOT NULL,
+                "activity" varchar(255) NOT NULL,
+                "created_at" timestamp with time zone NOT NULL,
+                "user_id" bigint NOT NULL
+                    REFERENCES "{CustomUser._meta.db_table}" ("id") DEFERRABLE INITIALLY DEFERRED,
+                CONSTRAINT "{table}_pkey" PRIMARY KEY ("id", "created_at")
+            ) PARTITION BY RANGE ("created_at")
+        """)
+
+        # One partition per month from the oldest row up to the months ahead, plus a default one
+        month = month_start(oldest or timezone.now())
+        last = add_months(month_start(timezone.now()), settings.ACTIVITY_LOG_PARTITIONS_AHEAD)
+        while month <= last:
+            create_partition(cursor, table, month)
+            month = add_months(month, 1)
+        create_default_partition(cursor, table)
+
+        # Check the copied rows' foreign keys right away, deferred checks still pending at commit
+        # would make the ALTER TABLE and CREATE INDEX below fail with "pending trigger events"
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f"""
+            INSERT INTO "{table}" ("id", "activity", "created_at", "user_id")
+            SELECT "id", "activity", "created_at", "user_id" FROM "{legacy}"
+        """)
+        cursor.execute(f'DROP TABLE "{legacy}"')
+
+        # The identity sequence went away with the old table, ids continue from a new one
+        sequence = f"{table}_id_seq"
+        cursor.execute(f'CREATE SEQUENCE "{sequence}" OWNED BY "{table}"."id"')
+        cursor.execute(f'SELECT setval(%s, coalesce(max("id"), 0) + 1, false) FROM "{table}"', [sequence])
+        cursor.execute(f"ALTER TABLE \"{table}\" ALTER COLUMN \"id\" SET DEFAULT nextval('{sequence}')")
+
+    # Recreate the foreign key and Meta indexes on the partitioned table, they cascade to every partition
+    schema_editor.add_index(UserActivityLog, models.Index(fields=['user'], name=USER_INDEX_NAME))
+    for index in UserActivityLog._meta.indexes:
+        schema_editor.add_index(UserActivityLog, index)
+
+
+# Back to a plain table: the rows of every attached partition (and the default one) are copied into it.
+# Partitions that were archived are detached already and stay as they are.
+def unpartition_activity_log(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    UserActivityLog = apps.get_model('social', 'UserActivityLog')
+    table = UserActivityLog._meta.db_table
+    partitioned = f"{table}_partitioned"
+
+    with schema_editor.connection.cursor() as cursor:
+        # Free the names the plain table is created with
+        for name in (USER_INDEX_NAME, *(index.name for index in UserActivityLog._meta.indexes)):
+            cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+        cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{partitioned}"')
+        cursor.execute(f'ALTER TABLE "{partitioned}" RENAME CONSTRAINT "{table}_pkey" TO "{partitioned}_pkey"')
+        cursor.execute(f'ALTER SEQUENCE "{table}_id_seq" RENAME TO "{partitioned}_id_seq"')
+
+    # The foreign key and the indexes are deferred to the end of the migration, after the copy
+    schema_editor.create_model(UserActivityLog)
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO "{table}" ("id", "activity", "created_at", "user_id")
+            SELECT "id", "activity", "created_at", "user_id" FROM "{partitioned}"
+        """)
+        cursor.execute(f'SELECT setval(pg_get_serial_sequence(%s, %s), coalesce(max("id"), 0) + 1, false) FROM "{table}"', [table, 'id'])
+        # Drops the attached partitions and the sequence along with it
+        cursor.execute(f'DROP TABLE "{partitioned}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0008_activity_log_created_at_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_activity_log, unpartition_activity_log),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+# Keep only the latest request of every (sender, receiver) pair before the constraint is added.
+def remove_duplicate_requests(apps, schema_editor):
+    FriendRequest = apps.get_model('social', 'FriendRequest')
+    duplicates = FriendRequest.objects.values('sender_id', 'receiver_id').annotate(
+        latest=Max('id'), total=Count('id')
+    ).filter(total__gt=1)
+    for pair in duplicates.iterator():
+        FriendRequest.objects.filter(
+            sender_id=pair['sender_id'], receiver_id=pair['receiver_id']
+        ).exclude(id=pair['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0009_partition_activity_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_requests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='friendrequest',
+            constraint=models.UniqueConstraint(fields=('sender', 'receiver'), name='unique_friend_request'),
+        ),
+    ]
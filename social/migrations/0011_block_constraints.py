@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:11
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+# Keep only the latest block of every (blocker, blocked) pair before the constraint is added.
+def remove_duplicate_blocks(apps, schema_editor):
+    Block = apps.get_model('social', 'Block')
+    duplicates = Block.objects.values('blocker_id', 'blocked_id').annotate(
+        latest=Max('id'), total=Count('id')
+    ).filter(total__gt=1)
+    for pair in duplicates.iterator():
+        Block.objects.filter(
+            blocker_id=pair['blocker_id'], blocked_id=pair['blocked_id']
+        ).exclude(id=pair['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0010_friendrequest_unique_sender_receiver'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_blocks, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='block',
+            index=models.Index(fields=['blocked', 'blocker'], name='block_blocked_blocker_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='block',
+            constraint=models.UniqueConstraint(fields=('blocker', 'blocked'), name='unique_block'),
+        ),
+    ]
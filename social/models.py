@@ -1,8 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
-from .custom_manager import CustomUserManager
+from .custom_manager import CustomUserManager, FriendshipManager
 from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Upper
 from django.conf import settings
+from django.utils import timezone
 
 # Custom user model
 class CustomUser(AbstractBaseUser):
@@ -25,6 +28,33 @@ class CustomUser(AbstractBaseUser):
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
+    # Fields the stored search vector is built from
+    SEARCH_VECTOR_FIELDS = ('first_name', 'last_name')
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='user_search_vector_gin'),
+            # Trigram indexes on UPPER(...) so the istartswith lookups of the typeahead search can use them
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'), name='user_email_trgm'),
+            GinIndex(OpClass(Upper('first_name'), name='gin_trgm_ops'), name='user_first_name_trgm'),
+            GinIndex(OpClass(Upper('last_name'), name='gin_trgm_ops'), name='user_last_name_trgm'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Keep the names as loaded, the search vector signal only runs when they changed
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_search_fields = tuple(instance.__dict__.get(field) for field in cls.SEARCH_VECTOR_FIELDS)
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        # The reloaded names are the stored ones again, the others keep what was loaded before
+        loaded = dict(zip(self.SEARCH_VECTOR_FIELDS, getattr(self, '_loaded_search_fields', None) or ()))
+        for field in self.SEARCH_VECTOR_FIELDS:
+            if fields is None or field in fields:
+                loaded[field] = self.__dict__.get(field)
+        self._loaded_search_fields = tuple(loaded.get(field) for field in self.SEARCH_VECTOR_FIELDS)
 
     def __str__(self):
         return self.email
@@ -54,6 +84,15 @@ class FriendRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     rejected_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sender', 'receiver'], name='unique_friend_request'),
+        ]
+        indexes = [
+            # Backs the pending inbox and its keyset pagination on (created_at, id)
+            models.Index(fields=['receiver', 'status', '-created_at', '-id'], name='friendrequest_inbox_idx'),
+        ]
+
     def __str__(self):
         return f"{self.sender.email} -> {self.receiver.email} : {self.status}"
     
@@ -64,14 +103,62 @@ class Block(models.Model):
     blocked = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='blocked', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blocker', 'blocked'], name='unique_block'),
+        ]
+        indexes = [
+            # The unique constraint covers lookups by blocker, this one covers "who blocked me"
+            models.Index(fields=['blocked', 'blocker'], name='block_blocked_blocker_idx'),
+        ]
+
     def __str__(self):
         return f"{self.blocker.email} blocked {self.blocked.email}"
 
+# Friendship model, one row per direction so a user's friends are a single index range read.
+class Friendship(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='friendships', on_delete=models.CASCADE)
+    friend = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = FriendshipManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'friend'], name='unique_friendship'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} <-> {self.friend_id}"
+
+# Precomputed "people you may know", the top suggestions per user with their mutual friend count.
+class FriendSuggestion(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='friend_suggestions', on_delete=models.CASCADE)
+    suggested = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    mutual_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'suggested'], name='unique_friend_suggestion'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-mutual_count'], name='suggestion_user_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.suggested_id} ({self.mutual_count} mutual)"
+
 # User activity model
 class UserActivityLog(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='activity_logs')
     activity = models.CharField(max_length=255) # Description of the activity
-    created_at = models.DateTimeField(auto_now_add=True)  # When the activity was logged
+    created_at = models.DateTimeField(default=timezone.now)  # When the activity was logged (set when queued)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='activity_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.activity} at {self.created_at}"
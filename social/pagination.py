@@ -1,7 +1,125 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 # This is used for pagination.
 class UserPagination(PageNumberPagination):
     page_size = 10  
     page_size_query_param = 'page_size'
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+
+
+# Keyset (cursor) pagination. The cursor holds the ordering values of the last row that was sent,
+# so the next page is a range read on the matching index instead of an OFFSET plus a COUNT(*).
+# Clients opt in per request with ?pagination=cursor and then follow the "next" links.
+class KeysetPagination(BasePagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    @classmethod
+    def requested(cls, request):
+        return request.query_params.get('pagination') == 'cursor' or cls.cursor_query_param in request.query_params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        except (TypeError, ValueError, binascii.Error, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        # Datetimes and decimals keep their full precision, the position has to match the stored values exactly
+        values = [
+            value.isoformat() if isinstance(value, datetime) else str(value) if isinstance(value, Decimal) else value
+            for value in position
+        ]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def after_position(self, position):
+        # (a, b) comes after (x, y) when a is past x, or a == x and b is past y.
+        # The redundant leading bound (a up to x) lets the planner turn the OR into an index range seek.
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        first = self.ordering[0]
+        bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": position[0]})
+        return bound & condition
+
+    def filter_queryset(self, queryset, request):
+        # Builds the page query without touching the database, one extra row tells if there is a next page
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after_position(position))
+        return queryset[:self.page_size + 1]
+
+    def paginate_rows(self, rows):
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last_position = None
+        if rows:
+            last = rows[-1]
+            self.last_position = [
+                last[field.lstrip('-')] if isinstance(last, dict) else getattr(last, field.lstrip('-'))
+                for field in self.ordering
+            ]
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_rows(list(self.filter_queryset(queryset, request)))
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+# Keyset pagination for ranked search results, ordered by rank and then id.
+# The rank has to be an exact numeric (CustomUserManager.search), a float rank does not compare
+# equal to itself after the round trip through the cursor and rows on the page boundary get lost.
+class SearchKeysetPagination(KeysetPagination):
+    ordering = ('-rank', 'id')
+
+
+# Picks the paginator for a request, keyset when the client opted in and page numbers otherwise.
+def get_paginator(request, keyset_class=KeysetPagination):
+    if keyset_class.requested(request):
+        return keyset_class()
+    return UserPagination()
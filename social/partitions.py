@@ -0,0 +1,90 @@
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+# Monthly range partitions of the activity log table (PostgreSQL only).
+# Partitions are named <table>_pYYYYMM and rows outside every partition land in <table>_default.
+
+PARTITION_SUFFIX = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def default_partition_name(table):
+    return f"{table}_default"
+
+
+def retention_cutoff(months=None):
+    # Start of the oldest month that is still kept, reads bounded by it skip every expired partition
+    months = settings.ACTIVITY_LOG_RETENTION_MONTHS if months is None else months
+    cutoff = add_months(month_start(timezone.now()), -(months - 1))
+    return datetime(cutoff.year, cutoff.month, 1, tzinfo=dt_timezone.utc)
+
+
+def table_exists(cursor, name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+    return cursor.fetchone()[0]
+
+
+def list_partitions(cursor, table):
+    cursor.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+    """, [table])
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = PARTITION_SUFFIX.search(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def create_partition(cursor, table, month):
+    name = partition_name(table, month)
+    if table_exists(cursor, name):
+        return False
+    lower = f"{month:%Y-%m-%d} 00:00:00+00"
+    upper = f"{add_months(month, 1):%Y-%m-%d} 00:00:00+00"
+    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    # Rows for this month may already sit in the default partition, attaching would fail on them
+    default = default_partition_name(table)
+    if table_exists(cursor, default):
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM "{default}" WHERE created_at >= '{lower}' AND created_at < '{upper}' RETURNING *
+            )
+            INSERT INTO "{name}" SELECT * FROM moved
+        """)
+    cursor.execute(f"""ALTER TABLE "{table}" ATTACH PARTITION "{name}" FOR VALUES FROM ('{lower}') TO ('{upper}')""")
+    return True
+
+
+def create_default_partition(cursor, table):
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS "{default_partition_name(table)}" PARTITION OF "{table}" DEFAULT')
+
+
+def drop_partition(cursor, table, month, archive=False):
+    name = partition_name(table, month)
+    if archive:
+        # Keep the rows in a standalone table that is no longer read by the app
+        cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+        cursor.execute(f'ALTER TABLE "{name}" RENAME TO "{table}_archive_{month:%Y%m}"')
+    else:
+        cursor.execute(f'DROP TABLE "{name}"')
+    return name
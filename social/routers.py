@@ -0,0 +1,81 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject, empty
+
+# Read replica routing. Reads go to a replica only inside a request with a safe method (GET, HEAD,
+# OPTIONS) whose user did not write recently; everything else (writes, reads in write requests,
+# management commands, the activity log writer) uses the primary. After a successful write the
+# user is pinned to the primary for DB_REPLICA_PIN_SECONDS, so they read their own writes even
+# when the replicas lag behind. The pins live in the cache, so replicas need a cache shared by all
+# workers (settings.CACHE_SHARED). Until the user of a request is known, authentication included,
+# reads stay on the primary: a replica may not have a new account or a password change yet.
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_request_state = ContextVar('db_routing_state', default=None)
+
+
+def pin_key(user_id):
+    return f"db_pin:{user_id}"
+
+
+class RoutingState:
+    def __init__(self, request):
+        self.request = request
+        self.use_replica = None
+
+    def replica_allowed(self):
+        if self.use_replica is None:
+            if self.request.method not in SAFE_METHODS:
+                self.use_replica = False
+            else:
+                user = self.known_user()
+                if user is None or not user.is_authenticated:
+                    # Not decided for good until the user is known (authentication happens in the view)
+                    return False
+                self.use_replica = not cache.get(pin_key(user.pk))
+        return self.use_replica
+
+    def known_user(self):
+        # request.user without evaluating a lazy session user, that would read the database from here
+        user = self.request.__dict__.get('user')
+        if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            return None
+        return user
+
+
+def start_request(request):
+    return _request_state.set(RoutingState(request))
+
+
+def end_request(token):
+    _request_state.reset(token)
+
+
+def pin_to_primary(user_id):
+    cache.set(pin_key(user_id), True, settings.DB_REPLICA_PIN_SECONDS)
+
+
+async def apin_to_primary(user_id):
+    await cache.aset(pin_key(user_id), True, settings.DB_REPLICA_PIN_SECONDS)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if settings.DATABASE_REPLICAS and state is not None and state.replica_allowed():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -1,12 +1,34 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.contrib.postgres.search import SearchVector
+from .authentication import AUTH_FIELDS, CACHED_USER_FIELDS, forget_cached_user, user_changed
+from .backends import forget_unknown_email
 from .models import CustomUser  # Adjust this import based on your project structure
 
 @receiver(post_save, sender=CustomUser)
-def update_search_vector(sender, instance, **kwargs):
-    # Update the search vector whenever a user is saved
-    instance.search_vector = (
-        SearchVector('first_name', 'last_name')
-    )
-    instance.save()
+def update_search_vector(sender, instance, created, update_fields=None, **kwargs):
+    # Only when a name changed, a save of other fields (last_login, password, role) leaves the vector alone
+    if update_fields is not None and not set(update_fields) & set(CustomUser.SEARCH_VECTOR_FIELDS):
+        return
+    names = tuple(getattr(instance, field) for field in CustomUser.SEARCH_VECTOR_FIELDS)
+    if not created and getattr(instance, '_loaded_search_fields', None) == names:
+        return
+    # A single UPDATE ... SET search_vector = to_tsvector(...), instance.save() here would fire post_save again
+    CustomUser.objects.update_search_vectors(pk=instance.pk)
+    instance._loaded_search_fields = names
+
+
+@receiver(post_save, sender=CustomUser)
+def forget_login_miss(sender, instance, created, **kwargs):
+    # A new account must not be refused by an earlier failed login with its email
+    if created:
+        forget_unknown_email(instance.email)
+
+
+@receiver(post_save, sender=CustomUser)
+def expire_token_claims(sender, instance, created, update_fields=None, **kwargs):
+    # Tokens issued before this save may carry an old role or is_active. A save of other fields
+    # (last_login on every login) keeps them, it only drops the cached user when one of its fields changed.
+    if update_fields is None or set(update_fields) & set(AUTH_FIELDS):
+        user_changed(instance.pk)
+    elif set(update_fields) & set(CACHED_USER_FIELDS):
+        forget_cached_user(instance.pk)
@@ -0,0 +1,187 @@
+import atexit
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+
+from .models import Block, Friendship, FriendSuggestion
+
+logger = logging.getLogger(__name__)
+
+# Friend suggestions built on the accepted-friend graph (the Friendship edges).
+# Adjacency is loaded set-wise, a handful of queries per batch of users, and everything else is
+# set intersections and counting in memory.
+
+ADJACENCY_CHUNK_SIZE = 5000
+
+
+def adjacency(user_ids):
+    friends = defaultdict(set)
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), ADJACENCY_CHUNK_SIZE):
+        rows = Friendship.objects.filter(
+            user_id__in=user_ids[start:start + ADJACENCY_CHUNK_SIZE]
+        ).values_list('user_id', 'friend_id')
+        for user_id, friend_id in rows:
+            friends[user_id].add(friend_id)
+    return friends
+
+
+def excluded_users(user_ids):
+    # Everyone on either side of a block, per user
+    excluded = defaultdict(set)
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), ADJACENCY_CHUNK_SIZE):
+        chunk = user_ids[start:start + ADJACENCY_CHUNK_SIZE]
+        rows = Block.objects.filter(Q(blocker_id__in=chunk) | Q(blocked_id__in=chunk)).values_list('blocker_id', 'blocked_id')
+        for blocker_id, blocked_id in rows:
+            excluded[blocker_id].add(blocked_id)
+            excluded[blocked_id].add(blocker_id)
+    return excluded
+
+
+def mutual_friend_ids(user_id, other_id):
+    friends = adjacency([user_id, other_id])
+    return sorted(friends[user_id] & friends[other_id])
+
+
+def top_suggestions(user_id, friends, friends_of_friends, excluded, limit):
+    counts = Counter()
+    for friend_id in friends:
+        counts.update(friends_of_friends.get(friend_id, ()))
+    for user in friends | excluded | {user_id}:
+        counts.pop(user, None)
+    # Most mutual friends first, lowest id on ties so rebuilds are deterministic
+    return heapq.nlargest(limit, counts.items(), key=lambda item: (item[1], -item[0]))
+
+
+def refresh_suggestions(user_ids, limit=None):
+    limit = limit or settings.SUGGESTIONS_LIMIT
+    user_ids = list(user_ids)
+    friends = adjacency(user_ids)
+    friends_of_friends = adjacency(set().union(*friends.values()) if friends else ())
+    excluded = excluded_users(user_ids)
+
+    suggestions = [
+        FriendSuggestion(user_id=user_id, suggested_id=suggested_id, mutual_count=mutual_count)
+        for user_id in user_ids
+        for suggested_id, mutual_count in top_suggestions(
+            user_id, friends.get(user_id, set()), friends_of_friends, excluded.get(user_id, set()), limit
+        )
+    ]
+    with transaction.atomic():
+        FriendSuggestion.objects.filter(user_id__in=user_ids).delete()
+        FriendSuggestion.objects.bulk_create(suggestions, batch_size=ADJACENCY_CHUNK_SIZE)
+    return friends
+
+
+# Rebuilds of single users' suggestions, queued by the friendship changes and run by a background
+# thread so that accepting a request does not wait for the friends-of-friends recompute.
+# Users queued while a rebuild runs are merged into the next one, the delay lets a burst coalesce.
+class SuggestionRefresher:
+    def __init__(self, delay):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._pending = set()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def schedule(self, user_ids):
+        with self._lock:
+            # A forked worker inherits the pending ids but not the thread, start over in the child
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pending = set()
+                self._thread = None
+            self._pending.update(user_ids)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='suggestion-refresher', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.delay)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+            # Idle until the next change, the connection is not kept open meanwhile
+            connection.close()
+
+    def flush(self):
+        # Rebuilds everything queued so far from the calling thread
+        with self._lock:
+            user_ids, self._pending = self._pending, set()
+        if not user_ids:
+            return
+        try:
+            refresh_suggestions(sorted(user_ids))
+        except Exception:
+            logger.exception("Failed to refresh the suggestions of %d users", len(user_ids))
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def get_refresher():
+    global _refresher
+    if _refresher is None:
+        with _refresher_lock:
+            if _refresher is None:
+                _refresher = SuggestionRefresher(settings.SUGGESTIONS_REFRESH_DELAY)
+                atexit.register(_refresher.flush)
+    return _refresher
+
+
+def schedule_refresh(user_ids):
+    # After the commit, the rebuild has to see the new edges
+    user_ids = list(user_ids)
+    if settings.SUGGESTIONS_ASYNC:
+        transaction.on_commit(lambda: get_refresher().schedule(user_ids))
+    else:
+        transaction.on_commit(lambda: refresh_suggestions(user_ids))
+
+
+def adjust_neighbours(friends, user_id, friend_ids, delta):
+    # user_id and each of friend_ids became (or stopped being) a mutual friend between the other one
+    # and each of their own friends, so the neighbours' suggestions of the other one gain (or lose) one
+    missing = []
+    for friend_id in friend_ids:
+        for user, other in ((user_id, friend_id), (friend_id, user_id)):
+            neighbours = friends.get(user, set()) - friends.get(other, set()) - {other}
+            if not neighbours:
+                continue
+            suggestions = FriendSuggestion.objects.filter(user_id__in=neighbours, suggested_id=other)
+            suggestions.update(mutual_count=F('mutual_count') + delta)
+            if delta > 0:
+                missing.extend(FriendSuggestion(user_id=neighbour, suggested_id=other, mutual_count=delta) for neighbour in neighbours)
+            else:
+                suggestions.filter(mutual_count__lte=0).delete()
+    if missing:
+        FriendSuggestion.objects.bulk_create(missing, ignore_conflicts=True, batch_size=ADJACENCY_CHUNK_SIZE)
+
+
+def on_friendship_created(user_id, *friend_ids):
+    friends = adjacency([user_id, *friend_ids])
+    # New friends no longer suggest each other, their full rebuild runs in the background
+    FriendSuggestion.objects.filter(
+        Q(user_id=user_id, suggested_id__in=friend_ids) | Q(user_id__in=friend_ids, suggested_id=user_id)
+    ).delete()
+    # Existing suggestions gain one, missing ones start at one and the next full rebuild settles the exact counts
+    adjust_neighbours(friends, user_id, friend_ids, 1)
+    schedule_refresh([user_id, *friend_ids])
+
+
+def on_friendship_removed(user_id, *friend_ids):
+    # Called after the edges are gone, the former friends may now suggest each other again
+    adjust_neighbours(adjacency([user_id, *friend_ids]), user_id, friend_ids, -1)
+    schedule_refresh([user_id, *friend_ids])
@@ -1,3 +1,1220 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.hashers import get_hashers, make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import Q
+from django.http import HttpResponse
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APITestCase
+
+from . import async_views, views
+from .activity import ActivityLogWriter
+from .authentication import ClaimsRefreshToken, ClaimsUser, user_cache_key, user_changed_key
+from .blocks import get_block_set
+from .caching import cache_stats, get_cached, invalidate, set_cached
+from .custom_manager import CustomUserManager
+from . import renderers
+from .metrics import registry
+from .middleware import PrimaryReplicaMiddleware
+from .models import Block, CustomUser, FriendRequest, Friendship, FriendSuggestion, UserActivityLog
+from .pagination import KeysetPagination, SearchKeysetPagination
+from .partitions import add_months, create_partition, default_partition_name, list_partitions, month_start, partition_name, table_exists
+from .routers import PrimaryReplicaRouter, end_request, pin_key, start_request
+from .suggestions import SuggestionRefresher, refresh_suggestions
+from .throttling import SlidingWindowLimiter, WeightedRateThrottle
+
+
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+
+# Full-text search, trigram indexes and partitions only exist on PostgreSQL
+postgres_only = unittest.skipUnless(connection.vendor == 'postgresql', "Needs PostgreSQL")
+
+
+class StatementCountMixin:
+    def assertStatements(self, expected, func):
+        # Transaction control is left out, the test run wraps everything in savepoints
+        with CaptureQueriesContext(connection) as context:
+            result = func()
+        statements = [query['sql'] for query in context.captured_queries if not query['sql'].startswith(TRANSACTION_STATEMENTS)]
+        self.assertEqual(len(statements), expected, '\n'.join(statements))
+        return result
+
+
+# Accepting, unfriending and blocking keep both friendship edges in step with the requests.
+@override_settings(ACTIVITY_LOG_ASYNC=False)
+class FriendshipEdgesTest(APITestCase):
+    def setUp(self):
+        self.sender = CustomUser.objects.create_user('sender@example.com', 'Passw0rd#', first_name='sender')
+        self.receiver = CustomUser.objects.create_user('receiver@example.com', 'Passw0rd#', first_name='receiver')
+        self.client = APIClient()
+        self.client.force_authenticate(self.receiver)
+        cache.clear()
+        friend_request = FriendRequest.objects.create(sender=self.sender, receiver=self.receiver)
+        response = self.client.put(f'/api/friend-request/{friend_request.pk}/', {'action': 'accept'})
+        self.assertEqual(response.status_code, 200)
+
+    def edges(self):
+        return set(Friendship.objects.values_list('user_id', 'friend_id'))
+
+    def friend_emails(self):
+        response = self.client.get('/api/friend-list/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['friends']
+
+    def test_accept_adds_both_edges(self):
+        self.assertEqual(self.edges(), {(self.sender.id, self.receiver.id), (self.receiver.id, self.sender.id)})
+        self.assertEqual(self.friend_emails(), ['sender@example.com'])
+
+    def test_failed_accept_leaves_the_request_pending(self):
+        friend_request = FriendRequest.objects.get()
+        FriendRequest.objects.filter(pk=friend_request.pk).update(status='pending')
+        Friendship.objects.all().delete()
+        with mock.patch.object(Friendship.objects, 'add_pair', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.client.put(f'/api/friend-request/{friend_request.pk}/', {'action': 'accept'})
+        friend_request.refresh_from_db()
+        self.assertEqual(friend_request.status, 'pending')
+        self.assertEqual(self.edges(), set())
+
+    def test_unfriend_removes_both_edges(self):
+        self.friend_emails()
+        response = self.client.post('/api/unfriend/', {'friend_email': 'sender@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.edges(), set())
+        self.assertFalse(FriendRequest.objects.exists())
+        self.assertEqual(self.friend_emails(), [])
+
+    def test_block_removes_both_edges(self):
+        self.friend_emails()
+        response = self.client.post('/api/blocked/', {'blocked_email': 'sender@example.com'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.edges(), set())
+        self.assertEqual(self.friend_emails(), [])
+
+
+# User search: exact email first, then full-text search on the stored name vector.
+class UserSearchTest(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('viewer@example.com', 'Passw0rd#', first_name='viewer')
+        self.alice = CustomUser.objects.create_user('alice@example.com', 'Passw0rd#', first_name='Alice', last_name='Walker')
+        self.bob = CustomUser.objects.create_user('bob@example.com', 'Passw0rd#', first_name='Bob', last_name='Walker')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def search(self, keyword):
+        return self.client.get('/api/user-search', {'q': keyword})
+
+    def test_exact_email_match(self):
+        response = self.search('ALICE@example.com')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.alice.id)
+
+    @postgres_only
+    def test_name_search_reads_the_stored_vector(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.search('walker')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['email'] for user in response.json()['results']], ['alice@example.com', 'bob@example.com'])
+        # The vector is not rebuilt per row at query time
+        search_sql = [query['sql'] for query in context.captured_queries if '@@' in query['sql']]
+        self.assertTrue(search_sql)
+        self.assertNotIn('to_tsvector', search_sql[0])
+
+    @postgres_only
+    def test_renamed_user_is_found_by_the_new_name(self):
+        self.bob.last_name = 'Marley'
+        self.bob.save()
+        response = self.search('marley')
+        self.assertEqual([user['email'] for user in response.json()['results']], ['bob@example.com'])
+        self.assertEqual([user['email'] for user in self.search('walker').json()['results']], ['alice@example.com'])
+
+
+# The typeahead lookups are served by the trigram indexes.
+@postgres_only
+class TrigramIndexTest(APITestCase):
+    def test_prefix_lookup_uses_the_trigram_index(self):
+        CustomUser.objects.create_user('alice@example.com', 'Passw0rd#', first_name='Alice')
+        queryset = CustomUser.objects.filter(email__istartswith='ali')
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertIn('user_email_trgm', queryset.explain())
+
+
+# Namespaced cache keys, invalidating a namespace drops all of its keys and nothing else.
+class CacheNamespaceTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_returns_what_was_set(self):
+        set_cached('friends_list:1', 'friends', ['a@example.com'])
+        self.assertEqual(get_cached('friends_list:1', 'friends'), ['a@example.com'])
+        self.assertIsNone(get_cached('friends_list:1', 'other'))
+        self.assertEqual(get_cached('friends_list:1', 'other', 'default'), 'default')
+
+    def test_cached_none_is_a_hit(self):
+        set_cached('friends_list:1', 'empty', None)
+        self.assertEqual(get_cached('friends_list:1', 'empty', 'default'), None)
+
+    def test_invalidate_drops_every_key_of_the_namespace(self):
+        set_cached('pending_requests:1', 'page-1', [1])
+        set_cached('pending_requests:1', 'page-2', [2])
+        invalidate('pending_requests:1')
+        self.assertIsNone(get_cached('pending_requests:1', 'page-1'))
+        self.assertIsNone(get_cached('pending_requests:1', 'page-2'))
+        # New entries are cached under the new version
+        set_cached('pending_requests:1', 'page-1', [3])
+        self.assertEqual(get_cached('pending_requests:1', 'page-1'), [3])
+
+    def test_invalidate_leaves_other_namespaces_alone(self):
+        set_cached('friends_list:1', 'friends', ['a'])
+        set_cached('friends_list:2', 'friends', ['b'])
+        set_cached('friends_list:3', 'friends', ['c'])
+        invalidate('friends_list:1', 'friends_list:2')
+        self.assertIsNone(get_cached('friends_list:1', 'friends'))
+        self.assertIsNone(get_cached('friends_list:2', 'friends'))
+        self.assertEqual(get_cached('friends_list:3', 'friends'), ['c'])
+
+    def test_hits_and_misses_are_counted(self):
+        before = cache_stats()
+        get_cached('friends_list:1', 'friends')
+        set_cached('friends_list:1', 'friends', [])
+        get_cached('friends_list:1', 'friends')
+        after = cache_stats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+
+# The pending requests pages are cached until the receiver's inbox changes.
+@override_settings(ACTIVITY_LOG_ASYNC=False)
+class PendingRequestsCacheTest(StatementCountMixin, APITestCase):
+    def setUp(self):
+        self.receiver = CustomUser.objects.create_user('receiver@example.com', 'Passw0rd#', first_name='receiver')
+        self.first = CustomUser.objects.create_user('first@example.com', 'Passw0rd#', first_name='first')
+        self.second = CustomUser.objects.create_user('second@example.com', 'Passw0rd#', first_name='second')
+        self.friend_request = FriendRequest.objects.create(sender=self.first, receiver=self.receiver)
+        self.client = APIClient()
+        self.client.force_authenticate(self.receiver)
+        cache.clear()
+
+    def pending_senders(self):
+        response = self.client.get('/api/pending-list/', {'page': 1})
+        self.assertEqual(response.status_code, 200)
+        return [row['sender_id'] for row in response.json()['results']]
+
+    def test_second_read_is_served_from_the_cache(self):
+        self.assertEqual(self.pending_senders(), [self.first.id])
+        self.assertEqual(self.assertStatements(0, self.pending_senders), [self.first.id])
+
+    def test_new_request_invalidates_the_page(self):
+        self.pending_senders()
+        sender = APIClient()
+        sender.force_authenticate(self.second)
+        self.assertEqual(sender.post('/api/friend-request/', {'receiver_email': 'receiver@example.com'}).status_code, 201)
+        self.assertEqual(sorted(self.pending_senders()), sorted([self.first.id, self.second.id]))
+
+    def test_accept_and_reject_invalidate_the_page(self):
+        other = FriendRequest.objects.create(sender=self.second, receiver=self.receiver)
+        self.pending_senders()
+        self.client.put(f'/api/friend-request/{self.friend_request.pk}/', {'action': 'accept'})
+        self.assertEqual(self.pending_senders(), [self.second.id])
+        self.client.put(f'/api/friend-request/{other.pk}/', {'action': 'reject'})
+        self.assertEqual(self.pending_senders(), [])
+
+
+# Keyset pagination: the cursor round trip, ties on the first ordering field and bad cursors.
+class KeysetPaginationTest(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('viewer@example.com', 'Passw0rd#', first_name='viewer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def walk(self, path, params, key):
+        seen = []
+        response = self.client.get(path, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row[key] for row in response.json()['results'])
+            if not response.json()['next']:
+                return seen
+            response = self.client.get(response.json()['next'])
+
+    def test_cursor_pages_keep_every_row_once_on_ties(self):
+        created_at = timezone.now().replace(microsecond=123456)
+        for index in range(7):
+            sender = CustomUser.objects.create_user(f'sender{index}@example.com', 'Passw0rd#')
+            FriendRequest.objects.create(sender=sender, receiver=self.user)
+        # Half of them at the same moment
+        FriendRequest.objects.filter(pk__in=FriendRequest.objects.order_by('id').values('id')[:4]).update(created_at=created_at)
+        expected = list(FriendRequest.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/pending-list/', {'pagination': 'cursor', 'page_size': 2}, 'request_id'), expected)
+
+    def test_cursor_round_trip_keeps_full_precision(self):
+        paginator = SearchKeysetPagination()
+        request = Request(RequestFactory().get('/', {'cursor': paginator.encode_cursor([Decimal('0.0607927100'), 42])}))
+        self.assertEqual(paginator.decode_cursor(request), ['0.0607927100', 42])
+
+        paginator = KeysetPagination()
+        moment = timezone.now().replace(microsecond=654321)
+        request = Request(RequestFactory().get('/', {'cursor': paginator.encode_cursor([moment, 7])}))
+        self.assertEqual(paginator.decode_cursor(request), [moment.isoformat(), 7])
+
+    def test_position_has_a_leading_range_bound(self):
+        condition = KeysetPagination().after_position([timezone.now(), 7])
+        sql = str(FriendRequest.objects.filter(condition).query)
+        self.assertIn('"created_at" <=', sql)
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ('not-base64!', 'bm90IGpzb24=', 'WzFd'):
+            response = self.client.get('/api/pending-list/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+    @postgres_only
+    def test_search_cursor_keeps_every_row_once_on_equal_ranks(self):
+        for index in range(5):
+            CustomUser.objects.create_user(f'walker{index}@example.com', 'Passw0rd#', first_name='Walker')
+        expected = [f'walker{index}@example.com' for index in range(5)]
+        self.assertEqual(self.walk('/api/user-search', {'q': 'walker', 'pagination': 'cursor', 'page_size': 2}, 'email'), expected)
+
+
+# Activity log date filters and the streaming JSONL export.
+class UserActivityLogFilterTest(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('viewer@example.com', 'Passw0rd#', first_name='viewer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        noon = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.days = [noon - timedelta(days=offset) for offset in (3, 2, 1)]
+        for index, created_at in enumerate(self.days):
+            UserActivityLog.objects.create(user=self.user, activity=f"activity {index}", created_at=created_at)
+
+    def activities(self, **params):
+        response = self.client.get('/api/user-activity/', params)
+        self.assertEqual(response.status_code, 200)
+        return [log['activity'] for log in response.json()['results']]
+
+    def test_date_bounds_include_whole_days(self):
+        self.assertEqual(self.activities(since=self.days[1].date().isoformat()), ['activity 2', 'activity 1'])
+        self.assertEqual(self.activities(until=self.days[1].date().isoformat()), ['activity 1', 'activity 0'])
+        day = self.days[1].date().isoformat()
+        self.assertEqual(self.activities(since=day, until=day), ['activity 1'])
+
+    def test_datetime_bounds(self):
+        since = (self.days[1] + timedelta(minutes=1)).isoformat()
+        self.assertEqual(self.activities(since=since), ['activity 2'])
+        self.assertEqual(self.activities(until=self.days[1].isoformat()), ['activity 0'])
+
+    def test_invalid_bound_is_rejected(self):
+        for params in ({'since': 'yesterday'}, {'until': '2024-13-45'}):
+            response = self.client.get('/api/user-activity/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_jsonl_export(self):
+        response = self.client.get('/api/user-activity/', {'export': 'jsonl', 'since': self.days[1].date().isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'activity': f'activity {index}', 'created_at': self.days[index].isoformat(), 'user_email': 'viewer@example.com'}
+            for index in (2, 1)
+        ])
+
+
+# The activity log writer: batches, the flush interval, backpressure and the flush on shutdown.
+# A TransactionTestCase, the writer thread has its own database connection.
+class ActivityLogWriterTest(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('writer@example.com', 'Passw0rd#', first_name='writer')
+
+    def writer(self, **options):
+        options = {'batch_size': 3, 'flush_interval': 0.1, 'queue_size': 100, 'put_timeout': 0.01, **options}
+        return ActivityLogWriter(**options)
+
+    def test_collect_returns_full_batches_first(self):
+        writer = self.writer(flush_interval=5)
+        with mock.patch.object(writer, '_ensure_started'):
+            for index in range(4):
+                writer.log(self.user.id, f"activity {index}")
+        start = time.monotonic()
+        self.assertEqual([entry.activity for entry in writer._collect()], ['activity 0', 'activity 1', 'activity 2'])
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_collect_returns_a_partial_batch_after_the_flush_interval(self):
+        writer = self.writer(flush_interval=0.1)
+        with mock.patch.object(writer, '_ensure_started'):
+            writer.log(self.user.id, "activity")
+        start = time.monotonic()
+        self.assertEqual(len(writer._collect()), 1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(writer._collect(), [])
+
+    def test_full_queue_writes_inline(self):
+        writer = self.writer(queue_size=1)
+        with mock.patch.object(writer, '_ensure_started'):
+            writer.log(self.user.id, "queued")
+            writer.log(self.user.id, "inline")
+        self.assertEqual(list(UserActivityLog.objects.values_list('activity', flat=True)), ['inline'])
+        stats = writer.stats()
+        self.assertEqual((stats['enqueued'], stats['queue_full'], stats['written_inline'], stats['queue_depth']), (1, 1, 1, 1))
+
+    def test_stop_flushes_the_queue(self):
+        writer = self.writer(batch_size=100, flush_interval=60)
+        with mock.patch.object(writer, '_ensure_started'):
+            writer.log(self.user.id, "first")
+            writer.log(self.user.id, "second")
+        self.assertFalse(UserActivityLog.objects.exists())
+        writer.stop()
+        self.assertEqual(sorted(UserActivityLog.objects.values_list('activity', flat=True)), ['first', 'second'])
+        self.assertEqual((writer.stats()['written'], writer.stats()['flushes']), (2, 1))
+
+    def test_background_thread_writes_in_batches(self):
+        writer = self.writer(batch_size=2, flush_interval=0.05)
+        for index in range(5):
+            writer.log(self.user.id, f"activity {index}")
+        deadline = time.monotonic() + 5
+        while writer.stats()['written'] < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        writer.stop()
+        self.assertEqual(UserActivityLog.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(writer.stats()['written'], 5)
+        self.assertGreaterEqual(writer.stats()['flushes'], 3)
+
+    def test_background_thread_closes_its_connection(self):
+        writer = self.writer(batch_size=1, flush_interval=0.05)
+        with mock.patch('social.activity.connection') as thread_connection:
+            writer.log(self.user.id, "activity")
+            deadline = time.monotonic() + 5
+            # Closed after the flush, before the writer goes idle
+            while not thread_connection.close.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(thread_connection.close.called)
+            writer.stop()
+        self.assertEqual(UserActivityLog.objects.filter(user=self.user).count(), 1)
+
+
+# Monthly activity log partitions: creating and attaching them, rows moved out of the default
+# partition, and the retention run of manage_activity_partitions.
+@postgres_only
+class ActivityPartitionsTest(TestCase):
+    table = UserActivityLog._meta.db_table
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('logger@example.com', 'Passw0rd#', first_name='logger')
+        self.current = month_start(timezone.now())
+
+    def partitions(self):
+        with connection.cursor() as cursor:
+            return list_partitions(cursor, self.table)
+
+    def rows_in(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM "{name}"')
+            return cursor.fetchone()[0]
+
+    def log_in(self, month, activity):
+        created_at = datetime(month.year, month.month, 15, tzinfo=dt_timezone.utc)
+        return UserActivityLog.objects.create(user=self.user, activity=activity, created_at=created_at)
+
+    def test_rows_land_in_their_month(self):
+        self.assertIn(self.current, self.partitions())
+        self.log_in(self.current, "now")
+        self.assertEqual(self.rows_in(partition_name(self.table, self.current)), 1)
+
+    def test_create_partition_moves_rows_out_of_the_default_partition(self):
+        month = add_months(self.current, 36)
+        self.log_in(month, "later")
+        self.assertEqual(self.rows_in(default_partition_name(self.table)), 1)
+
+        with connection.cursor() as cursor:
+            self.assertTrue(create_partition(cursor, self.table, month))
+            self.assertFalse(create_partition(cursor, self.table, month))
+        self.assertIn(month, self.partitions())
+        self.assertEqual(self.rows_in(default_partition_name(self.table)), 0)
+        self.assertEqual(self.rows_in(partition_name(self.table, month)), 1)
+        self.assertTrue(UserActivityLog.objects.filter(activity="later").exists())
+
+    def test_command_creates_the_months_ahead(self):
+        call_command('manage_activity_partitions', ahead=6, stdout=open(os.devnull, 'w'))
+        partitions = self.partitions()
+        for offset in range(7):
+            self.assertIn(add_months(self.current, offset), partitions)
+
+    def expired_partition(self):
+        month = add_months(self.current, -13)
+        with connection.cursor() as cursor:
+            create_partition(cursor, self.table, month)
+        self.log_in(month, "expired")
+        self.log_in(self.current, "kept")
+        return month
+
+    def test_command_drops_expired_partitions(self):
+        month = self.expired_partition()
+        # The user FK is deferred, a partition with pending checks can not be dropped in this transaction
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        with tempfile.TemporaryFile('w+') as output:
+            call_command('manage_activity_partitions', retention=12, dry_run=True, stdout=output)
+            self.assertIn(month, self.partitions())
+            call_command('manage_activity_partitions', retention=12, stdout=output)
+            output.seek(0)
+            self.assertIn(f"Dropped {partition_name(self.table, month)}", output.read())
+        self.assertNotIn(month, self.partitions())
+        self.assertIn(self.current, self.partitions())
+        self.assertEqual(list(UserActivityLog.objects.values_list('activity', flat=True)), ["kept"])
+
+    def test_command_archives_expired_partitions(self):
+        month = self.expired_partition()
+        call_command('manage_activity_partitions', retention=12, archive=True, stdout=open(os.devnull, 'w'))
+        self.assertNotIn(month, self.partitions())
+        archive = f"{self.table}_archive_{month:%Y%m}"
+        with connection.cursor() as cursor:
+            self.assertTrue(table_exists(cursor, archive))
+        self.assertEqual(self.rows_in(archive), 1)
+        self.assertEqual(list(UserActivityLog.objects.values_list('activity', flat=True)), ["kept"])
+
+
+# Search and the friend list hide users on either side of a block.
+class BlockFilterTest(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('viewer@example.com', 'Passw0rd#', first_name='Viewer')
+        self.friend = CustomUser.objects.create_user('walker.friend@example.com', 'Passw0rd#', first_name='Walker')
+        self.blocked = CustomUser.objects.create_user('walker.blocked@example.com', 'Passw0rd#', first_name='Walker')
+        self.blocker = CustomUser.objects.create_user('walker.blocker@example.com', 'Passw0rd#', first_name='Walker')
+        for other in (self.friend, self.blocked, self.blocker):
+            Friendship.objects.add_pair(self.user.id, other.id)
+        Block.objects.create(blocker=self.user, blocked=self.blocked)
+        Block.objects.create(blocker=self.blocker, blocked=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def test_friend_list_hides_blocked_users(self):
+        response = self.client.get('/api/friend-list/')
+        self.assertEqual(response.json()['friends'], ['walker.friend@example.com'])
+
+    # A hidden email match falls through to the full-text search
+    @postgres_only
+    def test_email_search_hides_blocked_users(self):
+        self.assertEqual(self.client.get('/api/user-search', {'q': 'walker.friend@example.com'}).status_code, 200)
+        for email in ('walker.blocked@example.com', 'walker.blocker@example.com'):
+            self.assertEqual(self.client.get('/api/user-search', {'q': email}).status_code, 404, email)
+
+    def test_typeahead_hides_blocked_users(self):
+        response = self.client.get('/api/user-search', {'q': 'walk', 'mode': 'prefix'})
+        self.assertEqual([user['email'] for user in response.json()['results']], ['walker.friend@example.com'])
+
+    @postgres_only
+    def test_name_search_hides_blocked_users(self):
+        response = self.client.get('/api/user-search', {'q': 'walker'})
+        self.assertEqual([user['email'] for user in response.json()['results']], ['walker.friend@example.com'])
+
+
+# Friend suggestions follow the friendship changes, the users' full rebuild runs after the commit.
+@override_settings(ACTIVITY_LOG_ASYNC=False, SUGGESTIONS_ASYNC=False)
+class FriendSuggestionsTest(APITestCase):
+    def setUp(self):
+        self.users = {
+            name: CustomUser.objects.create_user(f'{name}@example.com', 'Passw0rd#', first_name=name)
+            for name in ('alice', 'bob', 'carol', 'dave', 'erin')
+        }
+        # alice - bob - carol and alice - erin - carol
+        for left, right in (('alice', 'bob'), ('bob', 'carol'), ('alice', 'erin'), ('erin', 'carol')):
+            Friendship.objects.add_pair(self.users[left].id, self.users[right].id)
+        refresh_suggestions([user.id for user in self.users.values()])
+        cache.clear()
+
+    def client_for(self, name):
+        client = APIClient()
+        client.force_authenticate(self.users[name])
+        return client
+
+    def suggestions(self, name):
+        return {
+            CustomUser.objects.get(pk=suggested_id).first_name: mutual_count
+            for suggested_id, mutual_count in FriendSuggestion.objects.filter(user=self.users[name]).values_list('suggested_id', 'mutual_count')
+        }
+
+    def accept(self, sender, receiver):
+        friend_request = FriendRequest.objects.create(sender=self.users[sender], receiver=self.users[receiver])
+        response = self.client_for(receiver).put(f'/api/friend-request/{friend_request.pk}/', {'action': 'accept'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_rebuild_counts_mutual_friends(self):
+        self.assertEqual(self.suggestions('alice'), {'carol': 2})
+        self.assertEqual(self.suggestions('dave'), {})
+
+    def test_accept_updates_the_suggestions(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.accept('dave', 'bob')
+        # bob's other friends gain dave, dave's own list is rebuilt
+        self.assertEqual(self.suggestions('alice'), {'carol': 2, 'dave': 1})
+        self.assertEqual(self.suggestions('carol'), {'alice': 2, 'dave': 1})
+        self.assertEqual(self.suggestions('dave'), {'alice': 1, 'carol': 1})
+
+    def test_accept_defers_the_rebuild(self):
+        with override_settings(SUGGESTIONS_ASYNC=True), \
+                mock.patch('social.suggestions.get_refresher') as get_refresher, \
+                mock.patch('social.suggestions.refresh_suggestions') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.accept('alice', 'carol')
+            refresh.assert_not_called()
+        get_refresher.return_value.schedule.assert_called_once_with([self.users['alice'].id, self.users['carol'].id])
+        # The new friends stop suggesting each other right away
+        self.assertEqual(self.suggestions('alice'), {})
+        self.assertEqual(self.suggestions('carol'), {})
+
+    def test_unfriend_decrements_the_neighbours(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for('bob').post('/api/unfriend/', {'friend_email': 'carol@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.suggestions('alice'), {'carol': 1})
+        self.assertEqual(self.suggestions('carol'), {'alice': 1})
+
+    def test_last_mutual_friend_removed_drops_the_suggestion(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_for('bob').post('/api/unfriend/', {'friend_email': 'carol@example.com'})
+            self.client_for('erin').post('/api/blocked/', {'blocked_email': 'carol@example.com'})
+        self.assertEqual(self.suggestions('alice'), {})
+
+    def test_refresher_merges_queued_users(self):
+        refresher = SuggestionRefresher(delay=0)
+        with mock.patch('social.suggestions.threading.Thread'), mock.patch('social.suggestions.refresh_suggestions') as refresh:
+            refresher.schedule([3, 1])
+            refresher.schedule([2, 3])
+            refresher.flush()
+            refresher.flush()
+        refresh.assert_called_once_with([1, 2, 3])
+
+    def test_mutual_friends_hide_blocked_users(self):
+        client = self.client_for('alice')
+        response = client.get(f"/api/mutual-friends/{self.users['carol'].id}/")
+        self.assertEqual(response.json()['mutual_friends'], ['bob@example.com', 'erin@example.com'])
+
+        Block.objects.create(blocker=self.users['erin'], blocked=self.users['alice'])
+        cache.clear()
+        response = client.get(f"/api/mutual-friends/{self.users['carol'].id}/")
+        self.assertEqual((response.json()['mutual_count'], response.json()['mutual_friends']), (1, ['bob@example.com']))
+
+        Block.objects.create(blocker=self.users['alice'], blocked=self.users['carol'])
+        cache.clear()
+        self.assertEqual(client.get(f"/api/mutual-friends/{self.users['carol'].id}/").status_code, 404)
+
+
+# Sending a friend request has to stay a fixed, small number of queries.
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHE_SHARED=True)
+class FriendRequestSendQueriesTest(StatementCountMixin, APITestCase):
+    def setUp(self):
+        self.sender = CustomUser.objects.create_user('sender@example.com', 'Passw0rd#', first_name='sender')
+        self.receiver = CustomUser.objects.create_user('receiver@example.com', 'Passw0rd#', first_name='receiver')
+        self.client = APIClient()
+        self.client.force_authenticate(self.sender)
+        cache.clear()
+
+    def send(self, email='receiver@example.com'):
+        return self.client.post('/api/friend-request/', {'receiver_email': email})
+
+    def test_send_uses_three_queries(self):
+        # Combined lookup, insert and the activity log insert, block checks come from the cached block set
+        get_block_set(self.sender.id)
+        response = self.assertStatements(3, self.send)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(FriendRequest.objects.filter(sender=self.sender, receiver=self.receiver, status='pending').exists())
+
+    def test_duplicate_send_is_rejected_after_one_query(self):
+        self.send()
+        response = self.assertStatements(1, self.send)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(FriendRequest.objects.count(), 1)
+
+    def test_blocked_receiver_is_rejected_after_one_query(self):
+        Block.objects.create(blocker=self.receiver, blocked=self.sender)
+        get_block_set(self.sender.id)
+        response = self.assertStatements(1, self.send)
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_block_sets_are_not_cached_per_process(self):
+        # Another worker could not invalidate this process's copy
+        get_block_set(self.sender.id)
+        Block.objects.create(blocker=self.receiver, blocked=self.sender)
+        self.assertTrue(get_block_set(self.sender.id).is_blocked_by(self.receiver.id))
+        self.assertEqual(self.send().status_code, 403)
+
+    def test_resend_after_cooldown_reuses_rejected_request(self):
+        FriendRequest.objects.create(
+            sender=self.sender, receiver=self.receiver, status='rejected',
+            rejected_at=timezone.now() - timedelta(days=2)
+        )
+        get_block_set(self.sender.id)
+        response = self.assertStatements(3, self.send)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(FriendRequest.objects.get().status, 'pending')
+
+    def test_rate_limit(self):
+        for index in range(3):
+            CustomUser.objects.create_user(f'friend{index}@example.com', 'Passw0rd#')
+            self.assertEqual(self.send(f'friend{index}@example.com').status_code, 201)
+        response = self.send()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_duplicate_send_does_not_use_the_rate_limit(self):
+        for _ in range(5):
+            self.send()
+        CustomUser.objects.create_user('friend@example.com', 'Passw0rd#')
+        self.assertEqual(self.send('friend@example.com').status_code, 201)
+
+    def test_deleted_requests_still_count(self):
+        for index in range(3):
+            CustomUser.objects.create_user(f'friend{index}@example.com', 'Passw0rd#')
+            self.send(f'friend{index}@example.com')
+        FriendRequest.objects.all().delete()
+        self.assertEqual(self.send().status_code, 429)
+
+
+# The bulk endpoints cost the same number of queries whatever the number of emails.
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHE_SHARED=True)
+class BulkEndpointsTest(StatementCountMixin, APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('user@example.com', 'Passw0rd#')
+        self.others = [CustomUser.objects.create_user(f'other{index}@example.com', 'Passw0rd#') for index in range(4)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+        get_block_set(self.user.id)
+
+    def test_bulk_send(self):
+        emails = [other.email for other in self.others[:3]]
+        # Receivers, existing requests, one insert, the rows written and one activity log insert
+        response = self.assertStatements(5, lambda: self.client.post(
+            '/api/friend-request/bulk/', {'receiver_emails': emails}, format='json'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 201, 201])
+        self.assertEqual(FriendRequest.objects.filter(sender=self.user, status='pending').count(), 3)
+
+    def test_bulk_send_reports_each_item(self):
+        FriendRequest.objects.create(sender=self.user, receiver=self.others[0])
+        Block.objects.create(blocker=self.others[1], blocked=self.user)
+        cache.clear()
+        emails = ['missing@example.com', self.user.email] + [other.email for other in self.others]
+        response = self.client.post('/api/friend-request/bulk/', {'receiver_emails': emails}, format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], [404, 400, 400, 403, 201, 201])
+
+    def test_bulk_send_reports_and_refunds_concurrent_duplicates(self):
+        emails = [other.email for other in self.others[:3]]
+
+        def concurrent_send(user_id):
+            # Another request of the same user creates one of the pairs after the lookup
+            FriendRequest.objects.create(sender=self.user, receiver=self.others[0])
+            return get_block_set(user_id)
+
+        with self.settings(RATE_LIMITS={**settings.RATE_LIMITS, 'friend_request': {'default': '3/min'}}):
+            with mock.patch('social.views.get_block_set', concurrent_send):
+                response = self.client.post('/api/friend-request/bulk/', {'receiver_emails': emails}, format='json')
+            self.assertEqual([result['status'] for result in response.data['results']], [400, 201, 201])
+            self.assertEqual(UserActivityLog.objects.filter(user=self.user).count(), 2)
+            # The unit of the duplicate was handed back
+            self.assertEqual(self.client.post('/api/friend-request/', {'receiver_email': self.others[3].email}).status_code, 201)
+
+    def test_bulk_send_rejects_too_many_emails(self):
+        with self.settings(BULK_MAX_ITEMS=2):
+            response = self.client.post('/api/friend-request/bulk/', {
+                'receiver_emails': [other.email for other in self.others]
+            }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_block_ends_friendships(self):
+        Friendship.objects.add_pair(self.user.id, self.others[0].id)
+        FriendRequest.objects.create(sender=self.user, receiver=self.others[0], status='accepted')
+        response = self.client.post('/api/blocked/bulk/', {
+            'blocked_emails': [other.email for other in self.others[:2]] + ['missing@example.com']
+        }, format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 201, 404])
+        self.assertEqual(Block.objects.filter(blocker=self.user).count(), 2)
+        self.assertFalse(Friendship.objects.exists())
+        self.assertFalse(FriendRequest.objects.exists())
+        self.assertTrue(get_block_set(self.user.id).has_blocked(self.others[1].id))
+
+    def test_bulk_accept(self):
+        requests = [FriendRequest.objects.create(sender=other, receiver=self.user) for other in self.others[:3]]
+        other_request = FriendRequest.objects.create(sender=self.others[3], receiver=self.others[0])
+        response = self.client.post('/api/friend-request/bulk-respond/', {
+            'request_ids': [friend_request.id for friend_request in requests] + [other_request.id],
+            'action': 'accept'
+        }, format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 200, 200, 404])
+        self.assertEqual(FriendRequest.objects.filter(status='accepted').count(), 3)
+        self.assertEqual(set(Friendship.objects.friend_ids(self.user.id)), {other.id for other in self.others[:3]})
+        self.assertEqual(FriendRequest.objects.get(pk=other_request.id).status, 'pending')
+
+    def test_bulk_reject(self):
+        requests = [FriendRequest.objects.create(sender=other, receiver=self.user) for other in self.others]
+        response = self.client.post('/api/friend-request/bulk-respond/', {
+            'request_ids': [friend_request.id for friend_request in requests], 'action': 'reject'
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(FriendRequest.objects.filter(Q(status='pending') | Q(rejected_at=None)).exists())
+        self.assertFalse(Friendship.objects.exists())
+
+
+class SlidingWindowLimiterTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.limiter = SlidingWindowLimiter('test', 3, 60)
+
+    def test_limit_within_window(self):
+        with mock.patch('social.throttling.time.time', return_value=600.0):
+            self.assertEqual([self.limiter.allow('user') for _ in range(4)], [True, True, True, False])
+            self.assertEqual(self.limiter.retry_after('user'), 60)
+
+    def test_previous_window_is_weighted(self):
+        with mock.patch('social.throttling.time.time', return_value=600.0):
+            self.assertEqual(self.limiter.take('user', 3), 3)
+        # Half way into the next window half of the previous one still counts
+        with mock.patch('social.throttling.time.time', return_value=690.0):
+            self.assertEqual(self.limiter.take('user', 3), 1)
+        with mock.patch('social.throttling.time.time', return_value=720.0):
+            self.assertEqual(self.limiter.take('user', 3), 2)
+
+    def test_refund(self):
+        with mock.patch('social.throttling.time.time', return_value=600.0):
+            self.assertEqual(self.limiter.take('user', 3), 3)
+            self.limiter.refund('user')
+            self.assertTrue(self.limiter.allow('user'))
+            self.assertFalse(self.limiter.allow('user'))
+
+
+# Global role-aware throttling, weighted by the cost of the endpoint.
+class GlobalThrottleTest(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('user@example.com', 'Passw0rd#')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def test_search_costs_more_than_a_list_read(self):
+        rates = {'user.admin': '6/min', 'ip': '100/min', 'anon': '100/min'}
+        with self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}):
+            self.assertEqual(self.client.get('/api/user-search', {'q': 'ab', 'mode': 'prefix'}).status_code, 400)
+            self.assertEqual(self.client.get('/api/friend-list/').status_code, 200)
+            response = self.client.get('/api/friend-list/')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_role_rates(self):
+        self.user.role = 'read'
+        self.user.save()
+        rates = {'user.read': '1/min', 'user.admin': '100/min', 'ip': '100/min', 'anon': '100/min'}
+        with self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}):
+            self.assertEqual(self.client.get('/api/friend-list/').status_code, 200)
+            self.assertEqual(self.client.get('/api/friend-list/').status_code, 429)
+
+    def test_login_is_limited_per_ip(self):
+        client = APIClient()
+        for _ in range(5):
+            self.assertEqual(client.post('/api/login/', {'email': 'user@example.com', 'password': 'wrong'}).status_code, 401)
+        response = client.post('/api/login/', {'email': 'user@example.com', 'password': 'Passw0rd#'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_weighted_throttle_is_abstract(self):
+        with self.assertRaises(TypeError):
+            WeightedRateThrottle()
+
+        class ClientThrottle(WeightedRateThrottle):
+            def get_rate_name(self, request):
+                return 'ip'
+
+            def get_ident_for(self, request):
+                return self.get_ident(request)
+
+        self.assertEqual(ClientThrottle().get_limiter(RequestFactory().get('/'), None)[0].scope, 'ip')
+
+
+# Login fast path for unknown emails and rehash on login.
+@mock.patch('social.backends.time.sleep')
+class EmailBackendTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def login(self, email, password='Passw0rd#'):
+        return self.client.post('/api/login/', {'email': email, 'password': password})
+
+    def test_unknown_email_fails_fast_without_a_query(self, sleep):
+        self.assertEqual(self.login('nobody@example.com').status_code, 401)
+        with self.assertNumQueries(0):
+            self.assertIsNone(authenticate(email='nobody@example.com', password='Passw0rd#'))
+        # The time of a real password check is spent sleeping instead of hashing
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_signup_clears_the_negative_cache(self, sleep):
+        self.login('new@example.com')
+        CustomUser.objects.create_user('new@example.com', 'Passw0rd#')
+        self.assertEqual(self.login('new@example.com').status_code, 200)
+
+    def test_other_capitalisation_does_not_lock_out_the_account(self, sleep):
+        user = CustomUser.objects.create_user('foo@example.com', 'Passw0rd#')
+        # The login view lowercases the email, other callers of authenticate do not
+        self.assertIsNone(authenticate(email='Foo@example.com', password='Passw0rd#'))
+        self.assertEqual(authenticate(email='foo@example.com', password='Passw0rd#'), user)
+
+    def test_password_is_rehashed_with_the_preferred_hasher(self, sleep):
+        user = CustomUser.objects.create_user('old@example.com')
+        user.password = make_password('Passw0rd#', hasher='pbkdf2_sha1')
+        user.save()
+        self.assertEqual(self.login('old@example.com').status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith(get_hashers()[0].algorithm))
+
+
+# Token-only authentication, request.user comes from the access token claims.
+@override_settings(CACHE_SHARED=True)
+class StatelessJWTAuthenticationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('user@example.com', 'Passw0rd#', role='write', first_name='user')
+        self.token = ClaimsRefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        # Issued after the user was saved
+        cache.delete(user_changed_key(self.user.id))
+
+    def test_cached_read_needs_no_query(self):
+        self.client.get('/api/friend-list/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/friend-list/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_full_user_is_hydrated_from_the_cache(self):
+        request_user = ClaimsUser(self.token)
+        self.assertEqual((request_user.id, request_user.role, request_user.email), (self.user.id, 'write', 'user@example.com'))
+        with self.assertNumQueries(1):
+            self.assertEqual(request_user.first_name, 'user')
+            self.assertEqual(ClaimsUser(self.token).first_name, 'user')
+
+    def test_password_hash_is_not_cached(self):
+        ClaimsUser(self.token).first_name
+        self.assertNotIn(self.user.password, str(cache.get(user_cache_key(self.user.id))))
+        # Deferred, loaded from the database when it is read
+        with self.assertNumQueries(1):
+            self.assertEqual(ClaimsUser(self.token).password, self.user.password)
+
+    def test_login_keeps_the_token_claims(self):
+        self.client.post('/api/login/', {'email': 'user@example.com', 'password': 'Passw0rd#'})
+        self.assertIsNone(cache.get(user_changed_key(self.user.id)))
+        self.client.get('/api/friend-list/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/friend-list/')
+
+    def test_saved_user_is_loaded_again(self):
+        self.user.role = 'read'
+        self.user.save()
+        response = self.client.post('/api/blocked/', {'blocked_email': 'someone@example.com'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_inactive_user_is_refused(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/friend-list/').status_code, 401)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_per_process_cache_loads_the_user(self):
+        # The change marker would not reach the other workers, the token alone is not trusted
+        self.client.get('/api/friend-list/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/friend-list/')
+        self.assertEqual(response.status_code, 200)
+
+
+# The search vector is only recomputed when a name changes.
+class SearchVectorSignalTest(APITestCase):
+    def setUp(self):
+        CustomUser.objects.create_user('user@example.com', 'Passw0rd#', first_name='ada')
+        self.user = CustomUser.objects.get(email='user@example.com')
+
+    def save_and_count_updates(self, **save_kwargs):
+        with mock.patch.object(CustomUserManager, 'update_search_vectors') as update:
+            self.user.save(**save_kwargs)
+        return update.call_count
+
+    def test_other_fields_do_not_update_the_vector(self):
+        self.user.role = 'read'
+        self.assertEqual(self.save_and_count_updates(), 0)
+        self.assertEqual(self.save_and_count_updates(update_fields=['last_login']), 0)
+
+    def test_name_change_updates_the_vector_once(self):
+        self.user.first_name = 'grace'
+        self.assertEqual(self.save_and_count_updates(), 1)
+        self.assertEqual(self.save_and_count_updates(), 0)
+
+    def test_refreshed_names_are_not_a_change(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(first_name='grace')
+        self.user.refresh_from_db()
+        self.assertEqual(self.save_and_count_updates(), 0)
+        CustomUser.objects.filter(pk=self.user.pk).update(last_name='hopper')
+        self.user.refresh_from_db(fields=['last_name'])
+        self.assertEqual(self.save_and_count_updates(), 0)
+        self.user.first_name = 'ada'
+        self.assertEqual(self.save_and_count_updates(), 1)
+
+
+# The async read views answer like the synchronous ones.
+class AsyncReadViewsTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('user@example.com', 'Passw0rd#')
+        self.others = [CustomUser.objects.create_user(f'other{index}@example.com', 'Passw0rd#') for index in range(3)]
+        for other in self.others:
+            FriendRequest.objects.create(sender=other, receiver=self.user)
+        Friendship.objects.add_pair(self.user.id, self.others[0].id)
+        cache.delete(user_changed_key(self.user.id))
+        self.authorization = f'Bearer {ClaimsRefreshToken.for_user(self.user).access_token}'
+
+    async def call(self, view, path, params=None, authorization=None):
+        request = AsyncRequestFactory().get(path, params or {}, headers={'authorization': authorization or self.authorization})
+        return await view.as_view()(request)
+
+    def sync_call(self, view, path, params=None):
+        request = RequestFactory().get(path, params or {}, HTTP_AUTHORIZATION=self.authorization)
+        response = view.as_view()(request)
+        response.render()
+        return response
+
+    async def test_same_responses_as_the_sync_views(self):
+        cases = [
+            (async_views.FriendsListAPI, views.FriendsListAPI, '/api/friend-list/', None),
+            (async_views.PendingFriendRequestsAPI, views.PendingFriendRequestsAPI, '/api/pending-list/', {'page_size': 2}),
+            (async_views.PendingFriendRequestsAPI, views.PendingFriendRequestsAPI, '/api/pending-list/', {'pagination': 'cursor', 'page_size': 2}),
+            (async_views.UserActivityLogAPI, views.UserActivityLogAPI, '/api/user-activity/', None),
+        ]
+        for async_view, sync_view, path, params in cases:
+            await sync_to_async(cache.clear)()
+            response = await self.call(async_view, path, params)
+            await sync_to_async(cache.clear)()
+            expected = await sync_to_async(self.sync_call)(sync_view, path, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), json.loads(expected.content), path)
+
+    async def test_unauthenticated(self):
+        request = AsyncRequestFactory().get('/api/friend-list/')
+        response = await async_views.FriendsListAPI.as_view()(request)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_throttled(self):
+        rates = {'user.admin': '6/min', 'ip': '100/min', 'anon': '100/min'}
+        with self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}):
+            response = await self.call(async_views.UserSearchView, '/api/user-search', {'q': 'ot', 'mode': 'prefix'})
+            self.assertEqual(response.status_code, 400)
+            response = await self.call(async_views.UserSearchView, '/api/user-search', {'q': 'ot', 'mode': 'prefix'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+# Read replica routing and read-after-write pinning.
+@override_settings(DATABASE_REPLICAS=['replica_1'], DB_REPLICA_PIN_SECONDS=5)
+class PrimaryReplicaRouterTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pass1234')
+        self.router = PrimaryReplicaRouter()
+
+    def db_for_read(self, request):
+        token = start_request(request)
+        try:
+            return self.router.db_for_read(CustomUser)
+        finally:
+            end_request(token)
+
+    def request(self, method):
+        request = getattr(RequestFactory(), method)('/api/friend-list/')
+        request.user = self.user
+        return request
+
+    def test_reads_outside_a_request_use_the_primary(self):
+        self.assertEqual(self.router.db_for_read(CustomUser), 'default')
+
+    def test_safe_requests_read_from_a_replica(self):
+        self.assertEqual(self.db_for_read(self.request('get')), 'replica_1')
+        self.assertEqual(self.db_for_read(self.request('post')), 'default')
+        self.assertEqual(self.router.db_for_write(CustomUser), 'default')
+
+    def test_user_is_pinned_to_the_primary_after_a_write(self):
+        middleware = PrimaryReplicaMiddleware(lambda request: HttpResponse(status=201))
+        middleware(self.request('post'))
+        self.assertTrue(cache.get(pin_key(self.user.id)))
+        self.assertEqual(self.db_for_read(self.request('get')), 'default')
+
+        cache.delete(pin_key(self.user.id))
+        middleware = PrimaryReplicaMiddleware(lambda request: HttpResponse(status=400))
+        middleware(self.request('post'))
+        self.assertIsNone(cache.get(pin_key(self.user.id)))
+        self.assertEqual(self.db_for_read(self.request('get')), 'replica_1')
+
+    def test_reads_before_authentication_use_the_primary(self):
+        request = self.request('get')
+        request.user = AnonymousUser()
+        token = start_request(request)
+        try:
+            # The authentication's own user lookup
+            self.assertEqual(self.router.db_for_read(CustomUser), 'default')
+            request.user = self.user
+            self.assertEqual(self.router.db_for_read(CustomUser), 'replica_1')
+        finally:
+            end_request(token)
+
+    def test_lazy_session_user_is_not_evaluated(self):
+        request = self.request('get')
+        request.user = SimpleLazyObject(lambda: self.fail("the session user was loaded"))
+        self.assertEqual(self.db_for_read(request), 'default')
+
+
+# The synthetic graph generator and the endpoint benchmark driver.
+class BenchmarkCommandsTest(TransactionTestCase):
+    def generate(self, **options):
+        options.setdefault('stdout', open(os.devnull, 'w'))
+        call_command('generate_social_graph', users=60, friends_per_user=3, skip_search_vector=True, **options)
+
+    def friendships_by_email(self):
+        emails = dict(CustomUser.objects.values_list('id', 'email'))
+        return {(emails[user], emails[friend]) for user, friend in Friendship.objects.values_list('user_id', 'friend_id')}
+
+    def test_generate_social_graph(self):
+        output = io.StringIO()
+        self.generate(stdout=output)
+        self.assertEqual(CustomUser.objects.count(), 60)
+        # Duplicates skipped by ignore_conflicts are not counted
+        self.assertIn(f"friend requests: {FriendRequest.objects.count()} rows", output.getvalue())
+        self.assertIn(f"blocks: {Block.objects.count()} rows", output.getvalue())
+        friendships = self.friendships_by_email()
+        self.assertTrue(friendships)
+        self.assertTrue(all((friend, user) in friendships for user, friend in friendships))
+        self.assertTrue(all(user != friend for user, friend in friendships))
+        self.assertTrue(FriendRequest.objects.exists())
+        self.assertEqual(UserActivityLog.objects.count(), 600)
+
+        # Same seed, same graph
+        self.generate(reset=True)
+        self.assertEqual(self.friendships_by_email(), friendships)
+
+    def test_bench_endpoints_writes_results(self):
+        # The clients run in their own threads, they need committed rows
+        self.generate()
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('bench_endpoints', endpoints='friend-list,pending-list', concurrency='1', requests=10,
+                         viewers=5, warmup=0, output=output, stdout=open(os.devnull, 'w'))
+            with open(output) as results_file:
+                report = json.load(results_file)
+        self.assertEqual([(row['endpoint'], row['concurrency']) for row in report['results']],
+                         [('friend-list', 1), ('pending-list', 1)])
+        for row in report['results']:
+            self.assertEqual(row['errors'], 0)
+            self.assertEqual(row['non_2xx'], {})
+            self.assertEqual(row['count'], 10)
+            self.assertIn('p99_ms', row)
+            self.assertIn('queries_per_request', row)
+
+    def test_bench_endpoints_leaves_non_2xx_out_of_the_latency(self):
+        self.generate()
+        cache.clear()
+        rates = {rate: '2/min' for rate in ('user', 'user.read', 'user.write', 'user.admin')}
+        with self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {**rates, 'ip': '1000/min', 'anon': '1000/min'}}), \
+                tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('bench_endpoints', endpoints='friend-list', concurrency='1', requests=10, viewers=1, warmup=0,
+                         throttle=True, output=output, stdout=open(os.devnull, 'w'))
+            with open(output) as results_file:
+                row = json.load(results_file)['results'][0]
+        self.assertEqual((row['count'], row['non_2xx'], row['errors']), (2, {'429': 8}, 0))
+
+
+# Per-request query, cache and latency metrics, as headers and at /metrics.
+@override_settings(QUERY_METRICS_HEADERS=True, METRICS_TOKEN='scrape-token')
+class QueryMetricsMiddlewareTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.user = CustomUser.objects.create_user('user@example.com', 'Passw0rd#')
+        self.client.force_authenticate(self.user)
+
+    def test_headers(self):
+        response = self.client.get('/api/friend-list/')
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+        self.assertEqual(response['X-Cache-Hits'], '0')
+        self.assertIn('X-DB-Time-Ms', response)
+        self.assertIn('X-Response-Time-Ms', response)
+
+        response = self.client.get('/api/friend-list/')
+        self.assertEqual(response['X-DB-Queries'], '0')
+        self.assertEqual(response['X-Cache-Hits'], '1')
+
+        with self.settings(QUERY_METRICS_HEADERS=False):
+            self.assertNotIn('X-DB-Queries', self.client.get('/api/friend-list/'))
+
+    async def test_async_requests(self):
+        client = AsyncClient()
+        await sync_to_async(cache.clear)()
+        token = await sync_to_async(lambda: str(ClaimsRefreshToken.for_user(self.user).access_token))()
+        response = await client.get('/api/pending-list/', headers={'authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/friend-list/')
+        self.client.get('/api/friend-list/')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('social_http_responses_total{view="friend_list",method="GET",status="200"} 2', body)
+        self.assertIn('social_db_queries_per_request_count{view="friend_list",method="GET"} 2', body)
+        self.assertIn('social_request_cache_hits_total{view="friend_list",method="GET"} 1', body)
+        self.assertIn('social_activity_log_queue_depth', body)
+
+
+# The orjson renderer answers like DRF's JSONRenderer, and the list pages skip model instances.
+class FastRenderingTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('user@example.com', 'Passw0rd#')
+        self.client.force_authenticate(self.user)
+
+    def test_same_output_as_json_renderer(self):
+        now = timezone.now()
+        data = {
+            'results': [{'created_at': now, 'created_on': now.date(), 'at_second': now.replace(microsecond=0)}],
+            'text': 'caf\u00e9 \u2028', 'none': None, 'nested': [1, 2.5, True], 'duration': timedelta(seconds=3),
+        }
+        self.assertEqual(renderers.ORJSONRenderer().render(data), JSONRenderer().render(data))
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_pending_list_does_not_load_the_senders(self):
+        senders = [CustomUser.objects.create_user(f'sender{index}@example.com', 'Passw0rd#') for index in range(5)]
+        FriendRequest.objects.bulk_create([FriendRequest(sender=sender, receiver=self.user) for sender in senders])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/pending-list/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({row['sender_id'] for row in response.json()['results']}, {sender.id for sender in senders})
+        self.assertFalse([query for query in queries if 'social_customuser' in query['sql']])
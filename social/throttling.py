@@ -0,0 +1,237 @@
+import math
+import time
+from abc import ABCMeta, abstractmethod
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# Sliding-window rate limits kept in the shared cache, so rate checks never touch the database.
+# Each window is a counter incremented atomically (cache.incr), and the limit applies to the current
+# window plus the previous one weighted by how much of it still overlaps the sliding window.
+# Rates are configured per scope and per role in settings.RATE_LIMITS, e.g. {'friend_request': {'default': '3/min'}}.
+
+PERIODS = {
+    's': 1, 'sec': 1, 'second': 1,
+    'm': 60, 'min': 60, 'minute': 60,
+    'h': 3600, 'hour': 3600,
+    'd': 86400, 'day': 86400,
+}
+PERIOD_NAMES = {1: 'second', 60: 'minute', 3600: 'hour', 86400: 'day'}
+
+
+def parse_rate(rate):
+    # "3/min" -> (3, 60)
+    limit, period = rate.split('/')
+    return int(limit), PERIODS[period]
+
+
+def get_rate(scope, role=None):
+    rates = settings.RATE_LIMITS[scope]
+    return rates.get(role, rates.get('default'))
+
+
+class SlidingWindowLimiter:
+    def __init__(self, scope, limit, window):
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+
+    @classmethod
+    def for_scope(cls, scope, role=None):
+        # None when the scope has no limit for this role
+        rate = get_rate(scope, role)
+        if rate is None:
+            return None
+        limit, window = parse_rate(rate)
+        return cls(scope, limit, window)
+
+    @property
+    def period_name(self):
+        return PERIOD_NAMES.get(self.window, f"{self.window} seconds")
+
+    def _keys(self, ident, now):
+        index = int(now // self.window)
+        elapsed = (now % self.window) / self.window
+        return f"rl:{self.scope}:{ident}:{index}", f"rl:{self.scope}:{ident}:{index - 1}", elapsed
+
+    def _weighted(self, previous, current, elapsed):
+        return previous * (1 - elapsed) + current
+
+    def _granted(self, previous, current, elapsed, cost):
+        over = math.ceil(self._weighted(previous, current, elapsed) - self.limit)
+        return cost - min(max(over, 0), cost)
+
+    def usage(self, ident):
+        current_key, previous_key, elapsed = self._keys(ident, time.time())
+        counts = cache.get_many([current_key, previous_key])
+        return self._weighted(counts.get(previous_key, 0), counts.get(current_key, 0), elapsed)
+
+    def take(self, ident, cost=1):
+        # Consumes up to `cost` units and returns how many were granted, the rest is handed back
+        current_key, previous_key, elapsed = self._keys(ident, time.time())
+        cache.add(current_key, 0, self.window * 2)
+        try:
+            current = cache.incr(current_key, cost)
+        except ValueError:
+            # The counter expired between add and incr
+            cache.set(current_key, cost, self.window * 2)
+            current = cost
+        granted = self._granted(cache.get(previous_key, 0), current, elapsed, cost)
+        if granted < cost:
+            self._release(current_key, cost - granted)
+        return granted
+
+    async def atake(self, ident, cost=1):
+        # Same as take() through the cache's async API, for the async views
+        current_key, previous_key, elapsed = self._keys(ident, time.time())
+        await cache.aadd(current_key, 0, self.window * 2)
+        try:
+            current = await cache.aincr(current_key, cost)
+        except ValueError:
+            await cache.aset(current_key, cost, self.window * 2)
+            current = cost
+        granted = self._granted(await cache.aget(previous_key, 0), current, elapsed, cost)
+        if granted < cost:
+            try:
+                await cache.adecr(current_key, cost - granted)
+            except ValueError:
+                pass
+        return granted
+
+    def allow(self, ident):
+        return self.take(ident) == 1
+
+    def refund(self, ident, cost=1):
+        # Gives back units taken for an action that did not happen after all
+        current_key, _, _ = self._keys(ident, time.time())
+        self._release(current_key, cost)
+
+    def _release(self, key, cost):
+        try:
+            cache.decr(key, cost)
+        except ValueError:
+            pass
+
+    def retry_after(self, ident):
+        # Seconds until one more unit fits in the window
+        current_key, previous_key, elapsed = self._keys(ident, time.time())
+        counts = cache.get_many([current_key, previous_key])
+        return self._retry_after(counts.get(current_key, 0), counts.get(previous_key, 0), elapsed)
+
+    async def aretry_after(self, ident):
+        current_key, previous_key, elapsed = self._keys(ident, time.time())
+        counts = await cache.aget_many([current_key, previous_key])
+        return self._retry_after(counts.get(current_key, 0), counts.get(previous_key, 0), elapsed)
+
+    def _retry_after(self, current, previous, elapsed):
+        remaining = self.window * (1 - elapsed)
+        if current + 1 > self.limit or not previous:
+            # Nothing fits before the current window becomes the previous one
+            return max(math.ceil(remaining), 1)
+        wait = remaining - self.window * (self.limit - current - 1) / previous
+        return max(math.ceil(wait), 1)
+
+
+def rate_limit(scope, key=None):
+    # Decorator for APIView methods, every call takes one unit of the scope's limit
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            limiter = SlidingWindowLimiter.for_scope(scope, getattr(request.user, 'role', None))
+            if limiter is not None:
+                ident = key(request) if key else request.user.pk
+                if not limiter.allow(ident):
+                    retry_after = limiter.retry_after(ident)
+                    return Response(
+                        {"error": f"Too many requests. Please try again in {retry_after} seconds."},
+                        status=status.HTTP_429_TOO_MANY_REQUESTS,
+                        headers={'Retry-After': str(retry_after)}
+                    )
+            return view_method(view, request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# DRF throttle on top of the same limiter, the scope comes from the view's `throttle_scope`.
+class SlidingWindowThrottle(BaseThrottle):
+    def allow_request(self, request, view):
+        self.limiter = SlidingWindowLimiter.for_scope(view.throttle_scope, getattr(request.user, 'role', None))
+        if self.limiter is None:
+            return True
+        self.ident = request.user.pk if request.user.is_authenticated else self.get_ident(request)
+        return self.limiter.allow(self.ident)
+
+    def wait(self):
+        return self.limiter.retry_after(self.ident)
+
+
+# Global throttles, set in REST_FRAMEWORK['DEFAULT_THROTTLE_CLASSES'] with their rates in DEFAULT_THROTTLE_RATES.
+# A request takes as many units as the view's `throttle_cost` (1 by default), so an expensive
+# endpoint like the search uses up the budget faster than a cheap list read.
+# Abstract, subclasses say which rate applies to a request and whose budget it is taken from.
+class WeightedRateThrottle(BaseThrottle, metaclass=ABCMeta):
+    def get_cost(self, view):
+        return getattr(view, 'throttle_cost', 1)
+
+    @abstractmethod
+    def get_rate_name(self, request):
+        # Key of the rate in DEFAULT_THROTTLE_RATES, None leaves the request unthrottled
+        pass
+
+    @abstractmethod
+    def get_ident_for(self, request):
+        # Whose budget the request uses, e.g. the user id or the client IP
+        pass
+
+    def get_limiter(self, request, view):
+        # The limiter and the cost of this request, no limiter when there is no rate for it
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        rate_name = self.get_rate_name(request)
+        rate = rates.get(rate_name) if rate_name else None
+        if rate is None:
+            return None, 0
+        limit, window = parse_rate(rate)
+        self.ident = self.get_ident_for(request)
+        return SlidingWindowLimiter(rate_name, limit, window), min(self.get_cost(view), limit)
+
+    def allow_request(self, request, view):
+        self.limiter, cost = self.get_limiter(request, view)
+        return self.limiter is None or self.limiter.take(self.ident, cost) == cost
+
+    def wait(self):
+        return self.limiter.retry_after(self.ident) if self.limiter else None
+
+    async def aallow_request(self, request, view):
+        self.limiter, cost = self.get_limiter(request, view)
+        return self.limiter is None or await self.limiter.atake(self.ident, cost) == cost
+
+    async def await_time(self):
+        return await self.limiter.aretry_after(self.ident) if self.limiter else None
+
+
+# Per-user budget by role, the rate is 'user.<role>' with 'user' as the fallback.
+class UserRoleRateThrottle(WeightedRateThrottle):
+    def get_rate_name(self, request):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        role_rate = f"user.{getattr(request.user, 'role', '')}"
+        return role_rate if role_rate in api_settings.DEFAULT_THROTTLE_RATES else 'user'
+
+    def get_ident_for(self, request):
+        return request.user.pk
+
+
+# Per-IP budget for every request, authenticated or not ('anon' for anonymous ones, 'ip' otherwise).
+class IPRateThrottle(WeightedRateThrottle):
+    def get_rate_name(self, request):
+        if request.user and request.user.is_authenticated:
+            return 'ip'
+        return 'anon'
+
+    def get_ident_for(self, request):
+        return self.get_ident(request)
@@ -1,16 +1,28 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
+from . import async_views, views
 from .views import *
 
+# Under ASGI the read endpoints are served by their native async versions
+read_views = async_views if settings.ASYNC_READ_VIEWS else views
+
 urlpatterns = [
     path('api/signup/', SignUpView.as_view(), name='signup'),
     path('api/login/', LoginView.as_view(), name='login'),
-    path('api/user-search', UserSearchView.as_view(), name='user_search'),
+    path('api/user-search', read_views.UserSearchView.as_view(), name='user_search'),
     path('api/friend-request/', FriendRequestView.as_view(), name='send_friend_request'),
+    path('api/friend-request/bulk/', BulkFriendRequestView.as_view(), name='bulk_friend_request'),
+    path('api/friend-request/bulk-respond/', BulkRespondFriendRequestView.as_view(), name='bulk_respond_friend_request'),
     path('api/friend-request/<int:pk>/', FriendRequestView.as_view(), name='respond_friend_request'),
     path('api/blocked/', BlockUserView.as_view(), name='blocking_user'),
+    path('api/blocked/bulk/', BulkBlockUserView.as_view(), name='bulk_block_user'),
     path('api/unblocked/', UnblockUserView.as_view(), name='unblock_user'),
-    path('api/friend-list/', FriendsListAPI.as_view(), name='friend_list'),
-    path('api/pending-list/', PendingFriendRequestsAPI.as_view(), name='pending_list'),
-    path('api/user-activity/', UserActivityLogAPI.as_view(), name="user-activity"),
+    path('api/unfriend/', UnfriendView.as_view(), name='unfriend_user'),
+    path('api/friend-list/', read_views.FriendsListAPI.as_view(), name='friend_list'),
+    path('api/suggestions/', FriendSuggestionsAPI.as_view(), name='friend_suggestions'),
+    path('api/mutual-friends/<int:user_id>/', MutualFriendsAPI.as_view(), name='mutual_friends'),
+    path('api/pending-list/', read_views.PendingFriendRequestsAPI.as_view(), name='pending_list'),
+    path('api/user-activity/', read_views.UserActivityLogAPI.as_view(), name="user-activity"),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
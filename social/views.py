@@ -1,21 +1,30 @@
 from .serializers import SignUpSerializer, LoginSerializer
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.utils.decorators import method_decorator
-from django_ratelimit.decorators import ratelimit
-from django_ratelimit.exceptions import Ratelimited
+from .authentication import ClaimsRefreshToken
 from rest_framework.permissions import IsAuthenticated
-from django.contrib.postgres.search import SearchVector
 from .permissions import RoleBasedPermission
 from rest_framework.response import Response
 from django.contrib.auth import authenticate
 from rest_framework.views import APIView
-from .pagination import UserPagination
-from django.core.cache import cache
+from .partitions import retention_cutoff
+from .suggestions import mutual_friend_ids, on_friendship_created, on_friendship_removed
+from .throttling import SlidingWindowLimiter, SlidingWindowThrottle
+from .pagination import SearchKeysetPagination, UserPagination, get_paginator
+from .activity import log_activities, log_activity
+from .blocks import get_block_set, invalidate_block_sets
+from .metrics import process_metrics
+from .caching import friends_list_namespace, get_cached, invalidate, pending_requests_namespace, query_key, set_cached
 from rest_framework import status
 from django.conf import settings
 from django.utils import timezone
-from django.db.models import Q
-from datetime import timedelta
+from django.db.models import OuterRef, Q, Subquery
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_date, parse_datetime
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from datetime import datetime, timedelta
+import json
+import hashlib
+import hmac
 from .models import *
 
 
@@ -34,7 +43,10 @@ class SignUpView(APIView):
 
 # This api for login.
 class LoginView(APIView):
-    @method_decorator(ratelimit(key='ip', rate='5/m', method='POST', block=True))
+    # Login attempts are limited per IP (RATE_LIMITS['login']) on top of the global throttles
+    throttle_classes = [*APIView.throttle_classes, SlidingWindowThrottle]
+    throttle_scope = 'login'
+
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
         if serializer.is_valid():
@@ -44,7 +56,8 @@ class LoginView(APIView):
 
             if user is not None:
                 # Generate JWT tokens (access and refresh)
-                refresh = RefreshToken.for_user(user)
+                # The access token carries role, is_active and email, authenticated requests need no user query
+                refresh = ClaimsRefreshToken.for_user(user)
                 access_token = refresh.access_token
 
                 return Response({
@@ -59,37 +72,41 @@ class LoginView(APIView):
 # This api is for searching via email or named.
 class UserSearchView(APIView):
     permission_classes = [IsAuthenticated, RoleBasedPermission]
+    throttle_cost = 5
     
     def get(self, request):
         search_keyword = request.query_params.get('q', '')
 
+        # Users on either side of a block are hidden, the exclusion set comes from the cached block set
+        block_set = get_block_set(request.user.id)
+
+        # Typeahead mode for as-you-type queries
+        if request.query_params.get('mode') == 'prefix':
+            return self.prefix_search(search_keyword, block_set)
+
         if search_keyword:
             # Check if the keyword matches an exact email
-            user_by_email = CustomUser.objects.filter(email__iexact=search_keyword).first()
+            user_by_email = CustomUser.objects.filter(email__iexact=search_keyword).values('id', 'email', 'first_name', 'last_name').first()
 
-            if user_by_email:
+            if user_by_email and user_by_email['id'] not in block_set:
                 # If an email matches, return the user
-                return Response({
-                    'id': user_by_email.id,
-                    'email': user_by_email.email,
-                    'first_name': user_by_email.first_name,
-                    'last_name': user_by_email.last_name
-                }, status=status.HTTP_200_OK)
+                return Response(user_by_email, status=status.HTTP_200_OK)
 
-            # If no email match, perform full-text search by name
-            users_by_name = CustomUser.objects.annotate(
-                search=SearchVector('first_name', 'last_name')
-            ).filter(search=search_keyword)
+            # If no email match, perform full-text search by name on the stored, GIN indexed vector
+            users_by_name = CustomUser.objects.search(search_keyword)
+            if block_set:
+                users_by_name = users_by_name.exclude(pk__in=block_set.excluded_ids())
 
-            if users_by_name.exists():
-                # Apply pagination to the name search results
-                paginator = UserPagination()
-                paginated_users = paginator.paginate_queryset(users_by_name, request)
+            # Apply pagination to the ranked name search results (page numbers or a rank cursor),
+            # plain rows instead of model instances (the rank stays in for the cursor)
+            paginator = get_paginator(request, SearchKeysetPagination)
+            paginated_users = paginator.paginate_queryset(users_by_name.values('id', 'email', 'first_name', 'rank'), request)
 
+            if paginated_users:
                 user_list = [{
-                    'id': user.id,
-                    'email': user.email,
-                    'name': user.first_name
+                    'id': user['id'],
+                    'email': user['email'],
+                    'name': user['first_name']
                 } for user in paginated_users]
 
                 # Return the paginated response
@@ -98,6 +115,28 @@ class UserSearchView(APIView):
         # If no users are found
         return Response({'message': 'No users found'}, status=status.HTTP_404_NOT_FOUND)
 
+    def prefix_search(self, prefix, block_set):
+        prefix = prefix.strip().lower()
+        if len(prefix) < settings.TYPEAHEAD_MIN_LENGTH:
+            return Response({"error": f"Please type at least {settings.TYPEAHEAD_MIN_LENGTH} characters."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Every keystroke hits this, so results are cached per prefix for a short time. The cache is shared
+        # by all users, so it keeps some extra rows and blocked users are filtered out afterwards.
+        cache_key = hashlib.sha1(prefix.encode()).hexdigest()
+        results = get_cached('typeahead', cache_key)
+
+        if results is None:
+            # The istartswith lookups are served by the trigram indexes on email and names
+            results = list(
+                CustomUser.objects.filter(
+                    Q(email__istartswith=prefix) | Q(first_name__istartswith=prefix) | Q(last_name__istartswith=prefix)
+                ).order_by('email').values('id', 'email', 'first_name', 'last_name')[:settings.TYPEAHEAD_LIMIT * 2]
+            )
+            set_cached('typeahead', cache_key, results, settings.TYPEAHEAD_CACHE_TIMEOUT)
+
+        results = [user for user in results if user['id'] not in block_set][:settings.TYPEAHEAD_LIMIT]
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
 
 # This api is for send the friend request to the users and also for perform action like accept or reject.
 class FriendRequestView(APIView):
@@ -106,67 +145,87 @@ class FriendRequestView(APIView):
     def post(self, request):
         # Sending a friend request
         receiver_email = request.data.get('receiver_email')
+        user = request.user
+        now = timezone.now()
 
-        try:
-            receiver = CustomUser.objects.get(email=receiver_email)
-            if receiver == request.user:
-                return Response({"error": "You cannot send a friend request to yourself."}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Check if the user is blocked or has blocked the receiver
-            if Block.objects.filter(blocker=request.user, blocked=receiver).exists():
-                return Response({"error": "You have blocked this user and cannot send a friend request."}, status=status.HTTP_403_FORBIDDEN)
-            if Block.objects.filter(blocker=receiver, blocked=request.user).exists():
-                return Response({"error": "You are blocked by this user and cannot send a friend request."}, status=status.HTTP_403_FORBIDDEN)
-
-            # Check if the receiver has already sent a request to the user
-            reverse_request = FriendRequest.objects.filter(sender=receiver, receiver=request.user).first()
-
-            if reverse_request and reverse_request.status == 'pending':
-                return Response({"message": "This user has already sent you a request. Please respond to their request."}, status=status.HTTP_200_OK)
-
-            # Check if the sender has already sent a request to the receiver
-            friend_request = FriendRequest.objects.filter(sender=request.user, receiver=receiver, ).first()
-
-            if friend_request:
-                if friend_request.status == 'rejected' and friend_request.rejected_at:
-                    # Cooldown check: Ensure cooldown has passed after rejection
-                    time_since_rejection = timezone.now() - friend_request.rejected_at
-                    if time_since_rejection < settings.COOLDOWN_PERIOD:
-                        cooldown_remaining = settings.COOLDOWN_PERIOD - time_since_rejection
-                        return Response({"error": f"You cannot send a request to this user for another {cooldown_remaining.seconds // 3600} hours."},
-                                        status=status.HTTP_403_FORBIDDEN)
-                    else:
-                        # Cooldown passed, delete the previous rejected request
-                        friend_request.delete()
-                else:
-                    # If the request is pending or accepted, return error
-                    return Response({"error": "Friend request already sent."}, status=status.HTTP_400_BAD_REQUEST)
+        # A single query loads the receiver together with the requests in both directions
+        forward_requests = FriendRequest.objects.filter(sender_id=user.id, receiver=OuterRef('pk'))
 
-            # Rate limiting: Check how many friend requests were sent by this user in the last minute
-            one_minute_ago = timezone.now() - timedelta(minutes=1)
-            recent_requests_count = FriendRequest.objects.filter(sender=request.user, created_at__gte=one_minute_ago).count()
+        receiver = CustomUser.objects.filter(email=receiver_email).annotate(
+            reverse_status=Subquery(
+                FriendRequest.objects.filter(sender=OuterRef('pk'), receiver_id=user.id).values('status')[:1]
+            ),
+            forward_id=Subquery(forward_requests.values('id')[:1]),
+            forward_status=Subquery(forward_requests.values('status')[:1]),
+            forward_rejected_at=Subquery(forward_requests.values('rejected_at')[:1]),
+        ).only('id', 'email').first()
 
-            if recent_requests_count >= 3:
-                return Response({"error": "You can only send 3 friend requests per minute. Please try again later."}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if receiver is None:
+            return Response({"error": "Receiver not found."}, status=status.HTTP_404_NOT_FOUND)
+        if receiver.id == user.id:
+            return Response({"error": "You cannot send a friend request to yourself."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check if the user is blocked or has blocked the receiver, a lookup in the cached block set
+        block_set = get_block_set(user.id)
+        if block_set.has_blocked(receiver.id):
+            return Response({"error": "You have blocked this user and cannot send a friend request."}, status=status.HTTP_403_FORBIDDEN)
+        if block_set.is_blocked_by(receiver.id):
+            return Response({"error": "You are blocked by this user and cannot send a friend request."}, status=status.HTTP_403_FORBIDDEN)
+
+        # Check if the receiver has already sent a request to the user
+        if receiver.reverse_status == 'pending':
+            return Response({"message": "This user has already sent you a request. Please respond to their request."}, status=status.HTTP_200_OK)
+
+        # Check if the sender has already sent a request to the receiver
+        if receiver.forward_id is not None:
+            if receiver.forward_status == 'rejected' and receiver.forward_rejected_at:
+                # Cooldown check: Ensure cooldown has passed after rejection
+                time_since_rejection = now - receiver.forward_rejected_at
+                if time_since_rejection < settings.COOLDOWN_PERIOD:
+                    cooldown_remaining = settings.COOLDOWN_PERIOD - time_since_rejection
+                    return Response({"error": f"You cannot send a request to this user for another {cooldown_remaining.seconds // 3600} hours."},
+                                    status=status.HTTP_403_FORBIDDEN)
+            else:
+                # If the request is pending or accepted, return error
+                return Response({"error": "Friend request already sent."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Create a new friend request
-            friend_request, created = FriendRequest.objects.get_or_create(sender=request.user, receiver=receiver)
+        # Rate limiting (3 friend requests per minute by default), counted in the shared cache
+        limiter = SlidingWindowLimiter.for_scope('friend_request', user.role)
+        if limiter and not limiter.allow(user.id):
+            return Response({"error": f"You can only send {limiter.limit} friend requests per {limiter.period_name}. Please try again later."},
+                            status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(limiter.retry_after(user.id))})
 
-            if created:
-                # Log the activity
-                UserActivityLog.objects.create(
-                    user=request.user,
-                    activity=f"Sent a friend request to {receiver.email}"
-                )
-                return Response({"message": "Friend request sent."}, status=status.HTTP_201_CREATED)
+        # Create the friend request, the unique (sender, receiver) constraint settles concurrent sends
+        try:
+            with transaction.atomic():
+                if receiver.forward_id is not None:
+                    # Cooldown passed, the rejected request becomes the new pending one
+                    created = FriendRequest.objects.filter(pk=receiver.forward_id, status='rejected').update(
+                        status='pending', rejected_at=None, created_at=now
+                    )
+                else:
+                    FriendRequest.objects.create(sender_id=user.id, receiver_id=receiver.id)
+                    created = True
+        except IntegrityError:
+            created = False
 
-        except CustomUser.DoesNotExist:
-            return Response({"error": "Receiver not found."}, status=status.HTTP_404_NOT_FOUND)
+        if not created:
+            # Nothing was sent, hand the rate limit unit back
+            if limiter:
+                limiter.refund(user.id)
+            return Response({"error": "Friend request already sent."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The receiver's pending inbox changed
+        invalidate(pending_requests_namespace(receiver.id))
+
+        # Log the activity
+        log_activity(user.id, f"Sent a friend request to {receiver.email}")
+        return Response({"message": "Friend request sent."}, status=status.HTTP_201_CREATED)
 
     def put(self, request, pk):
         # Accepting or rejecting a friend request
         try:
-            friend_request = FriendRequest.objects.get(pk=pk, receiver=request.user)
+            friend_request = FriendRequest.objects.select_related('sender').get(pk=pk, receiver_id=request.user.id)
             action = request.data.get('action')  # 'accept' or 'reject'
 
             # Check if the request is still pending
@@ -174,27 +233,29 @@ class FriendRequestView(APIView):
                 return Response({"message": f"You have already {friend_request.status} this friend request."}, status=status.HTTP_400_BAD_REQUEST)
 
             if action == 'accept':
-                friend_request.status = 'accepted'
-                friend_request.save()
+                # The request and both friendship edges change together or not at all
+                with transaction.atomic():
+                    friend_request.status = 'accepted'
+                    friend_request.save(update_fields=['status'])
+                    Friendship.objects.add_pair(friend_request.sender_id, friend_request.receiver_id)
+                on_friendship_created(friend_request.sender_id, friend_request.receiver_id)
 
                 # Log the activity
-                UserActivityLog.objects.create(
-                    user=request.user,
-                    activity=f"You have accepted the friend request of {friend_request.sender}"
+                log_activity(request.user.id, f"You have accepted the friend request of {friend_request.sender.email}")
+                # Invalidate cache for both users and the receiver's pending inbox
+                invalidate(
+                    friends_list_namespace(friend_request.sender_id),
+                    friends_list_namespace(friend_request.receiver_id),
+                    pending_requests_namespace(friend_request.receiver_id)
                 )
-                # Invalidate cache for both users
-                cache.delete(f"friends_list_{friend_request.sender.id}")
-                cache.delete(f"friends_list_{friend_request.receiver.id}")
                 return Response({"message": "Friend request accepted."}, status=status.HTTP_200_OK)
             elif action == 'reject':
                 friend_request.status = 'rejected'
                 friend_request.rejected_at = timezone.now()
-                friend_request.save()
+                friend_request.save(update_fields=['status', 'rejected_at'])
                 # Log the activity
-                UserActivityLog.objects.create(
-                    user=request.user,
-                    activity=f"You have rejected the friend request of {friend_request.sender__email}"
-                )
+                log_activity(request.user.id, f"You have rejected the friend request of {friend_request.sender.email}")
+                invalidate(pending_requests_namespace(friend_request.receiver_id))
                 return Response({"message": "Friend request rejected."}, status=status.HTTP_200_OK)
             else:
                 return Response({"error": "Invalid action."}, status=status.HTTP_400_BAD_REQUEST)
@@ -203,6 +264,202 @@ class FriendRequestView(APIView):
             return Response({"error": "Friend request not found."}, status=status.HTTP_404_NOT_FOUND)
 
 
+# This api is for accepting or rejecting many pending friend requests at once.
+class BulkRespondFriendRequestView(APIView):
+    permission_classes = [IsAuthenticated, RoleBasedPermission]
+    throttle_classes = [*APIView.throttle_classes, SlidingWindowThrottle]
+    throttle_scope = 'bulk'
+    throttle_cost = 10
+
+    def post(self, request):
+        request_ids = request.data.get('request_ids')
+        action = request.data.get('action')  # 'accept' or 'reject'
+        if action not in ('accept', 'reject'):
+            return Response({"error": "Invalid action."}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(request_ids, list) or not request_ids or not all(isinstance(pk, int) for pk in request_ids):
+            return Response({"error": "request_ids must be a non-empty list of ids."}, status=status.HTTP_400_BAD_REQUEST)
+        request_ids = list(dict.fromkeys(request_ids))
+        if len(request_ids) > settings.BULK_MAX_ITEMS:
+            return Response({"error": f"You can respond to at most {settings.BULK_MAX_ITEMS} requests at once."}, status=status.HTTP_400_BAD_REQUEST)
+        user = request.user
+        now = timezone.now()
+
+        with transaction.atomic():
+            # Lock the pending ones, a concurrent response to the same request waits for this one.
+            # Only the request rows, the senders joined in for their emails stay unlocked.
+            pending = {
+                friend_request['id']: friend_request
+                for friend_request in FriendRequest.objects.select_for_update(of=('self',)).filter(
+                    pk__in=request_ids, receiver_id=user.id, status='pending'
+                ).values('id', 'sender_id', 'sender__email')
+            }
+            if pending:
+                # One UPDATE ... WHERE id IN for the whole batch
+                if action == 'accept':
+                    FriendRequest.objects.filter(pk__in=pending).update(status='accepted')
+                    Friendship.objects.add_pairs(user.id, [friend_request['sender_id'] for friend_request in pending.values()])
+                else:
+                    FriendRequest.objects.filter(pk__in=pending).update(status='rejected', rejected_at=now)
+
+        results = []
+        for pk in request_ids:
+            if pk in pending:
+                results.append({"id": pk, "status": status.HTTP_200_OK, "message": f"Friend request {action}ed."})
+            else:
+                results.append({"id": pk, "status": status.HTTP_404_NOT_FOUND, "error": "Pending friend request not found."})
+
+        if pending:
+            sender_ids = [friend_request['sender_id'] for friend_request in pending.values()]
+            log_activities([
+                (user.id, f"You have {action}ed the friend request of {friend_request['sender__email']}")
+                for friend_request in pending.values()
+            ])
+            if action == 'accept':
+                on_friendship_created(user.id, *sender_ids)
+                # Every affected friend list and the receiver's pending inbox in one multi-key operation
+                invalidate(
+                    pending_requests_namespace(user.id),
+                    friends_list_namespace(user.id),
+                    *[friends_list_namespace(sender_id) for sender_id in sender_ids]
+                )
+            else:
+                invalidate(pending_requests_namespace(user.id))
+
+        return Response({"message": f"{len(pending)} of {len(request_ids)} friend requests {action}ed.", "results": results},
+                        status=status.HTTP_200_OK)
+
+
+# Reads a list of emails for the bulk endpoints, duplicates are dropped and the order is kept.
+def parse_email_list(data, field):
+    emails = data.get(field)
+    if not isinstance(emails, list) or not emails or not all(isinstance(email, str) for email in emails):
+        return None, Response({"error": f"{field} must be a non-empty list of emails."}, status=status.HTTP_400_BAD_REQUEST)
+    emails = list(dict.fromkeys(emails))
+    if len(emails) > settings.BULK_MAX_ITEMS:
+        return None, Response({"error": f"You can send at most {settings.BULK_MAX_ITEMS} emails at once."}, status=status.HTTP_400_BAD_REQUEST)
+    return emails, None
+
+
+# This api is for sending friend requests to a list of users at once, e.g. from a contact import.
+class BulkFriendRequestView(APIView):
+    permission_classes = [IsAuthenticated, RoleBasedPermission]
+    throttle_classes = [*APIView.throttle_classes, SlidingWindowThrottle]
+    throttle_scope = 'bulk'
+    throttle_cost = 10
+
+    def post(self, request):
+        receiver_emails, error = parse_email_list(request.data, 'receiver_emails')
+        if error:
+            return error
+        user = request.user
+        now = timezone.now()
+
+        # Resolve every receiver and the requests in both directions with one query each
+        receivers = {
+            receiver.email: receiver
+            for receiver in CustomUser.objects.filter(email__in=receiver_emails).only('id', 'email')
+        }
+        receiver_ids = [receiver.id for receiver in receivers.values()]
+        forward_requests, reverse_statuses = {}, {}
+        for friend_request in FriendRequest.objects.filter(
+            Q(sender_id=user.id, receiver_id__in=receiver_ids) | Q(sender_id__in=receiver_ids, receiver_id=user.id)
+        ).values('id', 'sender_id', 'receiver_id', 'status', 'rejected_at'):
+            if friend_request['sender_id'] == user.id:
+                forward_requests[friend_request['receiver_id']] = friend_request
+            else:
+                reverse_statuses[friend_request['sender_id']] = friend_request['status']
+
+        block_set = get_block_set(user.id)
+
+        results = []
+        candidates = []
+        for email in receiver_emails:
+            receiver = receivers.get(email)
+            if receiver is None:
+                results.append({"email": email, "status": status.HTTP_404_NOT_FOUND, "error": "Receiver not found."})
+                continue
+            if receiver.id == user.id:
+                results.append({"email": email, "status": status.HTTP_400_BAD_REQUEST, "error": "You cannot send a friend request to yourself."})
+                continue
+            if block_set.has_blocked(receiver.id):
+                results.append({"email": email, "status": status.HTTP_403_FORBIDDEN, "error": "You have blocked this user and cannot send a friend request."})
+                continue
+            if block_set.is_blocked_by(receiver.id):
+                results.append({"email": email, "status": status.HTTP_403_FORBIDDEN, "error": "You are blocked by this user and cannot send a friend request."})
+                continue
+            if reverse_statuses.get(receiver.id) == 'pending':
+                results.append({"email": email, "status": status.HTTP_200_OK, "message": "This user has already sent you a request. Please respond to their request."})
+                continue
+
+            forward = forward_requests.get(receiver.id)
+            if forward is not None:
+                if forward['status'] != 'rejected' or not forward['rejected_at']:
+                    results.append({"email": email, "status": status.HTTP_400_BAD_REQUEST, "error": "Friend request already sent."})
+                    continue
+                time_since_rejection = now - forward['rejected_at']
+                if time_since_rejection < settings.COOLDOWN_PERIOD:
+                    cooldown_remaining = settings.COOLDOWN_PERIOD - time_since_rejection
+                    results.append({"email": email, "status": status.HTTP_403_FORBIDDEN,
+                                    "error": f"You cannot send a request to this user for another {cooldown_remaining.seconds // 3600} hours."})
+                    continue
+
+            result = {"email": email}
+            results.append(result)
+            candidates.append((result, receiver, forward))
+
+        # The same friend request rate limit as a single send, shared by the whole batch
+        limiter = SlidingWindowLimiter.for_scope('friend_request', user.role)
+        granted = limiter.take(user.id, len(candidates)) if limiter and candidates else len(candidates)
+
+        to_create, to_resend, written = [], {}, []
+        for index, (result, receiver, forward) in enumerate(candidates):
+            if index >= granted:
+                result.update(status=status.HTTP_429_TOO_MANY_REQUESTS,
+                              error=f"You can only send {limiter.limit} friend requests per {limiter.period_name}. Please try again later.")
+                continue
+            if forward is not None:
+                to_resend[forward['id']] = receiver.id
+            else:
+                to_create.append(FriendRequest(sender_id=user.id, receiver_id=receiver.id))
+            written.append((result, receiver))
+
+        # Write every accepted item at once. A concurrent send of the same pair is absorbed by the
+        # unique (sender, receiver) constraint or by the status check of the resend, the rows written
+        # here are the ones that carry this request's created_at.
+        created_at = {}
+        if written:
+            with transaction.atomic():
+                if to_create:
+                    FriendRequest.objects.bulk_create(to_create, ignore_conflicts=True)
+                    # created_at is set on the instances, skipped conflicts included
+                    created_at.update((friend_request.receiver_id, friend_request.created_at) for friend_request in to_create)
+                if to_resend:
+                    FriendRequest.objects.filter(pk__in=list(to_resend), status='rejected').update(
+                        status='pending', rejected_at=None, created_at=now
+                    )
+                    created_at.update((receiver_id, now) for receiver_id in to_resend.values())
+                stored = dict(FriendRequest.objects.filter(
+                    sender_id=user.id, receiver_id__in=list(created_at)
+                ).values_list('receiver_id', 'created_at'))
+
+        sent = []
+        for result, receiver in written:
+            if stored.get(receiver.id) == created_at[receiver.id]:
+                result.update(status=status.HTTP_201_CREATED, message="Friend request sent.")
+                sent.append(receiver.email)
+            else:
+                result.update(status=status.HTTP_400_BAD_REQUEST, error="Friend request already sent.")
+        if limiter and len(sent) < len(written):
+            # Nothing was sent for these, hand their rate limit units back
+            limiter.refund(user.id, len(written) - len(sent))
+        if sent:
+            invalidate(*[pending_requests_namespace(receivers[email].id) for email in sent])
+            log_activities([(user.id, f"Sent a friend request to {email}") for email in sent])
+
+        return Response({"message": f"{len(sent)} of {len(receiver_emails)} friend requests sent.", "results": results},
+                        status=status.HTTP_200_OK)
+
+
 # This api is for blocked the users.
 class BlockUserView(APIView):
     permission_classes = [IsAuthenticated, RoleBasedPermission]
@@ -214,27 +471,102 @@ class BlockUserView(APIView):
             blocked_user = CustomUser.objects.get(email=blocked_email)
 
             # Prevent self-blocking
-            if blocked_user == request.user:
+            if blocked_user.id == request.user.id:
                 return Response({"error": "You cannot block yourself."}, status=status.HTTP_400_BAD_REQUEST)
 
             # Check if the user is already blocked
-            if Block.objects.filter(blocker=request.user, blocked=blocked_user).exists():
+            if get_block_set(request.user.id).has_blocked(blocked_user.id):
                 return Response({"error": "User is already blocked."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Block the user
-            Block.objects.create(blocker=request.user, blocked=blocked_user)
+            # Block the user, the unique constraint catches a concurrent block of the same user
+            try:
+                with transaction.atomic():
+                    Block.objects.create(blocker_id=request.user.id, blocked=blocked_user)
+            except IntegrityError:
+                return Response({"error": "User is already blocked."}, status=status.HTTP_400_BAD_REQUEST)
+            invalidate_block_sets(request.user.id, blocked_user.id)
+
+            # Blocking also ends the friendship, if there was one
+            with transaction.atomic():
+                removed, _ = Friendship.objects.remove_pair(request.user.id, blocked_user.id)
+                if removed:
+                    FriendRequest.objects.filter(
+                        Q(sender_id=request.user.id, receiver=blocked_user) | Q(sender=blocked_user, receiver_id=request.user.id),
+                        status='accepted'
+                    ).delete()
+            if removed:
+                invalidate(friends_list_namespace(request.user.id), friends_list_namespace(blocked_user.id))
+                on_friendship_removed(request.user.id, blocked_user.id)
 
             # Log the activity
-            UserActivityLog.objects.create(
-                user=request.user,
-                activity=f"You have blocked this {blocked_email}"
-            )
+            log_activity(request.user.id, f"You have blocked this {blocked_email}")
             return Response({"message": "User blocked successfully."}, status=status.HTTP_201_CREATED)
 
         except CustomUser.DoesNotExist:
             return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
 
 
+# This api is for blocking a list of users at once.
+class BulkBlockUserView(APIView):
+    permission_classes = [IsAuthenticated, RoleBasedPermission]
+    throttle_classes = [*APIView.throttle_classes, SlidingWindowThrottle]
+    throttle_scope = 'bulk'
+    throttle_cost = 10
+
+    def post(self, request):
+        blocked_emails, error = parse_email_list(request.data, 'blocked_emails')
+        if error:
+            return error
+        user = request.user
+
+        blocked_users = {
+            blocked_user.email: blocked_user
+            for blocked_user in CustomUser.objects.filter(email__in=blocked_emails).only('id', 'email')
+        }
+        block_set = get_block_set(user.id)
+
+        results = []
+        to_block = []
+        for email in blocked_emails:
+            blocked_user = blocked_users.get(email)
+            if blocked_user is None:
+                results.append({"email": email, "status": status.HTTP_404_NOT_FOUND, "error": "User not found."})
+            elif blocked_user.id == user.id:
+                results.append({"email": email, "status": status.HTTP_400_BAD_REQUEST, "error": "You cannot block yourself."})
+            elif block_set.has_blocked(blocked_user.id):
+                results.append({"email": email, "status": status.HTTP_400_BAD_REQUEST, "error": "User is already blocked."})
+            else:
+                to_block.append(blocked_user.id)
+                results.append({"email": email, "status": status.HTTP_201_CREATED, "message": "User blocked successfully."})
+
+        if to_block:
+            with transaction.atomic():
+                Block.objects.bulk_create([Block(blocker_id=user.id, blocked_id=blocked_id) for blocked_id in to_block], ignore_conflicts=True)
+
+                # Blocking also ends the friendships, if there were any
+                unfriended = list(Friendship.objects.filter(user_id=user.id, friend_id__in=to_block).values_list('friend_id', flat=True))
+                if unfriended:
+                    Friendship.objects.filter(
+                        Q(user_id=user.id, friend_id__in=unfriended) | Q(user_id__in=unfriended, friend_id=user.id)
+                    ).delete()
+                    FriendRequest.objects.filter(
+                        Q(sender_id=user.id, receiver_id__in=unfriended) | Q(sender_id__in=unfriended, receiver_id=user.id),
+                        status='accepted'
+                    ).delete()
+            invalidate_block_sets(user.id, *to_block)
+            if unfriended:
+                invalidate(friends_list_namespace(user.id), *[friends_list_namespace(friend_id) for friend_id in unfriended])
+                on_friendship_removed(user.id, *unfriended)
+
+            log_activities([
+                (user.id, f"You have blocked this {result['email']}")
+                for result in results if result['status'] == status.HTTP_201_CREATED
+            ])
+
+        return Response({"message": f"{len(to_block)} of {len(blocked_emails)} users blocked.", "results": results},
+                        status=status.HTTP_200_OK)
+
+
 # This api is for unblock the user who has been blocked by you.
 class UnblockUserView(APIView):
     permission_classes = [IsAuthenticated, RoleBasedPermission]
@@ -245,49 +577,73 @@ class UnblockUserView(APIView):
         try:
             blocked_user = CustomUser.objects.get(email=blocked_email)
 
-            # Check if the user is blocked
-            block_entry = Block.objects.filter(blocker=request.user, blocked=blocked_user).first()
-            if not block_entry:
+            # Unblock the user, nothing deleted means the user was not blocked
+            deleted, _ = Block.objects.filter(blocker_id=request.user.id, blocked=blocked_user).delete()
+            if not deleted:
                 return Response({"error": "User is not blocked."}, status=status.HTTP_400_BAD_REQUEST)
+            invalidate_block_sets(request.user.id, blocked_user.id)
 
-            # Unblock the user
-            block_entry.delete()
             # Log the activity
-            UserActivityLog.objects.create(
-                user=request.user,
-                activity=f"You have unblocked this {blocked_email}"
-            )
+            log_activity(request.user.id, f"You have unblocked this {blocked_email}")
             return Response({"message": "User unblocked successfully."}, status=status.HTTP_200_OK)
 
         except CustomUser.DoesNotExist:
             return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
 
 
+# This api is for removing a user from your friend list.
+class UnfriendView(APIView):
+    permission_classes = [IsAuthenticated, RoleBasedPermission]
+
+    def post(self, request):
+        friend_email = request.data.get('friend_email')
+
+        try:
+            friend = CustomUser.objects.get(email=friend_email)
+
+            with transaction.atomic():
+                removed, _ = Friendship.objects.remove_pair(request.user.id, friend.id)
+                # Drop the accepted request as well so that either side can send a new one later
+                if removed:
+                    FriendRequest.objects.filter(
+                        Q(sender_id=request.user.id, receiver=friend) | Q(sender=friend, receiver_id=request.user.id),
+                        status='accepted'
+                    ).delete()
+            if not removed:
+                return Response({"error": "This user is not in your friend list."}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Log the activity
+            log_activity(request.user.id, f"You have unfriended {friend_email}")
+            # Invalidate cache for both users
+            invalidate(friends_list_namespace(request.user.id), friends_list_namespace(friend.id))
+            on_friendship_removed(request.user.id, friend.id)
+            return Response({"message": "Friend removed successfully."}, status=status.HTTP_200_OK)
+
+        except CustomUser.DoesNotExist:
+            return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
 # This api is for showing the friend list.
 class FriendsListAPI(APIView):
     permission_classes = [IsAuthenticated, RoleBasedPermission]
     
     def get(self, request):
         user = request.user
-        cache_key = f"friends_list_{user.id}"
         
-        # Try fetching friends list from the cache
-        friends_list = cache.get(cache_key)
+        # Try fetching friends list from the shared cache
+        friends_list = get_cached(friends_list_namespace(user.id), 'friends')
         
-        if not friends_list:
-            # If not in cache, query the database
-            accepted_friend_requests = FriendRequest.objects.filter(
-                Q(sender=user, status='accepted') | Q(receiver=user, status='accepted')
-            ).select_related('sender', 'receiver')
-            
-            # Get list of friends from the accepted requests
-            friends_list = [
-                request.receiver.email if request.sender == user else request.sender.email
-                for request in accepted_friend_requests
-            ]
+        if friends_list is None:
+            # If not in cache, read the user's friendship edges (single index range read),
+            # leaving out anyone on either side of a block
+            friendships = Friendship.objects.filter(user_id=user.id)
+            block_set = get_block_set(user.id)
+            if block_set:
+                friendships = friendships.exclude(friend_id__in=block_set.excluded_ids())
+            friends_list = list(friendships.values_list('friend__email', flat=True))
             
             # Save the friends list to cache
-            cache.set(cache_key, friends_list, settings.CACHE_TIMEOUT)
+            set_cached(friends_list_namespace(user.id), 'friends', friends_list, settings.CACHE_TIMEOUT)
         
         return Response({"message":"Successfully fetched","friends": friends_list}, status=status.HTTP_200_OK)
 
@@ -299,26 +655,37 @@ class PendingFriendRequestsAPI(APIView):
 
     def get(self, request):
         user = request.user
+
+        # Mobile clients poll this a lot, so every page is cached until the inbox changes
+        namespace = pending_requests_namespace(user.id)
+        cache_key = query_key(request)
+        cached_page = get_cached(namespace, cache_key)
+        if cached_page is not None:
+            return Response(cached_page, status=status.HTTP_200_OK)
         
-        # Fetch pending friend requests where the receiver is the user
-        pending_requests = FriendRequest.objects.filter(receiver=user, status='pending').order_by('-created_at')
+        # Fetch pending friend requests where the receiver is the user, as plain rows (no model instances, no sender join)
+        pending_requests = FriendRequest.objects.filter(receiver_id=user.id, status='pending').order_by('-created_at').values(
+            'id', 'created_at', 'sender_id', 'status'
+        )
 
-        # Pagination
-        paginator = UserPagination()
+        # Pagination, page numbers by default or a (created_at, id) cursor when the client asks for it
+        paginator = get_paginator(request)
         paginated_requests = paginator.paginate_queryset(pending_requests, request)
 
         # Prepare the response data
         response_data = [
             {
-                "request_id": request.id,
-                "created_at": request.created_at,
+                "request_id": request['id'],
+                "created_at": request['created_at'],
                 # Only include the sender's ID and status, not sensitive info like email
-                "sender_id": request.sender.id,
-                "status": request.status
+                "sender_id": request['sender_id'],
+                "status": request['status']
             }
             for request in paginated_requests
         ]
-        return paginator.get_paginated_response(response_data)
+        response = paginator.get_paginated_response(response_data)
+        set_cached(namespace, cache_key, response.data, settings.CACHE_TIMEOUT)
+        return response
 
 
 # This api is for showing the user activity.
@@ -327,21 +694,132 @@ class UserActivityLogAPI(APIView):
 
     def get(self, request):
         user = request.user
-        # # Caching mechanism (optional) - we can perform the cache also there to make the performance better
-        # cache_key = f"user_activity_log_{user.id}"
-        # cached_activities = cache.get(cache_key)
-        # if cached_activities is not None:
-        #     return Response({"activities": cached_activities}, status=status.HTTP_200_OK)
-
-        # Retrieve activity logs with related user details
-        activity_logs = UserActivityLog.objects.filter(user=user).select_related('user').order_by('-created_at')
+        # Bounded by the retention window, so only the live monthly partitions are scanned
+        activity_logs = UserActivityLog.objects.filter(user_id=user.id, created_at__gte=retention_cutoff())
+
+        # Optional date range, ?since= and ?until= accept a date or a datetime
+        try:
+            activity_logs = self.filter_date_range(activity_logs, request)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Streaming export of the whole (filtered) history
+        if request.query_params.get('export') == 'jsonl':
+            return self.export_jsonl(activity_logs, user)
+
+        # Pagination, page numbers by default or a (created_at, id) cursor when the client asks for it
+        paginator = get_paginator(request)
+        paginated_logs = paginator.paginate_queryset(activity_logs.order_by('-created_at', '-id').values('id', 'activity', 'created_at'), request)
+
+        user_email = user.email
         activity_data = [
             {
-                "activity": log.activity,
-                "created_at": log.created_at,
-                "user_email": log.user.email 
+                "activity": log['activity'],
+                "created_at": log['created_at'],
+                "user_email": user_email
             }
-            for log in activity_logs
+            for log in paginated_logs
         ]
-        # cache.set(cache_key, activity_data, settings.CACHE_TIMEOUT)
-        return Response({"message":"Successfully fetched user activity", "activities": activity_data}, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(activity_data)
+
+    def filter_date_range(self, activity_logs, request):
+        since = request.query_params.get('since')
+        until = request.query_params.get('until')
+        if since:
+            bound, _ = self.parse_bound(since, 'since')
+            activity_logs = activity_logs.filter(created_at__gte=bound)
+        if until:
+            # A plain date includes the whole day
+            bound, whole_day = self.parse_bound(until, 'until')
+            if whole_day:
+                bound += timedelta(days=1)
+            activity_logs = activity_logs.filter(created_at__lt=bound)
+        return activity_logs
+
+    def parse_bound(self, value, name):
+        # Returns the bound and whether it was a plain date. The date is tried first,
+        # parse_datetime() also accepts a plain date (as midnight) on recent Pythons.
+        try:
+            parsed_date = parse_date(value)
+            if parsed_date is not None:
+                parsed = datetime.combine(parsed_date, datetime.min.time())
+            else:
+                parsed = parse_datetime(value)
+                if parsed is None:
+                    raise ValueError
+        except ValueError:
+            raise ValueError(f"Invalid '{name}' value, use an ISO date or datetime.")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed, parsed_date is not None
+
+    def export_jsonl(self, activity_logs, user):
+        # .iterator() reads through a server-side cursor in chunks, so memory stays flat for any history size
+        rows = activity_logs.order_by('-created_at', '-id').values_list('activity', 'created_at').iterator(chunk_size=2000)
+
+        def lines():
+            for activity, created_at in rows:
+                yield json.dumps({
+                    "activity": activity,
+                    "created_at": created_at.isoformat(),
+                    "user_email": user.email
+                }) + "\n"
+
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="user-activity.jsonl"'
+        return response
+
+
+# This api is for showing the people you may know, ranked by mutual friends.
+class FriendSuggestionsAPI(APIView):
+    permission_classes = [IsAuthenticated, RoleBasedPermission]
+
+    def get(self, request):
+        user = request.user
+
+        # Suggestions are precomputed, this is one index range read on (user, mutual_count)
+        suggestions = FriendSuggestion.objects.filter(user_id=user.id)
+        block_set = get_block_set(user.id)
+        if block_set:
+            suggestions = suggestions.exclude(suggested_id__in=block_set.excluded_ids())
+
+        suggestion_data = [
+            {
+                "user_id": suggestion['suggested_id'],
+                "email": suggestion['suggested__email'],
+                "mutual_friends": suggestion['mutual_count']
+            }
+            for suggestion in suggestions.order_by('-mutual_count', 'suggested_id').values(
+                'suggested_id', 'suggested__email', 'mutual_count'
+            )[:settings.SUGGESTIONS_LIMIT]
+        ]
+        return Response({"message": "Successfully fetched", "suggestions": suggestion_data}, status=status.HTTP_200_OK)
+
+
+# This api is for showing the mutual friends you share with another user.
+class MutualFriendsAPI(APIView):
+    permission_classes = [IsAuthenticated, RoleBasedPermission]
+
+    def get(self, request, user_id):
+        # Users on either side of a block are hidden, as the other user and in the mutual friends
+        block_set = get_block_set(request.user.id)
+        if user_id in block_set:
+            return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        mutual_ids = [friend_id for friend_id in mutual_friend_ids(request.user.id, user_id) if friend_id not in block_set]
+        mutual_emails = list(
+            CustomUser.objects.filter(id__in=mutual_ids[:settings.SUGGESTIONS_LIMIT]).order_by('id').values_list('email', flat=True)
+        ) if mutual_ids else []
+        return Response({
+            "message": "Successfully fetched",
+            "mutual_count": len(mutual_ids),
+            "mutual_friends": mutual_emails
+        }, status=status.HTTP_200_OK)
+
+
+# This api is for the Prometheus scraper, the per-view request metrics in the text format.
+# With METRICS_TOKEN set the scraper has to send it as a bearer token.
+@require_GET
+def metrics_view(request):
+    if settings.METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(process_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
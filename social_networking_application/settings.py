@@ -14,6 +14,7 @@ from pathlib import Path
 import os
 from dotenv import load_dotenv
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -40,12 +41,15 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'social',
 ]
 
 MIDDLEWARE = [
+    'social.middleware.QueryMetricsMiddleware',
+    'social.middleware.PrimaryReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +90,25 @@ WSGI_APPLICATION = 'social_networking_application.wsgi.application'
 #     }
 # }
 
+# Connection management, DB_CONNECTION_MODE is one of:
+#   persistent  connections stay open for DB_CONN_MAX_AGE seconds and are reused across requests (default)
+#   pool        psycopg's connection pool (needs psycopg 3 and its pool extra instead of psycopg2)
+#   none        a new connection per request
+DB_CONNECTION_MODE = os.getenv('DB_CONNECTION_MODE', 'persistent')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60')) if DB_CONNECTION_MODE == 'persistent' else 0
+DB_OPTIONS = {}
+if DB_CONNECTION_MODE == 'pool':
+    try:
+        import psycopg  # noqa: F401
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        raise ImproperlyConfigured("DB_CONNECTION_MODE=pool needs psycopg 3 with its pool extra: pip install 'psycopg[binary,pool]'.")
+    DB_OPTIONS['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    }
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -94,13 +117,51 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        # Checks a reused connection before the request uses it, so a dropped connection is replaced
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true',
+        'OPTIONS': DB_OPTIONS,
     }
 }
 
+# Optional read replicas (comma separated hosts). Safe requests read from them, writes and the
+# reads of a user who just wrote stay on the primary for DB_REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+for index, replica_host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host.strip(),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'OPTIONS': {**DB_OPTIONS},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+DATABASE_ROUTERS = ['social.routers.PrimaryReplicaRouter']
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', '5'))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'social.authentication.StatelessJWTAuthentication',
+    ),
+    # orjson when it is installed, DRF's JSONRenderer otherwise
+    'DEFAULT_RENDERER_CLASSES': (
+        'social.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
+    # Every endpoint is throttled per user (by role) and per IP. A request costs the view's
+    # throttle_cost units, so the search (5) uses up the budget faster than a list read (1).
+    'DEFAULT_THROTTLE_CLASSES': (
+        'social.throttling.UserRoleRateThrottle',
+        'social.throttling.IPRateThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'user': '300/min',
+        'user.read': '120/min',
+        'user.write': '300/min',
+        'user.admin': '600/min',
+        'ip': '1200/min',
+        'anon': '60/min',
+    },
 }
 
 
@@ -130,6 +191,28 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing. PASSWORD_HASHER picks the hasher for new and updated passwords (pbkdf2, argon2,
+# bcrypt or scrypt, argon2 needs argon2-cffi and bcrypt needs bcrypt). The others stay listed so
+# existing hashes keep working, and they are rehashed with the preferred hasher on the next login.
+PASSWORD_HASHER_CLASSES = {
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'bcrypt': 'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+}
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+AUTHENTICATION_BACKENDS = ['social.backends.EmailBackend']
+
+# Lifetime of the cached user fields behind the token-only request.user, they are also dropped when they are saved
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# How long an unknown login email is remembered, so repeated attempts fail without a hash or a query
+LOGIN_NEGATIVE_CACHE_TIMEOUT = 60 * 10
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -158,4 +241,87 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 COOLDOWN_PERIOD = timedelta(hours=24)
 
 # To set the cache timeline
-CACHE_TIMEOUT = 60 * 5 
+CACHE_TIMEOUT = 60 * 5
+
+# Lifetime of the cached per-user block sets, they are also invalidated on every block and unblock.
+# Only used with CACHE_SHARED, a per-process cache could not see the invalidations of other workers
+BLOCK_CACHE_TIMEOUT = 60 * 60
+
+# Sliding-window rate limits per scope, counted in the cache. A role can override the default rate,
+# e.g. 'friend_request': {'default': '3/min', 'read': '1/min'}, and None disables the limit.
+RATE_LIMITS = {
+    'friend_request': {'default': '3/min'},
+    'bulk': {'default': '10/min'},
+    'login': {'default': '5/min'},
+}
+
+# Maximum number of emails accepted by the bulk friend request and bulk block endpoints
+BULK_MAX_ITEMS = 100
+
+# Number of friend suggestions kept per user
+SUGGESTIONS_LIMIT = 20
+# Rebuild the suggestions of users whose friendships changed from a background thread, after
+# SUGGESTIONS_REFRESH_DELAY seconds so that a burst of changes is one rebuild (false rebuilds them inline)
+SUGGESTIONS_ASYNC = os.getenv('SUGGESTIONS_ASYNC', 'true').lower() == 'true'
+SUGGESTIONS_REFRESH_DELAY = 0.5
+
+# Typeahead (prefix) search: minimum prefix length, result limit and per-prefix cache lifetime in seconds
+TYPEAHEAD_MIN_LENGTH = 3
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_CACHE_TIMEOUT = 30
+
+# Serve the read endpoints (search, friend list, pending requests, activity) with their native async views.
+# asgi.py turns this on, under WSGI the synchronous views are used.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'false').lower() == 'true'
+
+# Cache backend, selected by the environment. LocMem is per process, so use a shared backend
+# (redis, memcached or file) whenever more than one worker is running.
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+CACHE_DEFAULT_LOCATIONS = {
+    'locmem': 'social',
+    'file': '/var/tmp/social_networking_cache',
+    'redis': 'redis://127.0.0.1:6379/1',
+    'memcached': '127.0.0.1:11211',
+}
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+# Whether every worker sees the same cache. Token revocation (social.authentication) and read-replica
+# pinning keep their markers in the cache and need it shared. Only set it to true with locmem for a
+# single process, e.g. runserver.
+CACHE_SHARED = (os.getenv('CACHE_SHARED') or str(CACHE_BACKEND != 'locmem')).lower() == 'true'
+if DATABASE_REPLICAS and not CACHE_SHARED:
+    # A write pins its user to the primary in the cache, the other workers have to see the pin
+    raise ImproperlyConfigured("DB_REPLICA_HOSTS needs a cache shared by all workers, set CACHE_BACKEND to redis, memcached or file.")
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.getenv('CACHE_LOCATION') or CACHE_DEFAULT_LOCATIONS[CACHE_BACKEND],
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'social'),
+        'TIMEOUT': CACHE_TIMEOUT,
+    }
+}
+
+# Activity log writer. When async, entries are queued and written in batches by a background thread
+# once ACTIVITY_LOG_BATCH_SIZE entries are queued or ACTIVITY_LOG_FLUSH_INTERVAL seconds have passed.
+ACTIVITY_LOG_ASYNC = os.getenv('ACTIVITY_LOG_ASYNC', 'true').lower() == 'true'
+ACTIVITY_LOG_BATCH_SIZE = 500
+ACTIVITY_LOG_FLUSH_INTERVAL = 1.0
+ACTIVITY_LOG_QUEUE_SIZE = 10000
+# How long a request waits on a full queue before writing its entry itself
+ACTIVITY_LOG_PUT_TIMEOUT = 0.05
+
+# Activity log partitions: months kept before a partition is dropped or archived,
+# and how many months of partitions are created in advance
+ACTIVITY_LOG_RETENTION_MONTHS = int(os.getenv('ACTIVITY_LOG_RETENTION_MONTHS', 12))
+ACTIVITY_LOG_PARTITIONS_AHEAD = 3
+
+# Request metrics (social.middleware.QueryMetricsMiddleware): per-request numbers as X-DB-Queries,
+# X-DB-Time-Ms, X-Cache-Hits, X-Cache-Misses and X-Response-Time-Ms headers, and the totals per view at /metrics
+QUERY_METRICS_HEADERS = os.getenv('QUERY_METRICS_HEADERS', str(DEBUG)).lower() == 'true'
+# Bearer token the Prometheus scraper sends to /metrics, empty leaves the endpoint open (keep it off the public network)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')